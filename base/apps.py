@@ -4,3 +4,19 @@ from django.apps import AppConfig
 class BaseConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'base'
+
+    def ready(self):
+        # Registra los receptores de señales
+        from . import (  # noqa: F401
+            audit,
+            autocomplete,
+            geography,
+            search,
+            signals,
+            snapshot,
+            thumbnails,
+            uploads,
+        )
+
+        # Entradas de auditoría en lote, ver AUDITLOG_BUFFER_MODE
+        audit.install()
@@ -0,0 +1,184 @@
+import atexit
+import logging
+import queue
+import threading
+from contextvars import ContextVar
+
+from auditlog.middleware import AuditlogMiddleware
+from auditlog.models import LogEntry, LogEntryManager
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Petición y entradas confirmadas del contexto actual
+audit_request = ContextVar('audit_request', default=None)
+audit_entries = ContextVar('audit_entries', default=None)
+
+
+class BufferedLogEntryManager(LogEntryManager):
+    """!
+    Clase del manager de LogEntry que, durante una petición con buffer,
+    guarda las entradas en memoria en lugar de insertarlas una por una
+
+    Cada entrada pasa a la lista de la petición al confirmar la transacción
+    en la que se generó, por lo que las entradas de una transacción revertida
+    se descartan igual que sin buffer
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def create(self, **kwargs):
+        entries = audit_entries.get()
+        if entries is None:
+            return super().create(**kwargs)
+        entry = self.model(**kwargs)
+        request = audit_request.get()
+        # El usuario de DRF se asigna a la petición al autenticar, después de
+        # que el middleware de auditlog leyera el usuario de la sesión
+        user = getattr(request, 'user', None)
+        if entry.actor_id is None and user is not None and user.is_authenticated:
+            entry.actor_id = user.pk
+        if entry.remote_addr is None and request is not None:
+            entry.remote_addr = AuditlogMiddleware._get_remote_addr(request)
+        transaction.on_commit(lambda: entries.append(entry), using=self.db)
+        return entry
+
+
+class AuditWriter:
+    """!
+    Clase que inserta las entradas de auditoría en un hilo del proceso, para
+    sacar la escritura del camino de la petición
+
+    Si la cola está llena las entradas se insertan en la petición. Las
+    entradas aún en cola se pierden si el proceso termina de forma abrupta
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self):
+        self.queue = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None:
+                self.queue = queue.Queue(
+                    getattr(settings, 'AUDITLOG_BUFFER_QUEUE', 10000)
+                )
+                self.thread = threading.Thread(
+                    target=self.run, name='audit-writer', daemon=True
+                )
+                self.thread.start()
+                atexit.register(self.stop)
+
+    def put(self, entries):
+        if self.thread is None:
+            self.start()
+        try:
+            self.queue.put_nowait(entries)
+        except queue.Full:
+            write(entries)
+
+    def run(self):
+        batch_size = getattr(settings, 'AUDITLOG_BUFFER_BATCH_SIZE', 500)
+        while True:
+            entries = self.queue.get()
+            if entries is None:
+                return
+            # Junta los lotes de varias peticiones en una inserción
+            while len(entries) < batch_size:
+                try:
+                    more = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    self.queue.put(None)
+                    break
+                entries += more
+            close_old_connections()
+            try:
+                write(entries)
+            except Exception:
+                logger.exception(
+                    'No se guardaron %s entradas de auditoría', len(entries)
+                )
+
+    def stop(self):
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join(timeout=10)
+
+
+# Hilo de escritura compartido por el proceso
+writer = AuditWriter()
+
+
+def write(entries):
+    LogEntry.objects.bulk_create(
+        entries, batch_size=getattr(settings, 'AUDITLOG_BUFFER_BATCH_SIZE', 500)
+    )
+
+
+class AuditBufferMiddleware(AuditlogMiddleware):
+    """!
+    Clase del middleware de auditlog que junta las entradas de cada petición
+    y las inserta con un solo bulk_create al terminar
+
+    AUDITLOG_BUFFER_MODE indica cuándo se escriben: 'request' al final de la
+    petición, 'background' en el hilo del proceso y None sin buffer, igual
+    que AuditlogMiddleware
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __call__(self, request):
+        mode = getattr(settings, 'AUDITLOG_BUFFER_MODE', 'request')
+        if mode is None:
+            return super().__call__(request)
+        entries = []
+        request_token = audit_request.set(request)
+        entries_token = audit_entries.set(entries)
+        try:
+            return super().__call__(request)
+        finally:
+            audit_entries.reset(entries_token)
+            audit_request.reset(request_token)
+            if entries:
+                if mode == 'background':
+                    writer.put(entries)
+                else:
+                    write(entries)
+
+
+def install():
+    """!
+    Función que registra BufferedLogEntryManager como LogEntry.objects
+
+    auditlog crea las entradas con LogEntry.objects.log_create y no permite
+    configurar el manager, por lo que se quita el manager original de
+    LogEntry y se agrega este con add_to_class, como si estuviera declarado
+    en el modelo. Se llama una vez desde BaseConfig.ready(); fuera de una
+    petición con buffer el manager se comporta igual que el original
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if isinstance(LogEntry.objects, BufferedLogEntryManager):
+        return
+    meta = LogEntry._meta
+    meta.local_managers = [
+        manager for manager in meta.local_managers if manager.name != 'objects'
+    ]
+    LogEntry.add_to_class('objects', BufferedLogEntryManager())
+    # managers y default_manager se calculan de nuevo con el manager nuevo
+    meta._expire_cache()
@@ -0,0 +1,175 @@
+import bisect
+import threading
+import unicodedata
+
+from django.dispatch import receiver
+
+from .geography import get_versions
+from .models import (
+    City,
+    Municipality,
+    Parish,
+)
+from .signals import geography_changed
+
+
+def normalize(text):
+    """!
+    Función que quita acentos y mayúsculas para comparar nombres
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    return ''.join(
+        char for char in unicodedata.normalize('NFKD', text)
+        if not unicodedata.combining(char)
+    ).casefold()
+
+
+def get_keys(name):
+    """!
+    Función que devuelve las claves de un nombre: el nombre completo y el
+    resto del nombre desde cada palabra, para que "ju" encuentre "San Juan"
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    words = normalize(name).split()
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class PrefixIndex:
+    """!
+    Clase que guarda en memoria los nombres de un modelo geográfico en
+    listas ordenadas, una por padre y una global, para buscar por prefijo
+    con búsqueda binaria
+
+    Los cambios hechos en el proceso se aplican de forma incremental; si la
+    versión del modelo cambió en otro proceso el índice se reconstruye. Las
+    listas nunca se modifican: cada cambio arma copias y las reemplaza de una
+    vez, para que search() no necesite bloqueo
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self, model, parent):
+        self.model = model
+        self.parent = parent
+        self.version = None
+        # Filas por id y listas ordenadas por padre, reemplazadas juntas
+        self.state = ({}, {})
+        # Evita que dos cambios simultáneos partan del mismo estado
+        self.lock = threading.Lock()
+
+    def build(self):
+        """!
+        Método que arma el índice completo con una consulta
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        version, = get_versions(self.model)
+        rows = {
+            pk: (name, parent_id)
+            for pk, name, parent_id in self.model.objects.values_list(
+                'pk', 'name', '%s_id' % self.parent
+            )
+        }
+        entries = {None: []}
+        for pk, (name, parent_id) in rows.items():
+            for key in get_keys(name):
+                entries[None].append((key, pk))
+                entries.setdefault(parent_id, []).append((key, pk))
+        for values in entries.values():
+            values.sort()
+        with self.lock:
+            self.state, self.version = (rows, entries), version
+
+    def add(self, rows, entries, pk, name, parent_id):
+        rows[pk] = (name, parent_id)
+        keys = [(key, pk) for key in get_keys(name)]
+        for group in (None, parent_id):
+            # sorted es lineal sobre una lista casi ordenada
+            entries[group] = sorted(entries.get(group, []) + keys)
+
+    def remove(self, rows, entries, pk):
+        name, parent_id = rows.pop(pk)
+        for group in (None, parent_id):
+            entries[group] = [
+                entry for entry in entries[group] if entry[1] != pk
+            ]
+
+    def update(self, pk):
+        """!
+        Método que aplica el cambio de una fila consultando su estado actual
+        sobre copias de las listas afectadas
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        if self.version is None:
+            return
+        row = self.model.objects.filter(pk=pk).values_list(
+            'name', '%s_id' % self.parent
+        ).first()
+        with self.lock:
+            rows, entries = (dict(values) for values in self.state)
+            if pk in rows:
+                self.remove(rows, entries, pk)
+            if row is not None:
+                self.add(rows, entries, pk, *row)
+            self.state = rows, entries
+            self.version, = get_versions(self.model)
+
+    def search(self, prefix, parent_id=None, limit=10):
+        """!
+        Método que devuelve hasta limit filas (id, nombre, id del padre)
+        cuyo nombre, o alguna de sus palabras, empieza por prefix
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        if [self.version] != get_versions(self.model):
+            self.build()
+        prefix = ' '.join(normalize(prefix).split())
+        rows, entries = self.state
+        values = entries.get(parent_id, [])
+        results = []
+        i = bisect.bisect_left(values, (prefix,))
+        while i < len(values) and len(results) < limit:
+            key, pk = values[i]
+            if not key.startswith(prefix):
+                break
+            if pk not in results:
+                results.append(pk)
+            i += 1
+        return [(pk, *rows[pk]) for pk in results]
+
+
+# Índices del proceso por modelo
+indexes = {
+    Municipality: PrefixIndex(Municipality, 'state'),
+    City: PrefixIndex(City, 'state'),
+    Parish: PrefixIndex(Parish, 'municipality'),
+}
+
+
+@receiver(geography_changed)
+def autocomplete_update(sender, pk=None, **kwargs):
+    """!
+    Función que actualiza el índice del modelo geográfico modificado
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    index = indexes.get(sender)
+    if index is not None and pk is not None:
+        index.update(pk)
@@ -0,0 +1,150 @@
+import gzip
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.dispatch import receiver
+
+from .models import (
+    City,
+    Country,
+    Municipality,
+    Parish,
+    State,
+)
+from .signals import GEOGRAPHY_MODELS, geography_changed
+
+# Segundos que se conserva un árbol en caché
+TREE_TIMEOUT = 60 * 60 * 24
+
+
+def version_key(model):
+    return 'base:version:%s' % model._meta.label_lower
+
+
+def get_versions(*models):
+    """!
+    Función que devuelve la versión de los datos de cada modelo con una sola
+    lectura de la caché
+
+    La versión es el instante del último cambio en milisegundos, por lo que
+    también sirve como Last-Modified. Si la clave no existe se crea con la
+    hora actual, así una caché vacía nunca repite una versión anterior
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return list con la versión de cada modelo en el mismo orden
+    """
+
+    keys = [version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        now = int(time.time() * 1000)
+        for key in missing:
+            cache.add(key, now, None)
+        versions.update(cache.get_many(missing))
+    return [versions[key] for key in keys]
+
+
+@receiver(geography_changed)
+def bump_version(sender, **kwargs):
+    """!
+    Función que cambia la versión del modelo geográfico modificado
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    version, = get_versions(sender)
+    cache.set(
+        version_key(sender), max(int(time.time() * 1000), version + 1), None
+    )
+
+
+def build_tree():
+    """!
+    Función que arma el árbol completo con una consulta por modelo
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return list con los países y sus estados, municipios, parroquias y
+        ciudades
+    """
+
+    countries = {
+        pk: {'pk': pk, 'name': name, 'states': []}
+        for pk, name in Country.objects.order_by('name').values_list('pk', 'name')
+    }
+    states = {}
+    for pk, name, country_id in State.objects.order_by('name').values_list(
+        'pk', 'name', 'country_id'
+    ):
+        states[pk] = {
+            'pk': pk, 'name': name, 'municipalities': [], 'cities': [],
+        }
+        countries[country_id]['states'].append(states[pk])
+    municipalities = {}
+    for pk, name, state_id in Municipality.objects.order_by('name').values_list(
+        'pk', 'name', 'state_id'
+    ):
+        municipalities[pk] = {'pk': pk, 'name': name, 'parishes': []}
+        states[state_id]['municipalities'].append(municipalities[pk])
+    for pk, name, state_id in City.objects.order_by('name').values_list(
+        'pk', 'name', 'state_id'
+    ):
+        states[state_id]['cities'].append({'pk': pk, 'name': name})
+    for pk, name, municipality_id in Parish.objects.order_by('name').values_list(
+        'pk', 'name', 'municipality_id'
+    ):
+        municipalities[municipality_id]['parishes'].append(
+            {'pk': pk, 'name': name}
+        )
+    return list(countries.values())
+
+
+def get_tree(country=None, state=None):
+    """!
+    Función que devuelve el árbol, o el subárbol de un país o estado, ya
+    serializado y comprimido junto con su ETag
+
+    Solo se consulta la base de datos cuando el árbol no está en caché para
+    la versión actual
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @param country <b>{int}</b> Id del país del subárbol
+    @param state <b>{int}</b> Id del estado del subárbol
+    @return dict con etag, body y gzip, o None si el país o estado no existe
+    """
+
+    key = 'base:geography:tree:%s:%s:%s' % (
+        '.'.join(map(str, get_versions(*GEOGRAPHY_MODELS))), country, state,
+    )
+    tree = cache.get(key)
+    if tree is not None:
+        return tree or None
+    data = build_tree()
+    if country is not None:
+        data = next((item for item in data if item['pk'] == country), None)
+    elif state is not None:
+        data = next((
+            item for country in data for item in country['states']
+            if item['pk'] == state
+        ), None)
+    if data is None:
+        tree = {}
+    else:
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+        tree = {
+            'etag': '"%s"' % hashlib.sha256(body).hexdigest(),
+            'body': body,
+            'gzip': gzip.compress(body),
+        }
+    cache.set(key, tree, TREE_TIMEOUT)
+    return tree or None
@@ -0,0 +1,63 @@
+import os
+import tempfile
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+
+# Este módulo no importa Django: lo cargan los procesos del pool de
+# derivadas, que se inician sin configurarlo
+
+
+def render(source, targets, quality):
+    """!
+    Función que genera las derivadas de una imagen. Se ejecuta en el pool de
+    procesos, que importan este módulo sin configurar Django, por lo que solo
+    recibe rutas
+
+    Las derivadas más nuevas que el original se omiten y cada una se escribe
+    en un archivo temporal que luego se renombra, para que nunca se sirva una
+    imagen a medias
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @param source <b>{str}</b> Ruta del original
+    @param targets <b>{list}</b> Tuplas (ruta, (ancho, alto), formato), con
+        formato None para usar el del original
+    @param quality <b>{int}</b> Calidad de JPEG y WebP
+    @return int con la cantidad de derivadas generadas
+    """
+
+    mtime = os.stat(source).st_mtime_ns
+    pending = [
+        target for target in targets
+        if not os.path.exists(target[0]) or os.stat(target[0]).st_mtime_ns < mtime
+    ]
+    if not pending:
+        return 0
+    with PILImage.open(source) as original:
+        original_format = original.format
+        # Los JPEG se decodifican reducidos, lo que ahorra memoria y tiempo
+        original.draft(None, (
+            max(size[0] for _, size, _ in pending),
+            max(size[1] for _, size, _ in pending),
+        ))
+        original = ImageOps.exif_transpose(original)
+        for path, size, image_format in pending:
+            image_format = image_format or original_format
+            image = original.copy()
+            image.thumbnail(size, PILImage.Resampling.LANCZOS)
+            if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            fd, temp = tempfile.mkstemp(
+                dir=os.path.dirname(path), prefix='.%s' % os.path.basename(path)
+            )
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    image.save(file, format=image_format, quality=quality)
+                os.chmod(temp, 0o644)
+                os.replace(temp, path)
+            except BaseException:
+                os.unlink(temp)
+                raise
+    return len(pending)
@@ -0,0 +1,210 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+from auditlog.models import LogEntry
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Max, Min
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+# Campos de LogEntry guardados en el archivo; content_type se guarda como
+# app_label y model para poder restaurarlo en otra base de datos
+FIELDS = (
+    'id', 'content_type__app_label', 'content_type__model', 'object_pk',
+    'object_id', 'object_repr', 'serialized_data', 'action', 'changes_text',
+    'changes', 'actor_id', 'cid', 'remote_addr', 'timestamp',
+    'additional_data',
+)
+
+
+class Command(BaseCommand):
+    """!
+    Comando que mueve las entradas de auditoría antiguas a archivos JSONL
+    comprimidos y las restaura para una investigación (--rehydrate)
+
+    Las entradas se leen por rangos de id, cada rango se escribe en su propio
+    archivo auditlog-<primer id>-<último id>.jsonl.gz, que no se modifica
+    después, y solo cuando el archivo está en disco se borran las filas en
+    lotes pequeños, cada uno en su propia transacción, para no bloquear la
+    tabla
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    help = 'Archiva y borra las entradas de auditoría antiguas, o las restaura'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=getattr(settings, 'AUDITLOG_RETENTION_DAYS', 180),
+            help='Días que se conservan en la tabla',
+        )
+        parser.add_argument(
+            '--dir',
+            default=getattr(settings, 'AUDITLOG_ARCHIVE_DIR', None),
+            help='Carpeta de los archivos',
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Entradas por archivo',
+        )
+        parser.add_argument(
+            '--delete-batch', type=int, default=1000,
+            help='Entradas borradas por transacción',
+        )
+        parser.add_argument(
+            '--rehydrate', action='store_true',
+            help='Restaura en la tabla las entradas entre --from-id y --to-id',
+        )
+        parser.add_argument('--from-id', type=int, default=0)
+        parser.add_argument('--to-id', type=int)
+
+    def handle(self, *args, **options):
+        if not options['dir']:
+            raise CommandError('Indique la carpeta con --dir o AUDITLOG_ARCHIVE_DIR')
+        directory = Path(options['dir'])
+        if options['rehydrate']:
+            self.rehydrate(directory, options['from_id'], options['to_id'])
+        else:
+            self.archive(directory, options)
+
+    def archive(self, directory, options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        bounds = LogEntry.objects.filter(
+            timestamp__lt=cutoff
+        ).aggregate(first=Min('pk'), last=Max('pk'))
+        if bounds['last'] is None:
+            self.stdout.write('No hay entradas para archivar')
+            return
+        directory.mkdir(parents=True, exist_ok=True)
+        archives = self.get_archives(directory)
+        total, start = 0, bounds['first'] - 1
+        while start < bounds['last']:
+            end = min(start + options['chunk_size'], bounds['last'])
+            rows = list(LogEntry.objects.filter(
+                pk__gt=start, pk__lte=end, timestamp__lt=cutoff
+            ).order_by('pk').values(*FIELDS))
+            if rows:
+                # Las entradas restauradas con --rehydrate ya están en un
+                # archivo, solo se borran
+                archived = self.get_archived_ids(
+                    archives, rows[0]['id'], rows[-1]['id']
+                )
+                pending = [row for row in rows if row['id'] not in archived]
+                if pending:
+                    archives.append(self.write(directory, pending))
+                ids = [row['id'] for row in rows]
+                for i in range(0, len(ids), options['delete_batch']):
+                    LogEntry.objects.filter(
+                        pk__in=ids[i:i + options['delete_batch']]
+                    ).delete()
+                total += len(pending)
+            start = end
+        self.stdout.write(self.style.SUCCESS(
+            '%s entradas archivadas en %s' % (total, directory)
+        ))
+
+    def get_archives(self, directory):
+        """!
+        Método que devuelve los archivos existentes con su rango de ids
+
+        @author William Páez (paez.william8 at gmail.com)
+        @return list de tuplas (primer id, último id, ruta)
+        """
+
+        archives = []
+        for path in sorted(directory.glob('auditlog-*.jsonl.gz')):
+            first, last = (int(value) for value in path.name[9:-9].split('-'))
+            archives.append((first, last, path))
+        return archives
+
+    def get_archived_ids(self, archives, first, last):
+        """!
+        Método que devuelve los ids entre first y last que ya están en algún
+        archivo. Solo se leen los archivos cuyo rango se superpone, lo que
+        normalmente ocurre después de restaurar entradas
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        ids = set()
+        for start, end, path in archives:
+            if end < first or start > last:
+                continue
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                ids.update(json.loads(line)['id'] for line in archive)
+        return ids
+
+    def write(self, directory, rows):
+        """!
+        Método que escribe un rango en un archivo nuevo de forma atómica
+
+        @author William Páez (paez.william8 at gmail.com)
+        @return tuple (primer id, último id, ruta) del archivo
+        """
+
+        path = directory / ('auditlog-%012d-%012d.jsonl.gz' % (
+            rows[0]['id'], rows[-1]['id']
+        ))
+        if path.exists():
+            raise CommandError('El archivo %s ya existe' % path)
+        fd, temp = tempfile.mkstemp(dir=directory, prefix=path.name)
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                with gzip.GzipFile(fileobj=file, mode='wb') as archive:
+                    for row in rows:
+                        # DjangoJSONEncoder recorta la fecha a milisegundos
+                        row = dict(row, timestamp=row['timestamp'].isoformat())
+                        archive.write(json.dumps(
+                            row, cls=DjangoJSONEncoder, ensure_ascii=False
+                        ).encode() + b'\n')
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+        return rows[0]['id'], rows[-1]['id'], path
+
+    def rehydrate(self, directory, from_id, to_id):
+        """!
+        Método que vuelve a insertar en la tabla las entradas archivadas del
+        rango de ids, conservando su id; las que ya existen se ignoran
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        to_id = to_id if to_id is not None else float('inf')
+        content_types = {}
+        total = 0
+        for first, last, path in self.get_archives(directory):
+            if last < from_id or first > to_id:
+                continue
+            entries = []
+            with gzip.open(path, 'rt', encoding='utf-8') as archive:
+                for line in archive:
+                    row = json.loads(line)
+                    if not from_id <= row['id'] <= to_id:
+                        continue
+                    key = (
+                        row.pop('content_type__app_label'),
+                        row.pop('content_type__model'),
+                    )
+                    if key not in content_types:
+                        content_types[key] = ContentType.objects.get_by_natural_key(*key)
+                    row['timestamp'] = parse_datetime(row['timestamp'])
+                    entries.append(LogEntry(content_type=content_types[key], **row))
+            LogEntry.objects.bulk_create(
+                entries, batch_size=1000, ignore_conflicts=True
+            )
+            total += len(entries)
+        self.stdout.write(self.style.SUCCESS('%s entradas restauradas' % total))
@@ -0,0 +1,66 @@
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from base.models import Image
+from base.thumbnails import get_context, get_task, render
+
+
+class Command(BaseCommand):
+    """!
+    Comando que genera las derivadas que faltan de las imágenes existentes,
+    para ejecutarlo después de cambiar IMAGE_DERIVATIVES
+
+    Las derivadas que ya están al día se omiten, por lo que se puede volver a
+    ejecutar si se interrumpe
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    help = 'Genera las derivadas que faltan de las imágenes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=getattr(settings, 'IMAGE_DERIVATIVES_WORKERS', 2) or 1,
+            help='Procesos que generan las derivadas',
+        )
+
+    def handle(self, *args, **options):
+        # Las imágenes con el mismo contenido comparten el archivo
+        names = Image.objects.exclude(file='').values_list(
+            'file', flat=True
+        ).distinct().iterator()
+        self.generated = self.errors = 0
+        workers = options['workers']
+        # Se envían a lo sumo unas pocas tareas por proceso, para no cargar
+        # en memoria una tarea por imagen
+        window = workers * 4
+        futures = {}
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=get_context()
+        ) as executor:
+            for name in names:
+                if len(futures) >= window:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.collect(future, futures.pop(future))
+                future = executor.submit(render, *get_task(Image(file=name).file))
+                futures[future] = name
+            for future in list(futures):
+                self.collect(future, futures.pop(future))
+        self.stdout.write(self.style.SUCCESS(
+            '%s derivadas generadas, %s imágenes con errores' % (
+                self.generated, self.errors
+            )
+        ))
+
+    def collect(self, future, name):
+        try:
+            self.generated += future.result()
+        except Exception as e:
+            self.errors += 1
+            self.stderr.write('%s: %s' % (name, e))
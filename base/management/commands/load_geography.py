@@ -0,0 +1,258 @@
+import csv
+import io
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from base.models import (
+    City,
+    Country,
+    Municipality,
+    Parish,
+    State,
+)
+from base.signals import geography_changed
+
+
+class Command(BaseCommand):
+    """!
+    Comando que carga o actualiza la jerarquía geográfica desde un CSV o JSON
+
+    Los padres se resuelven por nombre en memoria y solo se insertan las filas
+    que no existen, por lo que ejecutarlo de nuevo con el mismo archivo no
+    modifica nada. En PostgreSQL se inserta con COPY y en los demás motores
+    con bulk_create por bloques.
+
+    CSV con encabezado: country,state,municipality,parish,city (las columnas
+    de niveles inferiores pueden ir vacías).
+
+    JSON: [{"name": "Venezuela", "states": [{"name": "Mérida",
+    "municipalities": [{"name": "Libertador", "parishes": ["Arias"]}],
+    "cities": ["Mérida"]}]}]
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    help = 'Carga países, estados, municipios, ciudades y parroquias desde un CSV o JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archivo .csv o .json con la jerarquía')
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Formato del archivo, por defecto según la extensión',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Filas por inserción cuando no se usa COPY',
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Usa bulk_create también en PostgreSQL',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Muestra lo que cambiaría sin guardar',
+        )
+
+    def read_csv(self, path):
+        with open(path, newline='', encoding='utf-8-sig') as file:
+            for row in csv.DictReader(file):
+                yield {key: (value or '').strip() for key, value in row.items()}
+
+    def read_json(self, path):
+        with open(path, encoding='utf-8') as file:
+            countries = json.load(file)
+        for country in countries:
+            yield {'country': country['name']}
+            for state in country.get('states', ()):
+                yield {'country': country['name'], 'state': state['name']}
+                for municipality in state.get('municipalities', ()):
+                    yield {
+                        'country': country['name'],
+                        'state': state['name'],
+                        'municipality': municipality['name'],
+                    }
+                    for parish in municipality.get('parishes', ()):
+                        yield {
+                            'country': country['name'],
+                            'state': state['name'],
+                            'municipality': municipality['name'],
+                            'parish': parish,
+                        }
+                for city in state.get('cities', ()):
+                    yield {
+                        'country': country['name'],
+                        'state': state['name'],
+                        'city': city,
+                    }
+
+    def read(self, path, format):
+        """!
+        Método que recorre el archivo y agrupa los nombres únicos por nivel
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        format = format or path.rsplit('.', 1)[-1].lower()
+        if format not in ('csv', 'json'):
+            raise CommandError('Formato no soportado: %s' % format)
+        rows = self.read_csv(path) if format == 'csv' else self.read_json(path)
+        tree = {
+            'countries': set(),
+            'states': {},
+            'municipalities': set(),
+            'cities': set(),
+            'parishes': set(),
+        }
+        for line, row in enumerate(rows, 1):
+            country, state = row.get('country'), row.get('state')
+            municipality = row.get('municipality')
+            if not country:
+                raise CommandError('Fila %s sin país' % line)
+            tree['countries'].add(country)
+            if not state:
+                continue
+            if tree['states'].setdefault(state, country) != country:
+                raise CommandError(
+                    'Fila %s: el estado %s aparece en dos países' % (line, state)
+                )
+            if municipality:
+                tree['municipalities'].add((state, municipality))
+                if row.get('parish'):
+                    tree['parishes'].add((state, municipality, row['parish']))
+            elif row.get('parish'):
+                raise CommandError('Fila %s: parroquia sin municipio' % line)
+            if row.get('city'):
+                tree['cities'].add((state, row['city']))
+        return tree
+
+    def insert(self, model, fields, rows):
+        """!
+        Método que inserta las filas de un modelo con los valores de fields
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param model <b>{object}</b> Modelo en el que se inserta
+        @param fields <b>{tuple}</b> Campos, por ejemplo ('name', 'state')
+        @param rows <b>{list}</b> Tuplas con los valores en el orden de fields
+        """
+
+        if not rows or self.dry_run:
+            return
+        if self.use_copy:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (
+                        connection.ops.quote_name(model._meta.db_table),
+                        ', '.join(
+                            connection.ops.quote_name(
+                                model._meta.get_field(field).column
+                            )
+                            for field in fields
+                        ),
+                    ),
+                    buffer,
+                )
+        else:
+            attnames = [model._meta.get_field(field).attname for field in fields]
+            model.objects.bulk_create(
+                [model(**dict(zip(attnames, row))) for row in rows],
+                batch_size=self.batch_size,
+            )
+
+    def index(self, model, parent):
+        """!
+        Método que devuelve el diccionario (id del padre, nombre) → id
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        return {
+            (parent_id, name): pk
+            for pk, parent_id, name in model.objects.values_list(
+                'pk', '%s_id' % parent, 'name'
+            )
+        }
+
+    def handle(self, *args, **options):
+        self.batch_size = options['batch_size']
+        self.dry_run = options['dry_run']
+        self.use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        tree = self.read(options['path'], options['format'])
+        counts = {}
+
+        with transaction.atomic():
+            countries = dict(Country.objects.values_list('name', 'pk'))
+            new = [(name,) for name in tree['countries'] - countries.keys()]
+            self.insert(Country, ('name',), new)
+            counts[Country] = (len(new), 0)
+            countries = dict(Country.objects.values_list('name', 'pk'))
+
+            # El nombre del estado es único, se corrige el país si cambió
+            states = {
+                name: (pk, country_id)
+                for pk, country_id, name in State.objects.values_list(
+                    'pk', 'country_id', 'name'
+                )
+            }
+            new, moved = [], []
+            for name, country in tree['states'].items():
+                country_id = countries.get(country)
+                if name not in states:
+                    new.append((name, country_id))
+                elif states[name][1] != country_id:
+                    moved.append(State(
+                        pk=states[name][0], name=name, country_id=country_id,
+                    ))
+            self.insert(State, ('name', 'country'), new)
+            if moved and not self.dry_run:
+                State.objects.bulk_update(
+                    moved, ['country'], batch_size=self.batch_size
+                )
+            counts[State] = (len(new), len(moved))
+            states = dict(State.objects.values_list('name', 'pk'))
+
+            levels = (
+                (Municipality, 'state', tree['municipalities']),
+                (City, 'state', tree['cities']),
+            )
+            for model, parent, names in levels:
+                existing = self.index(model, parent)
+                new = [
+                    (name, states.get(state)) for state, name in names
+                    if (states.get(state), name) not in existing
+                ]
+                self.insert(model, ('name', parent), new)
+                counts[model] = (len(new), 0)
+
+            municipalities = self.index(Municipality, 'state')
+            existing = self.index(Parish, 'municipality')
+            new = set()
+            for state, municipality, name in tree['parishes']:
+                municipality_id = municipalities.get(
+                    (states.get(state), municipality)
+                )
+                if (municipality_id, name) not in existing:
+                    new.add((name, municipality_id))
+            self.insert(Parish, ('name', 'municipality'), list(new))
+            counts[Parish] = (len(new), 0)
+
+        for model, (created, updated) in counts.items():
+            self.stdout.write('%s: %s nuevos, %s actualizados' % (
+                model._meta.verbose_name_plural, created, updated,
+            ))
+        if self.dry_run:
+            self.stdout.write(self.style.WARNING('Dry run: no se guardó nada'))
+            return
+        # bulk_create y COPY no envían post_save
+        for model, (created, updated) in counts.items():
+            if created or updated:
+                geography_changed.send(sender=model, instance=None, pk=None)
+        self.stdout.write(self.style.SUCCESS('Geografía cargada'))
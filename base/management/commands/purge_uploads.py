@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from base.uploads import purge
+
+
+class Command(BaseCommand):
+    """!
+    Comando que elimina las subidas de imágenes sin terminar que no reciben
+    partes desde hace IMAGE_UPLOAD_EXPIRATION segundos, junto con sus
+    archivos temporales. Una subida lenta que sigue activa no se elimina
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    help = 'Elimina las subidas de imágenes sin terminar vencidas'
+
+    def handle(self, *args, **options):
+        expiration = getattr(settings, 'IMAGE_UPLOAD_EXPIRATION', 60 * 60 * 24)
+        count = purge(timezone.now() - timedelta(seconds=expiration))
+        self.stdout.write(self.style.SUCCESS(
+            '%s subidas eliminadas' % count
+        ))
@@ -0,0 +1,227 @@
+import mimetypes
+import os
+import re
+from stat import S_ISREG
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from django.utils.module_loading import import_string
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.permissions import AllowAny
+from rest_framework.views import APIView
+
+# Rango de bytes único: bytes=inicio-fin, bytes=inicio- o bytes=-sufijo
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Archivos de ContentAddressedStorage, <aa>/<sha256>.<ext>; las derivadas
+# llevan @ en el nombre y no coinciden
+CONTENT_ADDRESSED = re.compile(
+    r'(?:^|/)(?P<prefix>[0-9a-f]{2})/(?P<digest>(?P=prefix)[0-9a-f]{62})\.\w+$'
+)
+
+
+def get_etag(path, stat):
+    """!
+    Función que devuelve el ETag de un archivo sin leer su contenido
+
+    Los archivos de ContentAddressedStorage llevan el sha256 en el nombre,
+    que se usa como ETag; los demás usan la fecha de modificación y el
+    tamaño, que cambian cuando se reemplaza el archivo
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    match = CONTENT_ADDRESSED.search(path)
+    if match:
+        return '"%s"' % match.group('digest')[:32]
+    return '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+
+
+def get_content_type(path):
+    return mimetypes.guess_type(path)[0] or 'application/octet-stream'
+
+
+def get_range(header, size):
+    """!
+    Función que interpreta el encabezado Range
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return tuple (inicio, fin incluido), None si no hay un rango único
+        válido o False si el rango no se puede satisfacer
+    """
+
+    match = RANGE.match(header or '')
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if start == '':
+        # Los últimos bytes del archivo
+        start, end = max(size - int(end), 0), size - 1
+    else:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    if start > end or start >= size:
+        return False
+    return start, end
+
+
+class RangeFile:
+    """!
+    Clase que lee solo un rango de un archivo abierto
+
+    Expone fileno() para que el servidor (wsgi.file_wrapper) envíe el rango
+    con sendfile desde la posición actual, limitado por Content-Length
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.name = file.name
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+class MediaContentNegotiation(BaseContentNegotiation):
+    """!
+    Clase que ignora el encabezado Accept, que en las peticiones de archivos
+    pide el tipo del archivo y no el de los errores de la API
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class MediaView(APIView):
+    """!
+    Clase que sirve los archivos de MEDIA_ROOT en producción
+
+    Según MEDIA_SERVE_MODE el archivo lo envía el servidor web con
+    X-Accel-Redirect (nginx) o X-Sendfile (Apache, lighttpd), o Django con
+    FileResponse, que el servidor WSGI envía con sendfile, con soporte de
+    Range. Los permisos se toman de MEDIA_PERMISSION_CLASSES
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    content_negotiation_class = MediaContentNegotiation
+
+    def get_permissions(self):
+        return [
+            import_string(path)() for path in getattr(
+                settings, 'MEDIA_PERMISSION_CLASSES',
+                ['rest_framework.permissions.AllowAny'],
+            )
+        ]
+
+    def get(self, request, path):
+        try:
+            full_path = safe_join(settings.MEDIA_ROOT, path)
+            stat = os.stat(full_path)
+        except (OSError, SuspiciousFileOperation):
+            raise Http404('Archivo no encontrado.')
+        if not S_ISREG(stat.st_mode):
+            raise Http404('Archivo no encontrado.')
+
+        etag = get_etag(path, stat)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=int(stat.st_mtime)
+        )
+        if response is None:
+            response = self.send_file(request, path, full_path, stat, etag)
+
+        is_public = all(
+            isinstance(permission, AllowAny)
+            for permission in self.get_permissions()
+        )
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(stat.st_mtime)
+        if CONTENT_ADDRESSED.search(path):
+            # El nombre es el hash del contenido, por lo que nunca cambia
+            response['Cache-Control'] = '%s, max-age=%s, immutable' % (
+                'public' if is_public else 'private',
+                getattr(settings, 'MEDIA_CACHE_MAX_AGE', 60 * 60 * 24 * 365),
+            )
+        else:
+            # Las derivadas y los archivos con nombre fijo pueden cambiar, el
+            # cliente los revalida con el ETag
+            response['Cache-Control'] = '%s, no-cache' % (
+                'public' if is_public else 'private'
+            )
+        return response
+
+    def send_file(self, request, path, full_path, stat, etag):
+        """!
+        Método que delega el envío al servidor web o envía el archivo
+        completo o el rango pedido. Con If-Range el rango solo se respeta si
+        el ETag coincide
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        mode = getattr(settings, 'MEDIA_SERVE_MODE', 'django')
+        if mode == 'x-accel':
+            # nginx envía el archivo desde una location internal
+            response = HttpResponse(content_type=get_content_type(full_path))
+            response['X-Accel-Redirect'] = quote(
+                getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+                + path
+            )
+            return response
+        if mode == 'x-sendfile':
+            response = HttpResponse(content_type=get_content_type(full_path))
+            response['X-Sendfile'] = full_path
+            return response
+
+        size = stat.st_size
+        byte_range = None
+        if request.META.get('HTTP_IF_RANGE', etag) == etag:
+            byte_range = get_range(request.META.get('HTTP_RANGE'), size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%s' % size
+            return response
+        file = open(full_path, 'rb')
+        if byte_range is None:
+            response = FileResponse(file)
+        else:
+            start, end = byte_range
+            response = FileResponse(RangeFile(file, start, end - start + 1))
+            response.status_code = 206
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes %s-%s/%s' % (start, end, size)
+        response['Accept-Ranges'] = 'bytes'
+        return response
@@ -1,8 +1,13 @@
+import uuid
+
 from django.contrib.auth.models import User
 from django.core import validators
-from django.db import models
+from django.db import models, transaction
 from django.db.models.signals import pre_delete
 from django.dispatch.dispatcher import receiver
+from django.utils import timezone
+
+from .storage import get_image_storage
 
 
 class Country(models.Model):
@@ -96,7 +101,8 @@ class Municipality(models.Model):
 
     # Nombre
     name = models.CharField(
-        'nombre', max_length=50, db_comment='Nombre del municipio',
+        'nombre', max_length=50, db_index=True,
+        db_comment='Nombre del municipio',
     )
 
     # Relación con el modelo State
@@ -137,7 +143,8 @@ class City(models.Model):
 
     # Nombre
     name = models.CharField(
-        'nombre', max_length=50, db_comment='Nombre de la ciudad',
+        'nombre', max_length=50, db_index=True,
+        db_comment='Nombre de la ciudad',
     )
 
     # Relación con el modelo State
@@ -179,7 +186,8 @@ class Parish(models.Model):
 
     # Nombre
     name = models.CharField(
-        'nombre', max_length=50, db_comment='Nombre de la parroquia',
+        'nombre', max_length=50, db_index=True,
+        db_comment='Nombre de la parroquia',
     )
 
     # Relación con el modelo Municipality
@@ -221,12 +229,14 @@ class Image(models.Model):
 
     # Nombre
     name = models.CharField(
-        'nombre', max_length=100, db_comment='Nombre de la imagen',
+        'nombre', max_length=100, db_index=True,
+        db_comment='Nombre de la imagen',
     )
 
     # Archivo
     file = models.ImageField(
-        'archivo', upload_to='images/', db_comment='Archivo con la imagen',
+        'archivo', upload_to='images/', storage=get_image_storage,
+        db_index=True, db_comment='Archivo con la imagen',
     )
 
     def __str__(self):
@@ -240,6 +250,17 @@ class Image(models.Model):
 
         return self.name
 
+    def save(self, *args, **kwargs):
+        """!
+        Método que guarda el archivo y el registro en la misma transacción,
+        para que el bloqueo del Blob dure hasta que la imagen sea visible
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
     class Meta:
         """!
         Meta clase del modelo que establece algunas propiedades
@@ -251,17 +272,160 @@ class Image(models.Model):
         verbose_name_plural = 'Imágenes'
 
 
+class Blob(models.Model):
+    """!
+    Clase que contiene los archivos guardados por ContentAddressedStorage
+
+    La fila sirve de bloqueo entre quien guarda un archivo y quien lo borra:
+    ambos la escriben antes de tocar el disco, por lo que uno espera a que
+    la transacción del otro termine
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Nombre del archivo en el almacenamiento
+    name = models.CharField(
+        'nombre', max_length=255, primary_key=True,
+        db_comment='Nombre del archivo en el almacenamiento',
+    )
+
+    # Fecha del último guardado
+    used_at = models.DateTimeField(
+        'usado', default=timezone.now,
+        db_comment='Fecha del último guardado del archivo',
+    )
+
+    def __str__(self):
+        """!
+        Función para representar la clase de forma amigable
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param self <b>{object}</b> Objeto que instancia la clase
+        @return string <b>{object}</b> Objeto con el nombre
+        """
+
+        return self.name
+
+    class Meta:
+        """!
+        Meta clase del modelo que establece algunas propiedades
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        verbose_name = 'Archivo'
+        verbose_name_plural = 'Archivos'
+
+
 @receiver(pre_delete, sender=Image)
 def image_delete(sender, instance, **kwargs):
     """!
-    Función que permite eliminar la imagen del disco duro
+    Función que permite eliminar la imagen y sus derivadas del disco duro
+
+    Con ContentAddressedStorage varias imágenes comparten el archivo, por lo
+    que se borra solo si, confirmada la transacción, ya no lo usa ninguna.
+    Borrar primero la fila del Blob espera a los guardados en curso del mismo
+    archivo, y los siguientes esperan a que termine el borrado
 
     @author William Páez (paez.william8 at gmail.com)
     @copyright <a href='http://www.gnu.org/licenses/gpl-3.0.html'>
         GNU Public License versión 3 (GPLv3)</a>
     """
 
-    instance.file.delete(False)
+    from .thumbnails import get_names
+
+    if not instance.file:
+        return
+    storage, name = instance.file.storage, instance.file.name
+
+    def unlink():
+        with transaction.atomic():
+            Blob.objects.filter(name=name).delete()
+            if Image.objects.filter(file=name).exists():
+                transaction.set_rollback(True)
+                return
+            for derivative in get_names(name).values():
+                storage.delete(derivative)
+            storage.delete(name)
+
+    transaction.on_commit(unlink, robust=True)
+
+
+class ImageUpload(models.Model):
+    """!
+    Clase que contiene las subidas de imágenes por partes en curso
+
+    El contenido se guarda en un archivo temporal de IMAGE_UPLOAD_DIR cuyo
+    tamaño es la posición actual de la subida; al completarse se crea la
+    imagen y se elimina el registro
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Identificador difícil de adivinar, usado en la url y el archivo
+    id = models.UUIDField(
+        primary_key=True, default=uuid.uuid4, editable=False,
+        db_comment='Identificador de la subida',
+    )
+
+    # Nombre de la imagen que se va a crear
+    name = models.CharField(
+        'nombre', max_length=100, db_comment='Nombre de la imagen',
+    )
+
+    # Nombre del archivo original
+    filename = models.CharField(
+        'nombre del archivo', max_length=255,
+        db_comment='Nombre del archivo original',
+    )
+
+    # Tamaño total en bytes
+    size = models.PositiveBigIntegerField(
+        'tamaño', db_comment='Tamaño total del archivo en bytes',
+    )
+
+    # sha256 del archivo completo en hexadecimal
+    checksum = models.CharField(
+        'checksum', max_length=64,
+        db_comment='sha256 del archivo completo en hexadecimal',
+    )
+
+    # Relación con el modelo User
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, verbose_name='usuario',
+        db_comment='Relación con el modelo usuario',
+    )
+
+    # Fecha de creación
+    created_at = models.DateTimeField(
+        'creado', auto_now_add=True, db_index=True,
+        db_comment='Fecha de creación',
+    )
+
+    def __str__(self):
+        """!
+        Función para representar la clase de forma amigable
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param self <b>{object}</b> Objeto que instancia la clase
+        @return string <b>{object}</b> Objeto con el nombre del archivo
+        """
+
+        return self.filename
+
+    class Meta:
+        """!
+        Meta clase del modelo que establece algunas propiedades
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        verbose_name = 'Subida de imagen'
+        verbose_name_plural = 'Subidas de imágenes'
 
 
 class Person(models.Model):
@@ -275,12 +439,14 @@ class Person(models.Model):
 
     # Nombre
     first_name = models.CharField(
-        'nombres', max_length=100, db_comment='Nombres de la persona',
+        'nombres', max_length=100, db_index=True,
+        db_comment='Nombres de la persona',
     )
 
     # Apellido
     last_name = models.CharField(
-        'apellidos', max_length=100, db_comment='Apellidos de la persona',
+        'apellidos', max_length=100, db_index=True,
+        db_comment='Apellidos de la persona',
     )
 
     # Cédula de identidad
@@ -361,3 +527,8 @@ class Person(models.Model):
 
         verbose_name = 'Persona'
         verbose_name_plural = 'Personas'
+
+        # Índice para el listado por usuario paginado por cursor
+        indexes = [
+            models.Index(fields=['user', 'id'], name='person_user_id_idx'),
+        ]
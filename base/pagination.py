@@ -0,0 +1,22 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class PersonCursorPagination(CursorPagination):
+    """!
+    Clase que pagina las personas por cursor (keyset) sobre (user, id)
+
+    El listado ya viene filtrado por el usuario, por lo que basta con ordenar
+    por id para recorrer el índice (user, id). No se ejecuta COUNT(*) y cada
+    página cuesta lo mismo que la primera, porque el cursor se traduce en un
+    filtro id > último id y no en un OFFSET.
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    ordering = ('id',)
+    page_size = getattr(settings, 'PERSON_PAGE_SIZE', 100)
+    page_size_query_param = 'page_size'
+    max_page_size = getattr(settings, 'PERSON_MAX_PAGE_SIZE', 1000)
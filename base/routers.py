@@ -3,6 +3,7 @@ from rest_framework import routers
 from .views import (
     CityViewSet,
     CountryViewSet,
+    ImageUploadViewSet,
     ImageViewSet,
     MunicipalityViewSet,
     ParishViewSet,
@@ -18,4 +19,5 @@ router.register(r'municipalities', MunicipalityViewSet)
 router.register(r'cities', CityViewSet)
 router.register(r'parishes', ParishViewSet)
 router.register(r'images', ImageViewSet)
+router.register(r'image-uploads', ImageUploadViewSet)
 router.register(r'people', PersonViewSet)
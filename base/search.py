@@ -0,0 +1,254 @@
+import re
+
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Q
+from django.db.models.signals import post_migrate
+from django.dispatch import receiver
+
+from .models import Person
+
+# Campos indexados para la búsqueda de personas
+FIELDS = ('first_name', 'last_name', 'id_number', 'email', 'phone')
+
+# Prefijo de una cédula de identidad, como V1234
+ID_NUMBER_PREFIX = re.compile(r'^[VE]\d{1,8}$', re.IGNORECASE)
+
+
+def get_terms(query):
+    """!
+    Función que separa la búsqueda en palabras sin operadores del motor
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    return re.findall(r'\w+', query)[:10]
+
+
+def get_like_prefix(value):
+    """!
+    Función que escapa los comodines de LIKE para buscar value como prefijo
+    con ESCAPE '\\'
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    return re.sub(r'([\\%_])', r'\\\1', value) + '%'
+
+
+class SQLiteSearchBackend:
+    """!
+    Clase que busca personas con un índice FTS5 de SQLite
+
+    La tabla virtual usa base_person como contenido externo y se mantiene con
+    triggers, por lo que también se actualiza con bulk_create y bulk_update
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    table = 'base_person_fts'
+
+    # Peso de cada campo en el ranking bm25, en el orden de FIELDS
+    weights = (10.0, 10.0, 5.0, 1.0, 1.0)
+
+    def install(self):
+        """!
+        Método que crea la tabla FTS5 y sus triggers si no existen
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        person = Person._meta.db_table
+        columns = ', '.join(FIELDS)
+        new = ', '.join('new.%s' % field for field in FIELDS)
+        old = ', '.join('old.%s' % field for field in FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s",
+                [self.table],
+            )
+            created = cursor.fetchone() is None
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(%s, "
+                "content='%s', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+                % (self.table, columns, person)
+            )
+            cursor.execute(
+                'CREATE TRIGGER IF NOT EXISTS %s_ai AFTER INSERT ON %s BEGIN '
+                'INSERT INTO %s(rowid, %s) VALUES (new.id, %s); END'
+                % (self.table, person, self.table, columns, new)
+            )
+            cursor.execute(
+                'CREATE TRIGGER IF NOT EXISTS %s_ad AFTER DELETE ON %s BEGIN '
+                "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, %s); END"
+                % (self.table, person, self.table, self.table, columns, old)
+            )
+            cursor.execute(
+                'CREATE TRIGGER IF NOT EXISTS %s_au AFTER UPDATE ON %s BEGIN '
+                "INSERT INTO %s(%s, rowid, %s) VALUES ('delete', old.id, %s); "
+                'INSERT INTO %s(rowid, %s) VALUES (new.id, %s); END'
+                % (
+                    self.table, person, self.table, self.table, columns, old,
+                    self.table, columns, new,
+                )
+            )
+            if created:
+                # Indexa las personas que ya existían
+                cursor.execute(
+                    "INSERT INTO %s(%s) VALUES ('rebuild')" % (self.table, self.table)
+                )
+
+    def search(self, user_id, query, limit, offset):
+        """!
+        Método que devuelve los ids de las personas del usuario ordenados por
+        relevancia, tomando cada palabra como prefijo
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        terms = get_terms(query)
+        if not terms:
+            return []
+        match = ' '.join('"%s"*' % term for term in terms)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT p.id FROM %s JOIN %s p ON p.id = %s.rowid '
+                'WHERE %s MATCH %%s AND p.user_id = %%s '
+                'ORDER BY bm25(%s, %s), p.id LIMIT %%s OFFSET %%s' % (
+                    self.table, Person._meta.db_table, self.table, self.table,
+                    self.table, ', '.join(map(str, self.weights)),
+                ),
+                [match, user_id, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    """!
+    Clase que busca personas con un índice GIN sobre un tsvector de los
+    campos y, si pg_trgm está disponible, un índice de trigramas para los
+    prefijos de la cédula
+
+    PostgreSQL mantiene los índices de expresión en cada INSERT, UPDATE y
+    DELETE, por lo que no hace falta ningún trigger
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    document = "to_tsvector('simple', %s)" % " || ' ' || ".join(
+        "coalesce(%s, '')" % field for field in FIELDS
+    )
+
+    def install(self):
+        """!
+        Método que crea los índices si no existen
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        person = Person._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE INDEX IF NOT EXISTS base_person_search_idx ON %s '
+                'USING GIN ((%s))' % (person, self.document)
+            )
+            try:
+                with transaction.atomic():
+                    cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                    cursor.execute(
+                        'CREATE INDEX IF NOT EXISTS base_person_id_number_trgm_idx '
+                        'ON %s USING GIN (id_number gin_trgm_ops)' % person
+                    )
+            except DatabaseError:
+                # Sin permisos para crear la extensión se usa solo el tsvector
+                pass
+
+    def search(self, user_id, query, limit, offset):
+        """!
+        Método que devuelve los ids de las personas del usuario ordenados por
+        relevancia, tomando cada palabra como prefijo
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        terms = get_terms(query)
+        if not terms:
+            return []
+        tsquery = ' & '.join('%s:*' % term for term in terms)
+        condition = "%s @@ to_tsquery('simple', %%s)" % self.document
+        params = [tsquery]
+        # El índice trigram solo se usa cuando se busca una cédula
+        if len(terms) == 1 and ID_NUMBER_PREFIX.match(terms[0]):
+            condition += " OR id_number LIKE %s ESCAPE '\\'"
+            params.append(get_like_prefix(terms[0].upper()))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM %s WHERE user_id = %%s AND (%s) "
+                "ORDER BY ts_rank(%s, to_tsquery('simple', %%s)) DESC, id "
+                "LIMIT %%s OFFSET %%s" % (
+                    Person._meta.db_table, condition, self.document,
+                ),
+                [user_id, *params, tsquery, limit, offset],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+class DefaultSearchBackend:
+    """!
+    Clase de respaldo para los motores sin índice de texto completo
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def install(self):
+        pass
+
+    def search(self, user_id, query, limit, offset):
+        queryset = Person.objects.filter(user_id=user_id)
+        for term in get_terms(query):
+            condition = Q()
+            for field in FIELDS:
+                condition |= Q(**{'%s__istartswith' % field: term})
+            queryset = queryset.filter(condition)
+        return list(
+            queryset.order_by('id').values_list('id', flat=True)[offset:offset + limit]
+        )
+
+
+def get_backend():
+    """!
+    Función que devuelve el motor de búsqueda de la base de datos actual
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    return {
+        'sqlite': SQLiteSearchBackend,
+        'postgresql': PostgresSearchBackend,
+    }.get(connection.vendor, DefaultSearchBackend)()
+
+
+@receiver(post_migrate)
+def install_search(sender, **kwargs):
+    """!
+    Función que crea el índice de búsqueda después de migrar la app base
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if sender.name == 'base':
+        get_backend().install()
@@ -1,16 +1,40 @@
+import re
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
 
 from .models import (
     City,
     Country,
     Image,
+    ImageUpload,
     Parish,
     Person,
     State,
 )
+from .snapshot import snapshot
+from .thumbnails import get_names
+from .uploads import get_offset
 from users.serializers import UserSerializer
 
 
+def parish_exists(pk):
+    """!
+    Función que verifica si existe la parroquia usando el snapshot
+    geográfico y consulta la base de datos solo cuando no la encuentra
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    return (
+        snapshot.exists(Parish, pk)
+        or Parish.objects.filter(pk=pk).exists()
+    )
+
+
 class CountrySerializer(serializers.ModelSerializer):
     """!
     Clase que muestra los campos del modelo Country
@@ -90,9 +114,71 @@ class ImageSerializer(serializers.ModelSerializer):
         GNU Public License versión 2 (GPLv2)</a>
     """
 
+    # Urls de las derivadas por tamaño, ver IMAGE_DERIVATIVES
+    derivatives = serializers.SerializerMethodField()
+
     class Meta:
         model = Image
-        fields = ('pk', 'name', 'file',)
+        fields = ('pk', 'name', 'file', 'derivatives',)
+
+    def get_derivatives(self, obj):
+        """!
+        Método que devuelve las urls de las derivadas de la imagen, en el
+        formato del original (file) y en WebP (webp)
+
+        Las urls se arman a partir del nombre del archivo sin consultar el
+        disco; justo después de subir la imagen pueden tardar un momento en
+        estar disponibles
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        if not obj.file:
+            return {}
+        request = self.context.get('request')
+        derivatives = {}
+        for (size, extension), name in get_names(obj.file.name).items():
+            url = obj.file.storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            derivatives.setdefault(size, {})[extension or 'file'] = url
+        return derivatives
+
+
+class ImageUploadSerializer(serializers.ModelSerializer):
+    """!
+    Clase que muestra los campos del modelo ImageUpload con la posición
+    actual de la subida
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Bytes recibidos
+    offset = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImageUpload
+        fields = ('id', 'name', 'filename', 'size', 'checksum', 'offset',)
+
+    def get_offset(self, obj):
+        return get_offset(obj)
+
+    def validate_size(self, value):
+        max_size = getattr(settings, 'IMAGE_UPLOAD_MAX_SIZE', 20 * 1024 * 1024)
+        if not 0 < value <= max_size:
+            raise serializers.ValidationError(
+                'El tamaño debe estar entre 1 y %s bytes.' % max_size
+            )
+        return value
+
+    def validate_checksum(self, value):
+        if not re.fullmatch(r'[0-9a-fA-F]{64}', value):
+            raise serializers.ValidationError(
+                'Se esperaba el sha256 del archivo en hexadecimal.'
+            )
+        return value.lower()
 
 
 class PersonSerializer(serializers.ModelSerializer):
@@ -120,7 +206,69 @@ class PersonSerializer(serializers.ModelSerializer):
             'parish', 'parish_id', 'user', 'images',
         )
         depth = 1
-    
+
+    def validate_parish_id(self, value):
+        if not parish_exists(value):
+            raise serializers.ValidationError('Parroquia no encontrada.')
+        return value
+
+    def validate(self, attrs):
+        """!
+        Método que valida en una sola consulta las imágenes enviadas como
+        [{'id': 1}, ...]
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param attrs object con los campos a validar
+        @return attrs object con los ids de las imágenes en image_ids
+        """
+
+        images = self.initial_data.get('images')
+        if images is None:
+            return attrs
+        try:
+            image_ids = {int(image['id']) for image in images}
+        except (KeyError, TypeError, ValueError):
+            raise serializers.ValidationError(
+                {'images': 'Formato inválido. Ej. [{"id": 1}, {"id": 2}]'}
+            )
+        found = set(
+            Image.objects.filter(pk__in=image_ids).values_list('pk', flat=True)
+        )
+        missing = image_ids - found
+        if missing:
+            raise serializers.ValidationError(
+                {'images': 'Imágenes no encontradas: %s' % ', '.join(
+                    str(pk) for pk in sorted(missing)
+                )}
+            )
+        attrs['image_ids'] = image_ids
+        return attrs
+
+    def set_images(self, person, image_ids):
+        """!
+        Método que sincroniza las imágenes de la persona insertando y
+        eliminando en bloque solo las relaciones que cambiaron
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param person <b>{object}</b> Persona a la que se asignan las imágenes
+        @param image_ids <b>{set}</b> Ids de las imágenes que debe tener
+        """
+
+        # Usa las imágenes precargadas por el viewset cuando existen
+        current = {image.pk for image in person.images.all()}
+        through = Person.images.through
+        removed = current - image_ids
+        if removed:
+            through.objects.filter(
+                person_id=person.pk, image_id__in=removed
+            ).delete()
+        added = image_ids - current
+        if added:
+            through.objects.bulk_create([
+                through(person_id=person.pk, image_id=image_id)
+                for image_id in added
+            ])
+
     def create(self, validated_data):
         """!
         Método para crear personas
@@ -129,17 +277,20 @@ class PersonSerializer(serializers.ModelSerializer):
         """
 
         user = self.context['user']
-        parish = Parish.objects.get(id=validated_data['parish_id'])
-        person = Person.objects.create(
-            first_name=validated_data['first_name'],
-            last_name=validated_data['last_name'],
-            id_number=validated_data['id_number'],
-            phone=validated_data['phone'],
-            email=validated_data['email'],
-            address=validated_data['address'],
-            parish=parish,
-            user=user,
-        )
+        with transaction.atomic():
+            person = Person.objects.create(
+                first_name=validated_data['first_name'],
+                last_name=validated_data['last_name'],
+                id_number=validated_data['id_number'],
+                phone=validated_data['phone'],
+                email=validated_data['email'],
+                address=validated_data['address'],
+                parish_id=validated_data['parish_id'],
+                user_id=user.pk,
+            )
+            image_ids = validated_data.get('image_ids')
+            if image_ids:
+                self.set_images(person, image_ids)
         return person
 
     def update(self, instance, validated_data):
@@ -155,6 +306,249 @@ class PersonSerializer(serializers.ModelSerializer):
         instance.phone = validated_data.get('phone', instance.phone)
         instance.email = validated_data.get('email', instance.email)
         instance.address = validated_data.get('address', instance.address)
-        instance.parish_id = validated_data.get('parish_id', instance.parish)
-        instance.save()
+        instance.parish_id = validated_data.get('parish_id', instance.parish_id)
+        with transaction.atomic():
+            instance.save()
+            image_ids = validated_data.get('image_ids')
+            if image_ids is not None:
+                self.set_images(instance, image_ids)
         return instance
+
+
+class PersonBulkSerializer(serializers.ModelSerializer):
+    """!
+    Clase que valida y guarda personas en lote
+
+    Cada registro se valida sin consultar la base de datos; la existencia de
+    parroquias, imágenes y cédulas se verifica para todo el lote con una
+    consulta por bloque y las personas se insertan con bulk_create
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Id del modelo Parish
+    parish_id = serializers.IntegerField()
+
+    # Imágenes con el formato [{'id': 1}, ...]
+    images = serializers.ListField(
+        child=serializers.DictField(), required=False,
+    )
+
+    # Cantidad de registros por consulta o inserción
+    batch_size = 1000
+
+    class Meta:
+        model = Person
+        fields = (
+            'first_name', 'last_name', 'id_number', 'phone', 'email', 'address',
+            'parish_id', 'images',
+        )
+        # La unicidad de la cédula se valida para todo el lote
+        extra_kwargs = {
+            'id_number': {
+                'validators': Person._meta.get_field('id_number').validators,
+            },
+        }
+
+    def validate_images(self, value):
+        try:
+            return {int(image['id']) for image in value}
+        except (KeyError, TypeError, ValueError):
+            raise serializers.ValidationError(
+                'Formato inválido. Ej. [{"id": 1}, {"id": 2}]'
+            )
+
+    @classmethod
+    def chunks(cls, values):
+        """!
+        Método que divide una lista en bloques de batch_size
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        values = list(values)
+        for i in range(0, len(values), cls.batch_size):
+            yield values[i:i + cls.batch_size]
+
+    @classmethod
+    def existing(cls, queryset, field, values, *fields):
+        """!
+        Método que consulta por bloques las filas cuyo campo está en values
+
+        @author William Páez (paez.william8 at gmail.com)
+        @return dict con el valor del campo como clave y la fila como valor
+        """
+
+        rows = {}
+        for chunk in cls.chunks(values):
+            for row in queryset.filter(
+                **{'%s__in' % field: chunk}
+            ).values_list(field, *fields):
+                rows[row[0]] = row
+        return rows
+
+    @classmethod
+    def write(cls, created, updated, image_ids):
+        """!
+        Método que inserta y actualiza las personas y sus imágenes en una
+        transacción
+
+        @author William Páez (paez.william8 at gmail.com)
+        @raise IntegrityError si otra petición creó alguna de las cédulas
+        """
+
+        through = Person.images.through
+        fields = [field for field in cls.Meta.fields if field != 'images']
+        with transaction.atomic():
+            Person.objects.bulk_create(created, batch_size=cls.batch_size)
+            Person.objects.bulk_update(
+                updated, fields, batch_size=cls.batch_size
+            )
+            if any(person.pk is None for person in created):
+                # Motores que no devuelven los ids insertados
+                ids = cls.existing(
+                    Person.objects, 'id_number',
+                    [person.id_number for person in created], 'pk',
+                )
+                for person in created:
+                    person.pk = ids[person.id_number][1]
+            for chunk in cls.chunks(
+                person.pk for person in updated
+                if person.id_number in image_ids
+            ):
+                through.objects.filter(person_id__in=chunk).delete()
+            through.objects.bulk_create(
+                [
+                    through(person_id=person.pk, image_id=image_id)
+                    for person in created + updated
+                    for image_id in image_ids.get(person.id_number, ())
+                ],
+                batch_size=cls.batch_size,
+            )
+
+    @classmethod
+    def bulk_save(cls, records, user, upsert=False):
+        """!
+        Método que crea, o actualiza cuando upsert es verdadero, las personas
+        de un lote sin abortar por los registros inválidos
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param records <b>{list}</b> Registros con los campos de la persona
+        @param user <b>{object}</b> Usuario dueño de las personas
+        @param upsert <b>{bool}</b> Actualiza las personas con la misma cédula
+        @return dict con la cantidad de creados, actualizados y los errores
+            por índice del registro
+        """
+
+        errors = {}
+        rows = {}
+        for index, record in enumerate(records):
+            serializer = cls(data=record)
+            if serializer.is_valid():
+                rows[index] = serializer.validated_data
+            else:
+                errors[index] = serializer.errors
+
+        # Cédulas repetidas dentro del lote
+        seen = set()
+        for index, data in list(rows.items()):
+            if data['id_number'] in seen:
+                errors[index] = {
+                    'id_number': ['Cédula de identidad repetida en el lote.']
+                }
+                del rows[index]
+            seen.add(data['id_number'])
+
+        parishes = {
+            pk for pk in {data['parish_id'] for data in rows.values()}
+            if snapshot.exists(Parish, pk)
+        }
+        parishes.update(cls.existing(
+            Parish.objects, 'pk',
+            {data['parish_id'] for data in rows.values()} - parishes,
+        ))
+        images = cls.existing(
+            Image.objects, 'pk',
+            {pk for data in rows.values() for pk in data.get('images', ())},
+        )
+        people = cls.existing(
+            Person.objects, 'id_number',
+            {data['id_number'] for data in rows.values()}, 'pk', 'user_id',
+        )
+        for index, data in list(rows.items()):
+            error = {}
+            if data['parish_id'] not in parishes:
+                error['parish_id'] = ['Parroquia no encontrada.']
+            missing = data.get('images', set()) - images.keys()
+            if missing:
+                error['images'] = ['Imágenes no encontradas: %s' % ', '.join(
+                    str(pk) for pk in sorted(missing)
+                )]
+            person = people.get(data['id_number'])
+            if person is not None and not upsert:
+                error['id_number'] = [
+                    'Ya existe una persona con esta cédula de identidad.'
+                ]
+            elif person is not None and person[2] != user.pk:
+                error['id_number'] = [
+                    'Usted no tiene permiso para actualizar esta persona.'
+                ]
+            if error:
+                errors[index] = error
+                del rows[index]
+
+        created, updated, image_ids = [], [], {}
+        for data in rows.values():
+            data = dict(data)
+            if 'images' in data:
+                image_ids[data['id_number']] = data.pop('images')
+            person = Person(user_id=user.pk, **data)
+            if data['id_number'] in people:
+                person.pk = people[data['id_number']][1]
+                updated.append(person)
+            else:
+                created.append(person)
+
+        indexes = {data['id_number']: index for index, data in rows.items()}
+        while True:
+            try:
+                cls.write(created, updated, image_ids)
+                break
+            except IntegrityError:
+                # Otra petición creó alguna de las cédulas después de la
+                # consulta; esas se actualizan o se informan y se reintenta
+                people = cls.existing(
+                    Person.objects, 'id_number',
+                    [person.id_number for person in created], 'pk', 'user_id',
+                )
+                if not people:
+                    raise
+                remaining = []
+                for person in created:
+                    row = people.get(person.id_number)
+                    if row is None:
+                        person.pk = None
+                        remaining.append(person)
+                    elif upsert and row[2] == user.pk:
+                        person.pk = row[1]
+                        updated.append(person)
+                    else:
+                        errors[indexes[person.id_number]] = {'id_number': [
+                            'Usted no tiene permiso para actualizar esta '
+                            'persona.' if upsert else
+                            'Ya existe una persona con esta cédula de '
+                            'identidad.'
+                        ]}
+                        image_ids.pop(person.id_number, None)
+                created = remaining
+
+        return {
+            'created': len(created),
+            'updated': len(updated),
+            'errors': [
+                {'index': index, 'errors': errors[index]}
+                for index in sorted(errors)
+            ],
+        }
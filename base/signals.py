@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal
+
+from .models import (
+    City,
+    Country,
+    Municipality,
+    Parish,
+    State,
+)
+
+# Modelos de la jerarquía geográfica
+GEOGRAPHY_MODELS = (Country, State, Municipality, City, Parish)
+
+# Se envía con sender=<modelo> cuando cambian los datos de un modelo
+# geográfico, una vez confirmada la transacción. Los argumentos instance y
+# pk son None cuando el cambio fue una carga masiva.
+geography_changed = Signal()
+
+
+def geography_save_delete(sender, instance, **kwargs):
+    """!
+    Función que avisa de los cambios en los modelos geográficos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Django borra el pk de la instancia al eliminarla
+    pk = instance.pk
+    transaction.on_commit(
+        lambda: geography_changed.send(sender=sender, instance=instance, pk=pk)
+    )
+
+
+for model in GEOGRAPHY_MODELS:
+    post_save.connect(geography_save_delete, sender=model)
+    post_delete.connect(geography_save_delete, sender=model)
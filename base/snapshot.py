@@ -0,0 +1,374 @@
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from array import array
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import locks
+from django.db import connection
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    City,
+    Country,
+    Municipality,
+    Parish,
+    State,
+)
+from .signals import geography_changed
+
+# Modelos del snapshot con el campo del padre, en el orden del archivo
+SECTIONS = (
+    (Country, None),
+    (State, 'country'),
+    (Municipality, 'state'),
+    (City, 'state'),
+    (Parish, 'municipality'),
+)
+
+MAGIC = b'GEOS'
+FORMAT_VERSION = 2
+
+# Encabezado: magic, versión, cantidad de secciones y firma de los datos
+HEADER = struct.Struct('=4sII16s')
+
+# Por sección: id máximo, tamaño de la tabla hash y posición de los padres,
+# de los offsets de los nombres, de la tabla hash y de los nombres
+SECTION = struct.Struct('=6I')
+
+
+def get_path():
+    """!
+    Función que devuelve la ruta del snapshot de la base de datos actual
+
+    El nombre incluye la base de datos para que los tests o dos proyectos en
+    el mismo servidor no compartan el archivo
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    directory = getattr(
+        settings, 'GEOGRAPHY_SNAPSHOT_DIR', None
+    ) or tempfile.gettempdir()
+    name = hashlib.md5(
+        str(connection.settings_dict['NAME']).encode()
+    ).hexdigest()[:12]
+    return Path(directory) / ('geography-%s.snapshot' % name)
+
+
+def get_signature():
+    """!
+    Función que resume la cantidad y el id máximo de cada modelo, con lo que
+    un proceso que inicia sabe si el snapshot existente sigue al día sin
+    leer las tablas completas
+
+    Los cambios hechos con Django regeneran el snapshot al confirmarse; la
+    firma detecta las filas agregadas o eliminadas por fuera, por ejemplo
+    con el servidor detenido
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    values = []
+    for model, _ in SECTIONS:
+        stats = model.objects.aggregate(count=Count('pk'), last=Max('pk'))
+        values.append('%s:%s' % (stats['count'], stats['last'] or 0))
+    return hashlib.md5(','.join(values).encode()).digest()
+
+
+def read_signature(path):
+    """!
+    Función que devuelve la firma guardada en el snapshot, o None si no
+    existe o tiene otro formato
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    try:
+        with open(path, 'rb') as file:
+            header = file.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) < HEADER.size:
+        return None
+    magic, version, count, signature = HEADER.unpack(header)
+    if magic != MAGIC or version != FORMAT_VERSION or count != len(SECTIONS):
+        return None
+    return signature
+
+
+def hash_key(name, parent_id):
+    return zlib.crc32(('%s:%s' % (parent_id, name.casefold())).encode())
+
+
+def build_section(rows):
+    """!
+    Función que arma los arreglos de una sección a partir de las filas
+    (id, id del padre, nombre)
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    max_id = max((pk for pk, _, _ in rows), default=0)
+    parents = array('I', bytes(4 * (max_id + 1)))
+    names = {}
+    for pk, parent_id, name in rows:
+        parents[pk] = parent_id or 0
+        names[pk] = name.encode()
+    offsets = array('I', bytes(4 * (max_id + 2)))
+    blob = bytearray()
+    for pk in range(max_id + 1):
+        offsets[pk] = len(blob)
+        blob += names.get(pk, b'')
+    offsets[max_id + 1] = len(blob)
+    # Tabla hash con direccionamiento abierto, ocupada a lo sumo a la mitad
+    size = 1
+    while size < 2 * len(rows):
+        size *= 2
+    table = array('I', bytes(4 * size))
+    for pk, parent_id, name in rows:
+        slot = hash_key(name, parent_id or 0) & (size - 1)
+        while table[slot]:
+            slot = (slot + 1) & (size - 1)
+        table[slot] = pk
+    return max_id, parents, offsets, table, bytes(blob)
+
+
+def write_snapshot(path=None):
+    """!
+    Función que genera el snapshot desde la base de datos y lo reemplaza de
+    forma atómica
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return Path del snapshot
+    """
+
+    path = Path(path or get_path())
+    # La firma se lee antes que las filas, para que un cambio entre ambas
+    # lecturas deje el archivo como desactualizado
+    signature = get_signature()
+    sections = []
+    for model, parent in SECTIONS:
+        fields = ('pk', '%s_id' % parent, 'name') if parent else ('pk', 'name')
+        rows = model.objects.values_list(*fields)
+        if not parent:
+            rows = [(pk, 0, name) for pk, name in rows]
+        sections.append(build_section(list(rows)))
+
+    position = HEADER.size + SECTION.size * len(sections)
+    headers, chunks = [], []
+    for max_id, parents, offsets, table, blob in sections:
+        header = [max_id, len(table)]
+        for chunk in (parents.tobytes(), offsets.tobytes(), table.tobytes(), blob):
+            header.append(position)
+            chunks.append(chunk)
+            # Alinea a 4 bytes para leer los arreglos como enteros
+            padding = -len(chunk) % 4
+            chunks.append(b'\0' * padding)
+            position += len(chunk) + padding
+        headers.append(SECTION.pack(*header))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=path.parent, prefix=path.name)
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(HEADER.pack(
+                MAGIC, FORMAT_VERSION, len(sections), signature
+            ))
+            file.writelines(headers)
+            file.writelines(chunks)
+            file.flush()
+            os.fsync(file.fileno())
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+    return path
+
+
+class GeographySnapshot:
+    """!
+    Clase que lee el snapshot geográfico desde un archivo mapeado en memoria
+
+    Todos los procesos mapean el mismo archivo de solo lectura, por lo que
+    el sistema operativo comparte las páginas. Antes de cada consulta se
+    verifica si el archivo fue reemplazado para volver a mapearlo.
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stat = None
+        self.sections = {}
+
+    def load(self):
+        """!
+        Método que mapea el archivo si cambió desde la última lectura
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        if self.stat is None:
+            self.path = str(self.path or get_path())
+            self.refresh()
+        stat = os.stat(self.path)
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key == self.stat:
+            return
+        path = self.path
+        with open(path, 'rb') as file:
+            buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, count, _ = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != FORMAT_VERSION or count != len(SECTIONS):
+            raise ValueError('Snapshot geográfico inválido: %s' % path)
+        view = memoryview(buffer)
+        sections = {}
+        for i, (model, _) in enumerate(SECTIONS):
+            max_id, size, parents, offsets, table, names = SECTION.unpack_from(
+                buffer, HEADER.size + SECTION.size * i
+            )
+            sections[model] = (
+                max_id,
+                view[parents:parents + 4 * (max_id + 1)].cast('I'),
+                view[offsets:offsets + 4 * (max_id + 2)].cast('I'),
+                view[table:table + 4 * size].cast('I'),
+                view[names:],
+            )
+        self.sections = sections
+        self.stat = key
+
+    def refresh(self):
+        """!
+        Método que genera el archivo al iniciar el proceso solo si falta o
+        quedó desactualizado de una ejecución anterior. Los procesos que
+        inician a la vez esperan al primero en lugar de generarlo cada uno
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        signature = get_signature()
+        if read_signature(self.path) == signature:
+            return
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path + '.lock', 'wb') as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                if read_signature(self.path) != signature:
+                    write_snapshot(self.path)
+            finally:
+                locks.unlock(lock)
+
+    def name(self, model, pk):
+        """!
+        Método que devuelve el nombre de un id, o None si no existe
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        self.load()
+        max_id, _, offsets, _, names = self.sections[model]
+        if not 0 < pk <= max_id or offsets[pk] == offsets[pk + 1]:
+            return None
+        return bytes(names[offsets[pk]:offsets[pk + 1]]).decode()
+
+    def exists(self, model, pk):
+        return self.name(model, pk) is not None
+
+    def parent(self, model, pk):
+        """!
+        Método que devuelve el id del padre de un id, o None si no existe
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        self.load()
+        max_id, parents, offsets, _, _ = self.sections[model]
+        if not 0 < pk <= max_id or offsets[pk] == offsets[pk + 1]:
+            return None
+        return parents[pk] or None
+
+    def lookup(self, model, name, parent_id=None):
+        """!
+        Método que busca el id por nombre, sin distinguir mayúsculas, dentro
+        del padre indicado
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param model <b>{object}</b> Modelo geográfico
+        @param name <b>{str}</b> Nombre a buscar
+        @param parent_id <b>{int}</b> Id del padre, None para los países
+        @return int con el id o None si no existe
+        """
+
+        self.load()
+        _, parents, offsets, table, names = self.sections[model]
+        size = len(table)
+        parent_id = parent_id or 0
+        name = name.casefold()
+        slot = hash_key(name, parent_id) & (size - 1)
+        while table[slot]:
+            pk = table[slot]
+            if parents[pk] == parent_id and bytes(
+                names[offsets[pk]:offsets[pk + 1]]
+            ).decode().casefold() == name:
+                return pk
+            slot = (slot + 1) & (size - 1)
+        return None
+
+
+# Instancia compartida por el proceso
+snapshot = GeographySnapshot()
+
+
+# Cambios del hilo que aún no están en el snapshot
+pending = threading.local()
+
+
+def geography_pending(sender, **kwargs):
+    pending.changed = True
+
+
+for model, _ in SECTIONS:
+    post_save.connect(geography_pending, sender=model)
+    post_delete.connect(geography_pending, sender=model)
+
+
+@receiver(geography_changed)
+def geography_snapshot(sender, instance=None, **kwargs):
+    """!
+    Función que regenera el snapshot al cambiar la geografía
+
+    geography_changed se envía una vez por fila al confirmar la transacción;
+    la primera regeneración ya incluye todas las filas de la transacción, por
+    lo que los avisos siguientes se omiten. Las cargas masivas no envían
+    post_save y siempre regeneran
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if instance is not None and not getattr(pending, 'changed', False):
+        return
+    pending.changed = False
+    write_snapshot()
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import router, transaction
+from django.db.transaction import TransactionManagementError
+from django.utils.module_loading import import_string
+
+
+def get_image_storage():
+    """!
+    Función que devuelve el almacenamiento de Image.file, ver IMAGE_STORAGE
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    path = getattr(settings, 'IMAGE_STORAGE', None)
+    return import_string(path)() if path else default_storage
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """!
+    Clase que guarda cada archivo con el sha256 de su contenido como nombre,
+    por ejemplo images/3f/3f9a...c2.png, por lo que los archivos iguales
+    comparten un único archivo en disco
+
+    El hash se calcula mientras el archivo se escribe en un temporal de la
+    misma carpeta, que luego se renombra o se descarta si el contenido ya
+    existía. Varios registros pueden apuntar al mismo archivo, por lo que
+    solo se debe borrar cuando no quedan referencias (ver image_delete), y
+    la fila del Blob de cada archivo ordena los guardados y los borrados. Por
+    eso save() se debe llamar dentro de la transacción que guarda el registro
+    que usa el archivo, como hace Image.save
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # El nombre final depende del contenido y se decide en _save
+        return name
+
+    def get_digest_name(self, name, digest):
+        directory, filename = os.path.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return os.path.join(directory, digest[:2], digest + extension)
+
+    def lock(self, name):
+        """!
+        Método que escribe la fila del Blob antes de revisar el disco. Si se
+        está borrando el archivo espera a que termine, y mientras dure la
+        transacción del guardado el borrado espera, por lo que no puede
+        eliminar un archivo que una imagen nueva acaba de reutilizar
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        from .models import Blob
+
+        Blob.objects.bulk_create(
+            [Blob(name=name)], update_conflicts=True,
+            unique_fields=['name'], update_fields=['used_at'],
+        )
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        # Fuera de una transacción el bloqueo terminaría antes de guardar el
+        # registro que usa el archivo
+        if not transaction.get_connection(
+            router.db_for_write(Blob)
+        ).in_atomic_block:
+            raise TransactionManagementError(
+                'ContentAddressedStorage.save() se debe ejecutar dentro de '
+                'la transacción que guarda el registro que usa el archivo.'
+            )
+        directory = os.path.dirname(self.path(name))
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        if hasattr(content, 'temporary_file_path'):
+            # El archivo ya está en disco, se lee para el hash y se mueve
+            temp = content.temporary_file_path()
+            with open(temp, 'rb') as file:
+                for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                    digest.update(chunk)
+        else:
+            fd, temp = tempfile.mkstemp(dir=directory, prefix='.upload-')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    for chunk in content.chunks():
+                        digest.update(chunk)
+                        file.write(chunk)
+            except BaseException:
+                os.unlink(temp)
+                raise
+
+        name = self.get_digest_name(name, digest.hexdigest())
+        self.lock(name)
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # Mismo contenido ya guardado
+            if not hasattr(content, 'temporary_file_path'):
+                os.unlink(temp)
+            return name
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(temp, full_path, allow_overwrite=True)
+        else:
+            # Dos subidas simultáneas del mismo contenido escriben lo mismo
+            os.replace(temp, full_path)
+        os.chmod(full_path, self.file_permissions_mode or 0o644)
+        return name
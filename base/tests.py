@@ -1,3 +1,1335 @@
-from django.test import TestCase
+import gzip
+import hashlib
+import io
+import json
+import os
+import queue
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from auditlog.models import LogEntry
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.transaction import TransactionManagementError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+
+from . import audit
+from . import snapshot as snapshots
+from . import views
+from .autocomplete import PrefixIndex
+from .imaging import render
+from .search import PostgresSearchBackend, get_like_prefix
+from .serializers import PersonBulkSerializer
+from .signals import geography_changed
+from .storage import ContentAddressedStorage
+from .thumbnails import get_name, get_names
+from .uploads import get_path
+from .models import (
+    Blob,
+    City,
+    Country,
+    Image,
+    ImageUpload,
+    Municipality,
+    Parish,
+    Person,
+    State,
+)
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class PersonQueriesTest(TestCase):
+    """!
+    Clase que verifica que los endpoint de Person ejecutan un número
+    constante de consultas sin importar la cantidad de resultados
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        # El superusuario evita las consultas de permisos en cada petición
+        cls.user = User.objects.create_superuser(
+            'admin', 'admin@email.com', 'usuario12345'
+        )
+        country = Country.objects.create(name='Venezuela')
+        state = State.objects.create(name='Mérida', country=country)
+        municipality = Municipality.objects.create(
+            name='Libertador', state=state
+        )
+        cls.parish = Parish.objects.create(
+            name='Arias', municipality=municipality
+        )
+        cls.images = [
+            Image.objects.create(
+                name='imagen %s' % i,
+                file=SimpleUploadedFile('image%s.png' % i, b'image'),
+            )
+            for i in range(3)
+        ]
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_people(self, count):
+        """!
+        Método que crea personas del usuario con todas las imágenes
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        start = Person.objects.count()
+        for i in range(start, start + count):
+            person = Person.objects.create(
+                first_name='Nombres',
+                last_name='Apellidos',
+                id_number='V%08d' % i,
+                phone='+58-416-0000000',
+                email='nombres@email.com',
+                address='Dirección',
+                parish=self.parish,
+                user=self.user,
+            )
+            person.images.add(*self.images)
+        return person
+
+    def count_queries(self, method, url, data=None):
+        """!
+        Método que cuenta las consultas ejecutadas por una petición
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(url, data, format='json')
+        self.assertLess(response.status_code, 300, response.data)
+        return len(context.captured_queries)
+
+    def test_list(self):
+        self.create_people(1)
+        few = self.count_queries('get', '/api/people/')
+        self.create_people(20)
+        many = self.count_queries('get', '/api/people/')
+        self.assertEqual(few, many)
+        # Personas (con parroquia y usuario) + imágenes
+        with self.assertNumQueries(2):
+            self.client.get('/api/people/')
+
+    def test_retrieve(self):
+        person = self.create_people(1)
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/people/%s/' % person.pk)
+        self.assertEqual(len(response.data['images']), len(self.images))
+        self.assertEqual(response.data['parish']['name'], self.parish.name)
+        self.assertEqual(response.data['user']['username'], self.user.username)
+
+    def person_data(self, id_number, images):
+        """!
+        Método que arma los datos para crear o actualizar una persona
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        return {
+            'first_name': 'Nombres',
+            'last_name': 'Apellidos',
+            'id_number': id_number,
+            'phone': '+58-416-0000000',
+            'email': 'nombres@email.com',
+            'address': 'Dirección',
+            'parish_id': self.parish.pk,
+            'images': [{'id': image.pk} for image in images],
+        }
+
+    def test_create(self):
+        self.count_queries(
+            'post', '/api/people/', self.person_data('V00000001', [])
+        )
+        one = self.count_queries(
+            'post', '/api/people/', self.person_data('V00000002', self.images[:1])
+        )
+        many = self.count_queries(
+            'post', '/api/people/', self.person_data('V00000003', self.images)
+        )
+        self.assertEqual(one, many)
+        person = Person.objects.get(id_number='V00000003')
+        self.assertEqual(person.images.count(), len(self.images))
+
+    def test_update(self):
+        person = self.create_people(1)
+        person.images.set(self.images[:1])
+        url = '/api/people/%s/' % person.pk
+        # Cada actualización elimina y agrega relaciones
+        data = self.person_data(person.id_number, self.images[1:2])
+        one = self.count_queries('put', url, data)
+        data = self.person_data(person.id_number, self.images[::2])
+        many = self.count_queries('put', url, data)
+        self.assertEqual(one, many)
+        response = self.client.get(url)
+        self.assertEqual(
+            sorted(image['id'] for image in response.data['images']),
+            [image.pk for image in self.images[::2]],
+        )
+
+    def test_unknown_images(self):
+        data = self.person_data('V00000001', self.images)
+        data['images'].append({'id': 0})
+        response = self.client.post('/api/people/', data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Person.objects.filter(id_number='V00000001').exists())
+
+    @mock.patch.object(views.PersonViewSet, 'export_chunk_size', 2)
+    def test_export_ndjson(self):
+        self.create_people(4)
+        response = self.client.get('/api/people/export/')
+        self.assertEqual(response.status_code, 200)
+        chunks = [chunk.decode() for chunk in response.streaming_content]
+        # La primera fila sale sola y las demás por bloques
+        self.assertEqual([chunk.count('\n') for chunk in chunks], [1, 2, 1])
+        rows = [json.loads(line) for line in ''.join(chunks).splitlines()]
+        self.assertEqual(
+            [row['id_number'] for row in rows],
+            ['V%08d' % i for i in range(4)],
+        )
+        self.assertEqual(rows[0]['parish'], self.parish.name)
+        self.assertEqual(rows[0]['country'], 'Venezuela')
+
+    @mock.patch.object(views.PersonViewSet, 'export_chunk_size', 2)
+    def test_export_csv(self):
+        self.create_people(2)
+        response = self.client.get('/api/people/export/?output=csv')
+        chunks = [chunk.decode() for chunk in response.streaming_content]
+        self.assertEqual(len(chunks), 3)
+        self.assertTrue(chunks[0].startswith('pk,first_name,'))
+        self.assertIn('V00000000', chunks[1])
+        self.assertIn('V00000001', chunks[2])
+
+    def test_export_empty(self):
+        response = self.client.get('/api/people/export/')
+        self.assertEqual(list(response.streaming_content), [])
+        response = self.client.get('/api/people/export/?output=xml')
+        self.assertEqual(response.status_code, 400)
+
+
+class PersonBulkTest(TestCase):
+    """!
+    Clase que verifica la creación y actualización de personas en lote, los
+    errores por registro y el reintento cuando otra petición crea una cédula
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_superuser(
+            'admin', 'admin@email.com', 'usuario12345'
+        )
+        cls.other = User.objects.create_user('otro', 'otro@email.com', 'otro')
+        country = Country.objects.create(name='Venezuela')
+        state = State.objects.create(name='Mérida', country=country)
+        municipality = Municipality.objects.create(
+            name='Libertador', state=state
+        )
+        cls.parish = Parish.objects.create(
+            name='Arias', municipality=municipality
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def record(self, id_number, **kwargs):
+        return {
+            'first_name': 'Nombres',
+            'last_name': 'Apellidos',
+            'id_number': id_number,
+            'phone': '+58-416-0000000',
+            'email': 'nombres@email.com',
+            'address': 'Dirección',
+            'parish_id': self.parish.pk,
+            **kwargs,
+        }
+
+    def create_person(self, id_number, user):
+        return Person.objects.create(user=user, **self.record(id_number))
+
+    def post(self, records, upsert=False):
+        return self.client.post(
+            '/api/people/bulk/%s' % ('?upsert=true' if upsert else ''),
+            records, format='json',
+        )
+
+    def test_create(self):
+        response = self.post([
+            self.record('V00000001'),
+            self.record('V00000002'),
+            self.record('V00000001'),
+            self.record('X1'),
+            self.record('V00000003', parish_id=0),
+        ])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [error['index'] for error in response.data['errors']], [2, 3, 4]
+        )
+        self.assertEqual(
+            set(Person.objects.values_list('id_number', flat=True)),
+            {'V00000001', 'V00000002'},
+        )
+
+    def test_upsert(self):
+        self.create_person('V00000001', self.user)
+        self.create_person('V00000002', self.other)
+        response = self.post([
+            self.record('V00000001', first_name='Cambiado'),
+            self.record('V00000002'),
+        ])
+        self.assertEqual(response.data['created'], 0)
+        self.assertEqual(len(response.data['errors']), 2)
+        response = self.post([
+            self.record('V00000001', first_name='Cambiado'),
+            self.record('V00000002'),
+            self.record('V00000003'),
+        ], upsert=True)
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertEqual(
+            Person.objects.get(id_number='V00000001').first_name, 'Cambiado'
+        )
+
+    def test_conflict(self):
+        write = PersonBulkSerializer.write
+        calls = []
+
+        def concurrent(created, updated, image_ids):
+            # Otra petición crea dos de las cédulas después de la consulta
+            if not calls:
+                self.create_person('V00000001', self.user)
+                self.create_person('V00000002', self.other)
+            calls.append(len(created))
+            return write(created, updated, image_ids)
+
+        with mock.patch.object(
+            PersonBulkSerializer, 'write', side_effect=concurrent
+        ):
+            response = self.post([
+                self.record('V00000001', first_name='Cambiado'),
+                self.record('V00000002'),
+                self.record('V00000003'),
+            ], upsert=True)
+        self.assertEqual(calls, [3, 1])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['updated'], 1)
+        self.assertEqual(
+            [error['index'] for error in response.data['errors']], [1]
+        )
+        self.assertEqual(
+            Person.objects.get(id_number='V00000001').first_name, 'Cambiado'
+        )
+        self.assertEqual(Person.objects.count(), 3)
+
+    def test_conflict_without_upsert(self):
+        write = PersonBulkSerializer.write
+
+        def concurrent(created, updated, image_ids):
+            if not Person.objects.exists():
+                self.create_person('V00000001', self.other)
+            return write(created, updated, image_ids)
+
+        with mock.patch.object(
+            PersonBulkSerializer, 'write', side_effect=concurrent
+        ):
+            response = self.post([
+                self.record('V00000001'), self.record('V00000002'),
+            ])
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 0)
+        self.assertEqual(
+            Person.objects.get(id_number='V00000001').user, self.other
+        )
+
+
+class QueryPlanMixin:
+    """!
+    Clase que ejecuta EXPLAIN para cada filtro declarado en filterset_fields
+    y falla si el plan recorre una tabla completa
+
+    En PostgreSQL se desactiva el seq scan, que el planificador prefiere con
+    tablas vacías, por lo que un Seq Scan en el plan indica que no hay un
+    índice utilizable
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Patrones de un recorrido completo por motor de base de datos
+    full_scan = {
+        'sqlite': re.compile(r'\bSCAN (\w+)(?!\w| USING (COVERING )?INDEX)'),
+        'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    }
+
+    def get_viewsets(self, module):
+        return [
+            value for value in vars(module).values()
+            if isinstance(value, type) and getattr(value, 'filterset_fields', None)
+            and value.__module__ == module.__name__
+        ]
+
+    def get_plan(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+            try:
+                return queryset.explain()
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute('RESET enable_seqscan')
+        return queryset.explain()
+
+    def assertFiltersUseIndexes(self, module):
+        if connection.vendor not in self.full_scan:
+            self.skipTest('EXPLAIN no soportado en %s' % connection.vendor)
+        viewsets = self.get_viewsets(module)
+        self.assertTrue(viewsets)
+        for viewset in viewsets:
+            for field in viewset.filterset_fields:
+                with self.subTest(viewset=viewset.__name__, field=field):
+                    queryset = viewset.queryset.filter(**{field: 'valor'})
+                    plan = self.get_plan(queryset)
+                    self.assertIsNone(
+                        self.full_scan[connection.vendor].search(plan), plan
+                    )
+
+
+class QueryPlanTest(QueryPlanMixin, TestCase):
+    """!
+    Clase que verifica que los filtros de los viewsets de base usan índices
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def test_filters(self):
+        self.assertFiltersUseIndexes(views)
+
+    def test_person_list(self):
+        if connection.vendor not in self.full_scan:
+            self.skipTest('EXPLAIN no soportado en %s' % connection.vendor)
+        user = User.objects.create_user('usuario', 'usuario@email.com')
+        queryset = Person.objects.filter(user=user).order_by('id')[:100]
+        plan = self.get_plan(queryset)
+        self.assertIsNone(self.full_scan[connection.vendor].search(plan), plan)
+        # El orden sale del índice, sin ordenar las filas aparte
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertNotIn('Sort', plan)
+
+
+@override_settings(GEOGRAPHY_SNAPSHOT_DIR=MEDIA_ROOT)
+class PostgresSearchTest(TestCase):
+    """!
+    Clase que verifica la consulta del motor de búsqueda de PostgreSQL y el
+    escape de los comodines de LIKE
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def execute(self, query):
+        with mock.patch.object(connection, 'cursor') as cursor:
+            PostgresSearchBackend().search(1, query, 10, 0)
+        return cursor.return_value.__enter__.return_value.execute.call_args[0]
+
+    def test_like_prefix(self):
+        self.assertEqual(get_like_prefix('V12'), 'V12%')
+        self.assertEqual(get_like_prefix('a_b%c\\'), 'a\\_b\\%c\\\\%')
+
+    def test_id_number(self):
+        sql, params = self.execute('v1234')
+        self.assertIn("id_number LIKE %s ESCAPE", sql)
+        self.assertIn('V1234%', params)
+        # Solo se busca por prefijo de cédula con un único término
+        for query in ('v1234 pérez', 'pedro', 'V_'):
+            sql, params = self.execute(query)
+            self.assertNotIn('LIKE', sql)
+            self.assertEqual(sql.count('%s'), len(params))
+
+
+class PrefixIndexTest(TestCase):
+    """!
+    Clase que verifica que los cambios incrementales del índice de
+    autocompletado no modifican las listas que está leyendo una búsqueda
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        country = Country.objects.create(name='Venezuela')
+        self.state = State.objects.create(name='Mérida', country=country)
+        self.municipality = Municipality.objects.create(
+            name='Libertador', state=self.state
+        )
+        self.index = PrefixIndex(Municipality, 'state')
+        self.index.build()
+
+    def search(self, prefix):
+        return [pk for pk, *_ in self.index.search(prefix, self.state.pk)]
+
+    def test_update(self):
+        rows, entries = self.index.state
+        snapshot = {group: list(values) for group, values in entries.items()}
+        other = Municipality.objects.create(name='Santos Marquina', state=self.state)
+        self.index.update(other.pk)
+        self.municipality.name = 'Campo Elías'
+        self.municipality.save()
+        self.index.update(self.municipality.pk)
+        # Las listas anteriores siguen intactas para quien las esté leyendo
+        self.assertEqual(entries, snapshot)
+        self.assertEqual(list(rows), [self.municipality.pk])
+        self.assertEqual(self.search('marq'), [other.pk])
+        self.assertEqual(self.search('eli'), [self.municipality.pk])
+        self.assertEqual(self.search('lib'), [])
+        pk = other.pk
+        other.delete()
+        self.index.update(pk)
+        self.assertEqual(self.search('s'), [])
+        self.assertEqual(self.index.search('c'), [
+            (self.municipality.pk, 'Campo Elías', self.state.pk),
+        ])
+
+
+class GeographySnapshotTest(TestCase):
+    """!
+    Clase que verifica las consultas del snapshot geográfico y que el
+    archivo solo se regenera cuando hace falta
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.country = Country.objects.create(name='Venezuela')
+            self.state = State.objects.create(
+                name='Mérida', country=self.country
+            )
+            self.municipality = Municipality.objects.create(
+                name='Libertador', state=self.state
+            )
+            self.parish = Parish.objects.create(
+                name='Arias', municipality=self.municipality
+            )
+
+    def tearDown(self):
+        path = snapshots.get_path()
+        path.unlink(missing_ok=True)
+        path.with_name(path.name + '.lock').unlink(missing_ok=True)
+
+    def test_lookups(self):
+        snapshot = snapshots.GeographySnapshot()
+        self.assertEqual(snapshot.name(State, self.state.pk), 'Mérida')
+        self.assertTrue(snapshot.exists(Parish, self.parish.pk))
+        self.assertFalse(snapshot.exists(Parish, self.parish.pk + 1))
+        self.assertFalse(snapshot.exists(Parish, 0))
+        self.assertEqual(
+            snapshot.parent(Parish, self.parish.pk), self.municipality.pk
+        )
+        self.assertIsNone(snapshot.parent(Country, self.country.pk))
+        self.assertEqual(snapshot.lookup(Country, 'VENEZUELA'), self.country.pk)
+        self.assertEqual(
+            snapshot.lookup(State, 'mérida', self.country.pk), self.state.pk
+        )
+        self.assertIsNone(snapshot.lookup(State, 'Mérida', self.country.pk + 1))
+        self.assertIsNone(snapshot.lookup(State, 'Zulia', self.country.pk))
+
+    def test_replace(self):
+        snapshot = snapshots.GeographySnapshot()
+        self.assertEqual(snapshot.name(Parish, self.parish.pk), 'Arias')
+        sections = snapshot.sections
+        with self.captureOnCommitCallbacks(execute=True):
+            parish = Parish.objects.create(
+                name='Milla', municipality=self.municipality
+            )
+        self.assertTrue(snapshot.exists(Parish, parish.pk))
+        # El mapeo anterior sigue siendo válido para quien lo esté leyendo
+        names = sections[Parish][4]
+        offsets = sections[Parish][2]
+        self.assertEqual(bytes(
+            names[offsets[self.parish.pk]:offsets[self.parish.pk + 1]]
+        ), b'Arias')
+
+    def test_one_write_per_transaction(self):
+        with mock.patch.object(
+            snapshots, 'write_snapshot', wraps=snapshots.write_snapshot
+        ) as write:
+            with self.captureOnCommitCallbacks(execute=True):
+                Parish.objects.bulk_create([
+                    Parish(name='Parroquia %s' % i,
+                           municipality=self.municipality)
+                    for i in range(3)
+                ])
+                for parish in Parish.objects.all():
+                    parish.save()
+            self.assertEqual(write.call_count, 1)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.parish.delete()
+            self.assertEqual(write.call_count, 2)
+        self.assertEqual(
+            snapshots.GeographySnapshot().lookup(
+                Parish, 'Parroquia 2', self.municipality.pk
+            ),
+            Parish.objects.get(name='Parroquia 2').pk,
+        )
+
+    def test_write_when_stale(self):
+        snapshots.GeographySnapshot().load()
+        with mock.patch.object(
+            snapshots, 'write_snapshot', wraps=snapshots.write_snapshot
+        ) as write:
+            snapshots.GeographySnapshot().load()
+            self.assertEqual(write.call_count, 0)
+            # Filas agregadas sin señales, por ejemplo con el servidor detenido
+            Parish.objects.bulk_create(
+                [Parish(name='Milla', municipality=self.municipality)]
+            )
+            snapshot = snapshots.GeographySnapshot()
+            self.assertIsNotNone(
+                snapshot.lookup(Parish, 'Milla', self.municipality.pk)
+            )
+            self.assertEqual(write.call_count, 1)
+
+
+class GeographyTreeTest(TestCase):
+    """!
+    Clase que verifica el ETag de cada codificación del árbol geográfico y
+    las respuestas 304
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        country = Country.objects.create(name='Venezuela')
+        State.objects.create(name='Mérida', country=country)
+        self.client = APIClient()
+        self.client.force_authenticate(
+            User.objects.create_superuser('admin', 'a@a.com', 'admin')
+        )
+
+    def get(self, **headers):
+        return self.client.get('/api/countries/tree/', headers=headers)
+
+    def test_encodings(self):
+        identity = self.get()
+        self.assertEqual(identity.status_code, 200)
+        self.assertEqual(json.loads(identity.content)[0]['name'], 'Venezuela')
+        compressed = self.get(accept_encoding='gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertNotEqual(identity['ETag'], compressed['ETag'])
+        # El ETag de una codificación no valida la otra
+        response = self.get(if_none_match=compressed['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, identity.content)
+
+    def test_not_modified(self):
+        etag = self.get()['ETag']
+        for value in (etag, 'W/%s' % etag, '"otro", %s' % etag, '*'):
+            response = self.get(if_none_match=value)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+        # Un ETag que contiene al actual no coincide
+        response = self.get(if_none_match='"x%s' % etag[1:])
+        self.assertEqual(response.status_code, 200)
+        etag = self.get(accept_encoding='gzip')['ETag']
+        response = self.get(accept_encoding='gzip', if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+class LoadGeographyTest(TestCase):
+    """!
+    Clase que verifica la carga de la jerarquía geográfica desde CSV y JSON
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.senders = []
+        receiver = lambda sender, **kwargs: self.senders.append(sender)
+        geography_changed.connect(receiver)
+        self.addCleanup(geography_changed.disconnect, receiver)
+
+    def tearDown(self):
+        path = snapshots.get_path()
+        path.unlink(missing_ok=True)
+        path.with_name(path.name + '.lock').unlink(missing_ok=True)
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def load(self, path, *args):
+        output = StringIO()
+        call_command('load_geography', path, *args, stdout=output)
+        return output.getvalue()
+
+    def names(self, model):
+        return sorted(model.objects.values_list('name', flat=True))
+
+    def test_csv(self):
+        path = self.write('geografia.csv', (
+            'country,state,municipality,parish,city\n'
+            'Venezuela,Mérida,Libertador,Arias,Mérida\n'
+            'Venezuela,Mérida,Libertador,Sagrario,\n'
+            'Venezuela,Mérida,Campo Elías,Matriz,Ejido\n'
+            'Colombia,,,,\n'
+        ))
+        self.load(path)
+        self.assertEqual(self.names(Country), ['Colombia', 'Venezuela'])
+        self.assertEqual(self.names(Municipality), ['Campo Elías', 'Libertador'])
+        self.assertEqual(self.names(Parish), ['Arias', 'Matriz', 'Sagrario'])
+        self.assertEqual(self.names(City), ['Ejido', 'Mérida'])
+        self.assertEqual(
+            Parish.objects.get(name='Matriz').municipality.name, 'Campo Elías'
+        )
+        self.assertCountEqual(
+            self.senders, [Country, State, Municipality, City, Parish]
+        )
+        # Con el mismo archivo no cambia nada
+        self.senders.clear()
+        self.assertIn('parroquias: 0 nuevos', self.load(path).lower())
+        self.assertEqual(Parish.objects.count(), 3)
+        self.assertEqual(self.senders, [])
+
+    def test_json(self):
+        path = self.write('geografia.json', json.dumps([{
+            'name': 'Venezuela',
+            'states': [{
+                'name': 'Mérida',
+                'municipalities': [{
+                    'name': 'Libertador', 'parishes': ['Arias'],
+                }],
+                'cities': ['Mérida'],
+            }],
+        }]))
+        self.load(path, '--dry-run')
+        self.assertFalse(Country.objects.exists())
+        self.load(path)
+        self.assertEqual(
+            Parish.objects.get().municipality.state.country.name, 'Venezuela'
+        )
+        self.assertEqual(City.objects.get().state.name, 'Mérida')
+
+    def test_moved_state(self):
+        country = Country.objects.create(name='Colombia')
+        State.objects.create(name='Mérida', country=country)
+        self.load(self.write('geografia.csv', (
+            'country,state,municipality,parish,city\nVenezuela,Mérida,,,\n'
+        )))
+        self.assertEqual(State.objects.get().country.name, 'Venezuela')
+
+    def test_errors(self):
+        for content in (
+            'country,state,municipality,parish,city\n,Mérida,,,\n',
+            'country,state,municipality,parish,city\n'
+            'Venezuela,Mérida,,,\nColombia,Mérida,,,\n',
+            'country,state,municipality,parish,city\nVenezuela,Mérida,,Arias,\n',
+        ):
+            with self.assertRaises(CommandError):
+                self.load(self.write('geografia.csv', content))
+        self.assertFalse(Country.objects.exists())
+        with self.assertRaises(CommandError):
+            self.load(self.write('geografia.txt', ''))
+
+
+def create_png(size=(400, 300), color='red'):
+    file = io.BytesIO()
+    PILImage.new('RGB', size, color).save(file, format='PNG')
+    return file.getvalue()
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_ROOT,
+    IMAGE_DERIVATIVES={'small': (100, 100)},
+    IMAGE_DERIVATIVES_WEBP=True,
+    IMAGE_DERIVATIVES_WORKERS=0,
+)
+class DerivativesTest(TestCase):
+    """!
+    Clase que verifica los nombres, la generación y el borrado de las
+    derivadas de las imágenes
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def create_image(self, content, name='foto.png'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Image.objects.create(
+                name='imagen', file=SimpleUploadedFile(name, content)
+            )
+
+    def delete_image(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+
+    def test_names(self):
+        self.assertEqual(
+            get_name('images/ab/abcd.png', 'small'), 'images/ab/abcd@small.png'
+        )
+        self.assertEqual(
+            get_name('images/ab/abcd.png', 'small', 'webp'),
+            'images/ab/abcd@small.webp',
+        )
+        self.assertEqual(get_names('images/a.jpg'), {
+            ('small', None): 'images/a@small.jpg',
+            ('small', 'webp'): 'images/a@small.webp',
+        })
+        with self.settings(IMAGE_DERIVATIVES_WEBP=False):
+            self.assertEqual(list(get_names('images/a.jpg').values()), [
+                'images/a@small.jpg'
+            ])
+
+    def test_render(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        source = os.path.join(directory, 'foto.png')
+        with open(source, 'wb') as file:
+            file.write(create_png())
+        targets = [
+            (os.path.join(directory, 'foto@small.png'), (100, 100), None),
+            (os.path.join(directory, 'foto@small.webp'), (100, 100), 'WEBP'),
+        ]
+        self.assertEqual(render(source, targets, 85), 2)
+        # Las derivadas al día se omiten
+        self.assertEqual(render(source, targets, 85), 0)
+        self.assertEqual(sorted(os.listdir(directory)), [
+            'foto.png', 'foto@small.png', 'foto@small.webp'
+        ])
+        with PILImage.open(targets[0][0]) as image:
+            self.assertEqual((image.format, image.size), ('PNG', (100, 75)))
+        with PILImage.open(targets[1][0]) as image:
+            self.assertEqual(image.format, 'WEBP')
+
+    def test_delete(self):
+        content = create_png()
+        image = self.create_image(content)
+        copy = self.create_image(content, 'copia.png')
+        self.assertEqual(image.file.name, copy.file.name)
+        storage = image.file.storage
+        names = [image.file.name, *get_names(image.file.name).values()]
+        for name in names:
+            self.assertTrue(storage.exists(name), name)
+        # El archivo se conserva mientras otra imagen lo use
+        self.delete_image(image)
+        for name in names:
+            self.assertTrue(storage.exists(name), name)
+        self.delete_image(copy)
+        for name in names:
+            self.assertFalse(storage.exists(name), name)
+
+    def test_generate_derivatives(self):
+        with self.settings(IMAGE_DERIVATIVES={}):
+            image = self.create_image(create_png(color='blue'))
+        names = get_names(image.file.name).values()
+        self.assertFalse(any(
+            image.file.storage.exists(name) for name in names
+        ))
+        stdout = io.StringIO()
+        call_command('generate_derivatives', workers=1, stdout=stdout)
+        self.assertIn('2 derivadas generadas, 0 imágenes', stdout.getvalue())
+        for name in names:
+            self.assertTrue(image.file.storage.exists(name), name)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_DERIVATIVES={})
+class ContentAddressedStorageTest(TestCase):
+    """!
+    Clase que verifica que las imágenes con el mismo contenido comparten el
+    archivo y que se borra con la última referencia
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def create_image(self, content, name='foto.PNG'):
+        return Image.objects.create(
+            name='imagen', file=SimpleUploadedFile(name, content)
+        )
+
+    def test_dedup(self):
+        first = self.create_image(b'contenido')
+        second = self.create_image(b'contenido', 'otra.png')
+        other = self.create_image(b'otro contenido')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertNotEqual(first.file.name, other.file.name)
+        digest = hashlib.sha256(b'contenido').hexdigest()
+        self.assertEqual(
+            first.file.name, 'images/%s/%s.png' % (digest[:2], digest)
+        )
+        directory = os.path.dirname(first.file.path)
+        self.assertEqual(os.listdir(directory), ['%s.png' % digest])
+        self.assertEqual(first.file.read(), b'contenido')
+        self.assertTrue(Blob.objects.filter(name=first.file.name).exists())
+
+    def test_delete_last_reference(self):
+        first = self.create_image(b'contenido')
+        second = self.create_image(b'contenido')
+        path = first.file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(Blob.objects.exists())
+        # El contenido se puede volver a guardar
+        third = self.create_image(b'contenido')
+        self.assertEqual(third.file.path, path)
+        self.assertTrue(os.path.exists(path))
+
+
+class ContentAddressedStorageTransactionTest(TransactionTestCase):
+    """!
+    Clase que verifica que el almacenamiento exige una transacción
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def test_requires_transaction(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage = ContentAddressedStorage(location=location)
+        with self.assertRaises(TransactionManagementError):
+            storage.save('images/foto.png', SimpleUploadedFile('f', b'x'))
+        # No queda el archivo temporal
+        self.assertEqual(os.listdir(location), [])
+        with transaction.atomic():
+            name = storage.save(
+                'images/foto.png', SimpleUploadedFile('f', b'x')
+            )
+        self.assertTrue(storage.exists(name))
+
+
+class MediaViewTest(TestCase):
+    """!
+    Clase que verifica el envío de los archivos media con Range, ETag y las
+    respuestas condicionales
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = self.settings(
+            MEDIA_ROOT=self.root, MEDIA_SERVE_MODE='django'
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.digest = hashlib.sha256(b'imagen').hexdigest()
+        self.write('docs/archivo.txt', b'0123456789')
+        self.write(
+            'images/%s/%s.png' % (self.digest[:2], self.digest), b'imagen'
+        )
+        self.client = APIClient()
+
+    def write(self, name, content):
+        path = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as file:
+            file.write(content)
+
+    def get(self, name, **headers):
+        return self.client.get('/media/%s' % name, headers=headers)
+
+    def test_full(self):
+        response = self.get('docs/archivo.txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+        self.assertEqual(self.get('docs/otro.txt').status_code, 404)
+        self.assertEqual(self.get('docs').status_code, 404)
+        self.assertEqual(self.get('../settings.py').status_code, 404)
+
+    def test_etag(self):
+        response = self.get('docs/archivo.txt')
+        stat = os.stat(os.path.join(self.root, 'docs/archivo.txt'))
+        self.assertEqual(
+            response['ETag'], '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+        )
+        response = self.get('images/%s/%s.png' % (self.digest[:2], self.digest))
+        # El ETag sale del nombre, sin leer el archivo
+        self.assertEqual(response['ETag'], '"%s"' % self.digest[:32])
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_not_modified(self):
+        etag = self.get('docs/archivo.txt')['ETag']
+        response = self.get('docs/archivo.txt', if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        response = self.get('docs/archivo.txt', if_none_match='"otro", %s' % etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.get('docs/archivo.txt', if_none_match='"otro"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_range(self):
+        response = self.get('docs/archivo.txt', range='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(response['Content-Length'], '4')
+        response = self.get('docs/archivo.txt', range='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+        response = self.get('docs/archivo.txt', range='bytes=8-')
+        self.assertEqual(b''.join(response.streaming_content), b'89')
+
+    def test_range_not_satisfiable(self):
+        response = self.get('docs/archivo.txt', range='bytes=10-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10')
+        # Un rango que no se entiende se ignora
+        response = self.get('docs/archivo.txt', range='bytes=1-2,4-5')
+        self.assertEqual(response.status_code, 200)
+
+    def test_if_range(self):
+        etag = self.get('docs/archivo.txt')['ETag']
+        response = self.get('docs/archivo.txt', range='bytes=0-1', if_range=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.get(
+            'docs/archivo.txt', range='bytes=0-1', if_range='"otro"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+
+    def test_x_accel(self):
+        with self.settings(MEDIA_SERVE_MODE='x-accel'):
+            with mock.patch('builtins.open', side_effect=AssertionError):
+                response = self.get(
+                    'images/%s/%s.png' % (self.digest[:2], self.digest)
+                )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            '/protected-media/images/%s/%s.png' % (self.digest[:2], self.digest),
+        )
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+
+class ImageUploadTest(TestCase):
+    """!
+    Clase que verifica la subida de imágenes por partes, su continuación
+    después de un corte y la purga de las subidas abandonadas
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        override = self.settings(
+            MEDIA_ROOT=os.path.join(self.root, 'media'),
+            IMAGE_UPLOAD_DIR=os.path.join(self.root, 'uploads'),
+            IMAGE_DERIVATIVES={},
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create_superuser('admin', 'a@a.com', 'admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.content = create_png()
+
+    def create_upload(self, content=None):
+        content = content or self.content
+        response = self.client.post('/api/image-uploads/', {
+            'name': 'imagen',
+            'filename': 'foto.png',
+            'size': len(self.content),
+            'checksum': hashlib.sha256(content).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    def patch(self, pk, offset, part, length=None):
+        # length mayor que la parte simula un cliente que corta la conexión
+        length = len(part) if length is None else length
+        return self.client.generic(
+            'PATCH', '/api/image-uploads/%s/' % pk, part,
+            content_type='application/offset+octet-stream',
+            HTTP_UPLOAD_OFFSET=str(offset),
+            CONTENT_LENGTH=str(length),
+            **{'wsgi.input': io.BytesIO(part)}
+        )
+
+    def test_conflict(self):
+        pk = self.create_upload()
+        response = self.patch(pk, 5, self.content[:5])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response['Upload-Offset'], '0')
+
+    def test_resume(self):
+        pk = self.create_upload()
+        response = self.patch(pk, 0, self.content[:5], length=10)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(response['Upload-Offset'], '5')
+        response = self.client.get('/api/image-uploads/%s/' % pk)
+        self.assertEqual(response.data['offset'], 5)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.patch(pk, 5, self.content[5:])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Image.objects.get().name, 'imagen')
+        self.assertFalse(ImageUpload.objects.exists())
+        self.assertFalse(
+            os.listdir(os.path.join(self.root, 'uploads'))
+        )
+
+    def test_checksum(self):
+        pk = self.create_upload(b'otro')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.patch(pk, 0, self.content)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Image.objects.exists())
+        self.assertFalse(ImageUpload.objects.exists())
+        self.assertEqual(self.patch(pk, 0, b'').status_code, 404)
+
+    def test_purge(self):
+        active = ImageUpload.objects.get(pk=self.create_upload())
+        idle = ImageUpload.objects.get(pk=self.create_upload())
+        self.patch(active.pk, 0, self.content[:5])
+        # Las dos se crearon hace dos días, pero solo una sigue recibiendo
+        # partes
+        ImageUpload.objects.update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        old = time.time() - 2 * 24 * 60 * 60
+        os.utime(get_path(idle), (old, old))
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('purge_uploads', stdout=StringIO())
+        self.assertEqual(
+            list(ImageUpload.objects.values_list('pk', flat=True)),
+            [active.pk],
+        )
+        self.assertTrue(get_path(active).exists())
+        self.assertFalse(get_path(idle).exists())
+
+
+class AuditBufferTest(TransactionTestCase):
+    """!
+    Clase que verifica que las entradas de auditoría de una petición se
+    insertan juntas, con el usuario de DRF y la IP, y que las de una
+    transacción revertida se descartan
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_superuser(
+            'admin', 'admin@email.com', 'usuario12345'
+        )
+        self.client = APIClient()
+        # Sin sesión, el middleware de auditlog no conoce al usuario
+        self.client.force_authenticate(self.user)
+        LogEntry.objects.all().delete()
+
+    def post(self, name):
+        return self.client.post(
+            '/api/countries/', {'name': name}, format='json',
+            REMOTE_ADDR='10.1.2.3',
+        )
+
+    def assertEntries(self, names):
+        self.assertEqual(
+            sorted(LogEntry.objects.values_list(
+                'object_repr', 'actor_id', 'remote_addr'
+            )),
+            [(name, self.user.pk, '10.1.2.3') for name in names],
+        )
+
+    def test_manager(self):
+        self.assertIsInstance(LogEntry.objects, audit.BufferedLogEntryManager)
+        self.assertIs(LogEntry._default_manager, LogEntry.objects)
+
+    def test_request(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.post('Venezuela').status_code, 201)
+        inserts = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('INSERT INTO "auditlog_logentry"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEntries(['Venezuela'])
+
+    def test_rollback(self):
+        entries = []
+        token = audit.audit_entries.set(entries)
+        try:
+            with self.assertRaises(ValueError):
+                with transaction.atomic():
+                    Country.objects.create(name='Revertido')
+                    raise ValueError()
+            self.assertEqual(entries, [])
+            with transaction.atomic():
+                Country.objects.create(name='Venezuela')
+        finally:
+            audit.audit_entries.reset(token)
+        self.assertEqual([entry.object_repr for entry in entries], ['Venezuela'])
+        # Hasta escribir el lote no se inserta nada
+        self.assertFalse(LogEntry.objects.exists())
+        audit.write(entries)
+        self.assertEqual(LogEntry.objects.get().object_repr, 'Venezuela')
+
+    @override_settings(AUDITLOG_BUFFER_MODE='background')
+    def test_background(self):
+        writer = audit.AuditWriter()
+        with mock.patch.object(audit, 'writer', writer):
+            self.assertEqual(self.post('Venezuela').status_code, 201)
+            self.assertEqual(self.post('Colombia').status_code, 201)
+            writer.stop()
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEntries(['Colombia', 'Venezuela'])
+
+    @override_settings(AUDITLOG_BUFFER_MODE='background')
+    def test_background_full(self):
+        writer = audit.AuditWriter()
+        # Un hilo ocupado con la cola llena
+        writer.thread = mock.Mock()
+        writer.queue = queue.Queue(1)
+        writer.queue.put([])
+        with mock.patch.object(audit, 'writer', writer):
+            self.assertEqual(self.post('Venezuela').status_code, 201)
+        # La petición escribió sus propias entradas
+        self.assertEntries(['Venezuela'])
+
+
+class ArchiveAuditlogTest(TestCase):
+    """!
+    Clase que verifica el archivo de las entradas de auditoría antiguas en
+    JSONL comprimido y su restauración
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        LogEntry.objects.all().delete()
+        for i in range(12):
+            Country.objects.create(name='País %s' % i)
+        self.ids = list(LogEntry.objects.order_by('pk').values_list('pk', flat=True))
+        # Las primeras diez superan la retención
+        LogEntry.objects.filter(pk__lte=self.ids[9]).update(
+            timestamp=timezone.now() - timedelta(days=400)
+        )
+
+    def call(self, *args, **kwargs):
+        call_command(
+            'archive_auditlog', *args, dir=self.directory, stdout=StringIO(),
+            **kwargs
+        )
+
+    def read(self):
+        ids = []
+        for name in sorted(os.listdir(self.directory)):
+            with gzip.open(os.path.join(self.directory, name), 'rt') as file:
+                ids += [json.loads(line)['id'] for line in file]
+        return ids
+
+    def test_archive(self):
+        self.call(chunk_size=4, delete_batch=3)
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        self.assertEqual(self.read(), self.ids[:10])
+        self.assertEqual(
+            list(LogEntry.objects.order_by('pk').values_list('pk', flat=True)),
+            self.ids[10:],
+        )
+        # Sin entradas antiguas no se crea otro archivo
+        self.call()
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+
+    def test_rehydrate(self):
+        entry = LogEntry.objects.get(pk=self.ids[3])
+        self.call(chunk_size=4)
+        self.call(rehydrate=True, from_id=self.ids[2], to_id=self.ids[4])
+        self.assertEqual(
+            sorted(LogEntry.objects.filter(
+                pk__lt=self.ids[10]
+            ).values_list('pk', flat=True)),
+            self.ids[2:5],
+        )
+        restored = LogEntry.objects.get(pk=self.ids[3])
+        for field in (
+            'content_type', 'object_pk', 'object_repr', 'action', 'changes',
+            'timestamp',
+        ):
+            self.assertEqual(getattr(restored, field), getattr(entry, field))
+        # Restaurar de nuevo no duplica las entradas
+        self.call(rehydrate=True, from_id=self.ids[2], to_id=self.ids[4])
+        self.assertEqual(LogEntry.objects.count(), 5)
+        # Al archivar otra vez solo se borran, ya están en un archivo
+        self.call(chunk_size=4)
+        self.assertEqual(self.read(), self.ids[:10])
+        self.assertEqual(LogEntry.objects.count(), 2)
+
+    def test_without_directory(self):
+        with self.assertRaises(CommandError):
+            call_command('archive_auditlog', dir='', stdout=StringIO())
@@ -0,0 +1,180 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .imaging import render
+from .models import Image
+
+logger = logging.getLogger(__name__)
+
+# Formato de las variantes WebP
+WEBP = 'webp'
+
+
+def get_context():
+    """!
+    Función que devuelve el contexto de los procesos del pool. El pool se
+    crea dentro de un worker del servidor que ya tiene otros hilos, y un
+    fork mientras otro hilo tiene un lock (logging, el driver de la base de
+    datos) puede bloquear al hijo, por lo que los procesos se inician con
+    forkserver o spawn
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context(
+        'forkserver' if 'forkserver' in methods else 'spawn'
+    )
+
+
+def get_sizes():
+    return getattr(settings, 'IMAGE_DERIVATIVES', {})
+
+
+def get_name(name, size, extension=None):
+    """!
+    Función que devuelve el nombre de una derivada junto al original, por
+    ejemplo images/foto@small.jpg o images/foto@small.webp
+
+    Django quita la @ de los nombres subidos, por lo que una derivada no
+    puede coincidir con otro original
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    root, original = os.path.splitext(name)
+    return '%s@%s%s' % (
+        root, size, '.%s' % extension if extension else original
+    )
+
+
+def get_names(name):
+    """!
+    Función que devuelve los nombres de todas las derivadas de un archivo por
+    tamaño y formato (None para el formato del original)
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    formats = [None]
+    if getattr(settings, 'IMAGE_DERIVATIVES_WEBP', True):
+        formats.append(WEBP)
+    return {
+        (size, extension): get_name(name, size, extension)
+        for size in get_sizes() for extension in formats
+    }
+
+
+def get_task(file):
+    """!
+    Función que arma los argumentos de render para el archivo de una imagen
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    sizes = get_sizes()
+    targets = [
+        (
+            file.storage.path(name), tuple(sizes[size]),
+            WEBP.upper() if extension else None,
+        )
+        for (size, extension), name in get_names(file.name).items()
+    ]
+    quality = getattr(settings, 'IMAGE_DERIVATIVES_QUALITY', 85)
+    return file.storage.path(file.name), targets, quality
+
+
+class DerivativePool:
+    """!
+    Clase que genera las derivadas en un pool de procesos
+
+    Redimensionar y codificar es trabajo de CPU que no libera el GIL, por lo
+    que se hace en procesos aparte y no en los hilos que atienden las
+    peticiones. Con IMAGE_DERIVATIVES_WORKERS = 0 se generan en el mismo
+    proceso
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """!
+        Método que crea el pool en el primer uso del proceso, después del fork
+        de los workers del servidor
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=get_context()
+                )
+
+    def submit(self, file):
+        """!
+        Método que encola la generación de las derivadas de un archivo
+
+        @author William Páez (paez.william8 at gmail.com)
+        @return Future con el resultado de render, o el resultado si se
+            generan en el mismo proceso
+        """
+
+        if self.workers is None:
+            self.workers = getattr(settings, 'IMAGE_DERIVATIVES_WORKERS', 2)
+        if self.workers == 0:
+            return render(*get_task(file))
+        if self.executor is None:
+            self.start()
+        future = self.executor.submit(render, *get_task(file))
+        future.add_done_callback(self.done)
+        return future
+
+    def done(self, future):
+        if future.exception() is not None:
+            logger.error(
+                'No se pudieron generar las derivadas de una imagen',
+                exc_info=future.exception(),
+            )
+
+
+# Pool compartido por el proceso
+pool = DerivativePool()
+
+
+@receiver(post_save, sender=Image)
+def image_derivatives(sender, instance, **kwargs):
+    """!
+    Función que genera las derivadas de la imagen una vez confirmada la
+    transacción
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if instance.file and get_sizes():
+        file = instance.file
+        transaction.on_commit(lambda: pool.submit(file), robust=True)
@@ -0,0 +1,244 @@
+import hashlib
+import mimetypes
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files import locks
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import ImageUpload
+
+# Bytes leídos de la petición en cada iteración
+BUFFER_SIZE = 64 * 1024
+
+
+class UploadConflict(Exception):
+    """!
+    Clase de la excepción que indica que la posición enviada no coincide con
+    la del archivo o que otra petición está escribiendo en él
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+
+def get_path(upload):
+    return Path(getattr(
+        settings, 'IMAGE_UPLOAD_DIR', settings.BASE_DIR / 'uploads'
+    )) / str(upload.pk)
+
+
+def get_offset(upload):
+    """!
+    Función que devuelve la posición de la subida, que es el tamaño del
+    archivo temporal
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    try:
+        return get_path(upload).stat().st_size
+    except FileNotFoundError:
+        return 0
+
+
+def is_expired(upload, limit):
+    """!
+    Función que indica si la subida no recibe partes desde antes de limit.
+    La fecha de modificación del archivo temporal es la de la última parte
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    try:
+        mtime = get_path(upload).stat().st_mtime
+    except FileNotFoundError:
+        return upload.created_at < limit
+    return mtime < limit.timestamp()
+
+
+def purge(limit):
+    """!
+    Función que elimina las subidas sin partes nuevas desde limit. Las que
+    tienen una petición escribiendo se omiten
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return int con la cantidad de subidas eliminadas
+    """
+
+    count = 0
+    # Una subida creada después de limit no puede estar vencida
+    for upload in ImageUpload.objects.filter(created_at__lt=limit).iterator():
+        try:
+            file = open(get_path(upload), 'rb')
+        except FileNotFoundError:
+            upload.delete()
+            count += 1
+            continue
+        with file:
+            if not locks.lock(file, locks.LOCK_EX | locks.LOCK_NB):
+                continue
+            try:
+                if is_expired(upload, limit):
+                    upload.delete()
+                    count += 1
+            finally:
+                locks.unlock(file)
+    return count
+
+
+def create_file(upload):
+    path = get_path(upload)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.touch(exist_ok=False)
+
+
+class UploadWriter:
+    """!
+    Clase que agrega una parte al archivo temporal de una subida
+
+    El archivo se bloquea mientras dura la petición, por lo que dos partes no
+    se pueden escribir a la vez, y la posición se toma del tamaño del archivo,
+    por lo que no hace falta actualizar la base de datos en cada parte
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self, upload):
+        self.upload = upload
+        self.path = get_path(upload)
+        self.file = None
+
+    def __enter__(self):
+        # Sin O_CREAT, para no recrear el archivo de una subida terminada o
+        # eliminada
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND)
+        except FileNotFoundError:
+            raise ImageUpload.DoesNotExist()
+        self.file = os.fdopen(fd, 'ab')
+        if not locks.lock(self.file, locks.LOCK_EX | locks.LOCK_NB):
+            self.file.close()
+            raise UploadConflict('Otra petición está enviando esta subida.')
+        # La subida pudo completarse mientras se esperaba el archivo
+        if not self.path.exists() or (
+            self.path.stat().st_ino != os.fstat(self.file.fileno()).st_ino
+        ):
+            self.close()
+            raise ImageUpload.DoesNotExist()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        locks.unlock(self.file)
+        self.file.close()
+
+    @property
+    def offset(self):
+        return os.fstat(self.file.fileno()).st_size
+
+    def write(self, stream, offset, length):
+        """!
+        Método que copia length bytes de stream al final del archivo
+
+        Si el cliente corta la conexión se conserva lo recibido y la subida
+        continúa desde esa posición
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param stream <b>{object}</b> Cuerpo de la petición
+        @param offset <b>{int}</b> Posición enviada por el cliente
+        @param length <b>{int}</b> Bytes de la parte
+        @raise UploadConflict si offset no es la posición actual
+        """
+
+        if offset != self.offset:
+            raise UploadConflict('La posición actual es %s.' % self.offset)
+        remaining = length
+        try:
+            while remaining > 0:
+                chunk = stream.read(min(BUFFER_SIZE, remaining))
+                if not chunk:
+                    break
+                self.file.write(chunk)
+                remaining -= len(chunk)
+        finally:
+            self.file.flush()
+
+    def is_complete(self):
+        return self.offset == self.upload.size
+
+    def verify(self):
+        """!
+        Método que compara el sha256 del archivo con el enviado al crear la
+        subida
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        digest = hashlib.sha256()
+        with open(self.path, 'rb') as file:
+            for chunk in iter(lambda: file.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest() == self.upload.checksum
+
+    def get_file(self):
+        """!
+        Método que devuelve el archivo completo como un archivo subido. Al
+        tener temporary_file_path el almacenamiento lo mueve en lugar de
+        copiarlo
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        return UploadFile(
+            self.path, self.upload.filename, self.upload.size
+        )
+
+
+class UploadFile(UploadedFile):
+    """!
+    Clase del archivo completo de una subida por partes
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self, path, name, size):
+        super().__init__(
+            open(path, 'rb'), name, mimetypes.guess_type(name)[0], size
+        )
+        self.path = path
+
+    def temporary_file_path(self):
+        return str(self.path)
+
+
+@receiver(post_delete, sender=ImageUpload)
+def upload_delete(sender, instance, **kwargs):
+    """!
+    Función que elimina el archivo temporal de la subida, si todavía existe,
+    una vez confirmada la transacción
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    path = get_path(instance)
+    transaction.on_commit(lambda: path.unlink(missing_ok=True), robust=True)
@@ -1,33 +1,163 @@
+import csv
+import hashlib
 import json
 
+from django.conf import settings
+from django.db import transaction
+from django.http import (
+    Http404,
+    HttpResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework import (
+    mixins,
     status,
     viewsets
 )
+from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
-from users.permissions import CustomObjectPermissions
+from users.permissions import (
+    AddObjectPermissions,
+    CustomObjectPermissions,
+    has_perms,
+)
+from .autocomplete import indexes
+from .geography import get_tree, get_versions
 from .models import (
     City,
     Country,
     Image,
+    ImageUpload,
     Municipality,
     Parish,
     Person,
     State,
 )
+from .pagination import PersonCursorPagination
+from .search import get_backend
 from .serializers import (
     CitySerializer,
     CountrySerializer,
     ImageSerializer,
+    ImageUploadSerializer,
     MunicipalitySerializer,
     ParishSerializer,
+    PersonBulkSerializer,
     PersonSerializer,
     StateSerializer,
 )
+from .uploads import (
+    UploadConflict,
+    UploadWriter,
+    create_file,
+    get_offset,
+)
+
+
+class Echo:
+    """!
+    Clase que implementa solo el método write de un archivo para que
+    csv.writer devuelva cada línea en lugar de guardarla
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def write(self, value):
+        return value
 
 
-class CountryViewSet(viewsets.ModelViewSet):
+class ConditionalGetMixin:
+    """!
+    Clase que agrega ETag y Last-Modified a list y retrieve a partir de la
+    versión en caché de los modelos, y responde 304 antes de consultar o
+    serializar el queryset
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Modelos de los que depende la respuesta, incluidos los de los filtros
+    conditional_models = ()
+
+    def conditional(self, request, view, *args, **kwargs):
+        """!
+        Método que ejecuta la vista solo si el cliente no tiene la versión
+        actual
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        versions = get_versions(*(self.conditional_models or (self.model,)))
+        etag = 'W/"%s"' % hashlib.md5(('%s:%s' % (
+            versions, request.headers.get('Accept', ''),
+        )).encode()).hexdigest()
+        last_modified = max(versions) // 1000
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = view(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = etag
+            response['Last-Modified'] = http_date(last_modified)
+            response['Cache-Control'] = 'no-cache'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional(request, super().retrieve, *args, **kwargs)
+
+
+class AutocompleteMixin:
+    """!
+    Clase que agrega la acción autocomplete, que busca por prefijo del
+    nombre sin acentos en un índice en memoria (?q=&<padre>=&limit=)
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        """!
+        Método que devuelve los primeros nombres que empiezan por q
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        index = indexes[self.model]
+        try:
+            parent_id = request.query_params.get(index.parent)
+            parent_id = int(parent_id) if parent_id else None
+            limit = min(int(request.query_params.get('limit', 10)), 50)
+        except ValueError:
+            return Response(
+                {'detail': '%s y limit deben ser números.' % index.parent},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        results = index.search(
+            request.query_params.get('q', ''), parent_id, limit
+        )
+        return Response(
+            [
+                {'pk': pk, 'name': name, index.parent: parent}
+                for pk, name, parent in results
+            ],
+            status=status.HTTP_200_OK
+        )
+
+
+class CountryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """!
     Clase que crea los endpoint para el modelo Country
 
@@ -42,8 +172,58 @@ class CountryViewSet(viewsets.ModelViewSet):
     permission_classes = [CustomObjectPermissions,]
     filterset_fields = ('name',)
 
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """!
+        Método que devuelve el árbol de países, estados, municipios,
+        parroquias y ciudades, o el de un país (?country=) o estado (?state=)
+
+        El árbol se guarda en caché serializado y comprimido hasta que cambie
+        algún modelo geográfico; con If-None-Match responde 304 sin consultar
+        la base de datos
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
 
-class StateViewSet(viewsets.ModelViewSet):
+        try:
+            country = request.query_params.get('country')
+            state = request.query_params.get('state')
+            tree = get_tree(
+                country=int(country) if country else None,
+                state=int(state) if state else None,
+            )
+        except ValueError:
+            return Response(
+                {'detail': 'country y state deben ser números.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if tree is None:
+            return Response(
+                {'detail': 'No encontrado.'}, status=status.HTTP_404_NOT_FOUND
+            )
+        # Cada codificación es una representación distinta, con su ETag
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            etag = '%s-gzip"' % tree['etag'][:-1]
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(
+                    tree['gzip'], content_type='application/json'
+                )
+                response['Content-Encoding'] = 'gzip'
+        else:
+            etag = tree['etag']
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = HttpResponse(
+                    tree['body'], content_type='application/json'
+                )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'no-cache'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class StateViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """!
     Clase que crea los endpoint para el modelo State
 
@@ -54,12 +234,15 @@ class StateViewSet(viewsets.ModelViewSet):
 
     model = State
     queryset = State.objects.all()
+    conditional_models = (State, Country)
     serializer_class = StateSerializer
     permission_classes = [CustomObjectPermissions,]
     filterset_fields = ('name', 'country__name',)
 
 
-class MunicipalityViewSet(viewsets.ModelViewSet):
+class MunicipalityViewSet(
+    AutocompleteMixin, ConditionalGetMixin, viewsets.ModelViewSet
+):
     """!
     Clase que crea los endpoint para el modelo Municipality
 
@@ -70,12 +253,15 @@ class MunicipalityViewSet(viewsets.ModelViewSet):
 
     model = Municipality
     queryset = Municipality.objects.all()
+    conditional_models = (Municipality, State)
     serializer_class = MunicipalitySerializer
     permission_classes = [CustomObjectPermissions,]
     filterset_fields = ('name', 'state__name',)
 
 
-class CityViewSet(viewsets.ModelViewSet):
+class CityViewSet(
+    AutocompleteMixin, ConditionalGetMixin, viewsets.ModelViewSet
+):
     """!
     Clase que crea los endpoint para el modelo City
 
@@ -86,12 +272,15 @@ class CityViewSet(viewsets.ModelViewSet):
 
     model = City
     queryset = City.objects.all()
+    conditional_models = (City, State)
     serializer_class = CitySerializer
     permission_classes = [CustomObjectPermissions,]
     filterset_fields = ('name', 'state__name',)
 
 
-class ParishViewSet(viewsets.ModelViewSet):
+class ParishViewSet(
+    AutocompleteMixin, ConditionalGetMixin, viewsets.ModelViewSet
+):
     """!
     Clase que crea los endpoint para el modelo Parish
 
@@ -102,6 +291,7 @@ class ParishViewSet(viewsets.ModelViewSet):
 
     model = Parish
     queryset = Parish.objects.all()
+    conditional_models = (Parish, Municipality)
     serializer_class = ParishSerializer
     permission_classes = [CustomObjectPermissions,]
     filterset_fields = ('name', 'municipality__name',)
@@ -123,6 +313,158 @@ class ImageViewSet(viewsets.ModelViewSet):
     filterset_fields = ('name',)
 
 
+class ImageUploadViewSet(
+    mixins.CreateModelMixin, mixins.RetrieveModelMixin,
+    mixins.DestroyModelMixin, viewsets.GenericViewSet,
+):
+    """!
+    Clase que crea los endpoint para subir imágenes por partes y continuar
+    la subida después de un corte
+
+    POST crea la subida con el nombre, tamaño y sha256 del archivo; HEAD o GET
+    devuelven la posición actual en Upload-Offset; PATCH con
+    Content-Type application/offset+octet-stream y Upload-Offset agrega una
+    parte, que se escribe en el archivo temporal a medida que se lee. Al
+    recibir la última parte se verifica el sha256 y se crea la imagen
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Los permisos son los de crear imágenes
+    model = Image
+    queryset = ImageUpload.objects.all()
+    serializer_class = ImageUploadSerializer
+    permission_classes = [AddObjectPermissions,]
+
+    def get_queryset(self):
+        return self.queryset.filter(user_id=self.request.user.pk)
+
+    def get_upload_headers(self, upload, offset):
+        return {
+            'Upload-Offset': str(offset),
+            'Upload-Length': str(upload.size),
+            'Cache-Control': 'no-store',
+        }
+
+    def create(self, request, format=None):
+        """!
+        Método para crear la subida y su archivo temporal vacío
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(user_id=request.user.pk)
+        create_file(upload)
+        headers = self.get_upload_headers(upload, 0)
+        headers['Location'] = self.reverse_action('detail', args=[upload.pk])
+        return Response(
+            serializer.data, status=status.HTTP_201_CREATED, headers=headers
+        )
+
+    def retrieve(self, request, format=None, pk=None):
+        """!
+        Método para consultar la posición de la subida
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        upload = self.get_object()
+        serializer = self.get_serializer(upload)
+        return Response(
+            serializer.data, status=status.HTTP_200_OK,
+            headers=self.get_upload_headers(upload, serializer.data['offset']),
+        )
+
+    def partial_update(self, request, format=None, pk=None):
+        """!
+        Método para agregar una parte a la subida
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        upload = self.get_object()
+        if request.content_type != 'application/offset+octet-stream':
+            return Response(
+                {'detail': 'Se esperaba application/offset+octet-stream.'},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        try:
+            offset = int(request.headers['Upload-Offset'])
+        except (KeyError, ValueError):
+            return Response(
+                {'detail': 'Falta el encabezado Upload-Offset.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        chunk_size = getattr(
+            settings, 'IMAGE_UPLOAD_CHUNK_SIZE', 5 * 1024 * 1024
+        )
+        if length > chunk_size or offset + length > upload.size:
+            return Response(
+                {'detail': 'La parte no puede superar %s bytes ni el tamaño '
+                 'del archivo.' % chunk_size},
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        try:
+            with UploadWriter(upload) as writer:
+                if length:
+                    writer.write(request.stream, offset, length)
+                elif offset != writer.offset:
+                    raise UploadConflict(
+                        'La posición actual es %s.' % writer.offset
+                    )
+                if writer.is_complete():
+                    return self.complete(upload, writer)
+                return Response(
+                    status=status.HTTP_204_NO_CONTENT,
+                    headers=self.get_upload_headers(upload, writer.offset),
+                )
+        except UploadConflict as e:
+            return Response(
+                {'detail': str(e)}, status=status.HTTP_409_CONFLICT,
+                headers=self.get_upload_headers(upload, get_offset(upload)),
+            )
+        except ImageUpload.DoesNotExist:
+            raise Http404
+
+    def complete(self, upload, writer):
+        """!
+        Método que verifica el archivo completo y crea la imagen. La subida se
+        elimina en la misma transacción; si el archivo no coincide con el
+        sha256 o no es una imagen válida también se elimina
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        if not writer.verify():
+            upload.delete()
+            return Response(
+                {'detail': 'El sha256 no coincide, la subida se descartó.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        file = writer.get_file()
+        try:
+            serializer = ImageSerializer(
+                data={'name': upload.name, 'file': file},
+                context=self.get_serializer_context(),
+            )
+            if not serializer.is_valid():
+                upload.delete()
+                return Response(
+                    serializer.errors, status=status.HTTP_400_BAD_REQUEST
+                )
+            with transaction.atomic():
+                serializer.save()
+                upload.delete()
+        finally:
+            file.close()
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+
 class PersonViewSet(viewsets.ModelViewSet):
     """!
     Clase que crea los endpoint para el modelo Person
@@ -133,21 +475,26 @@ class PersonViewSet(viewsets.ModelViewSet):
     """
 
     model = Person
-    queryset = Person.objects.all()
+    queryset = Person.objects.select_related(
+        'parish', 'user',
+    ).prefetch_related('images')
     serializer_class = PersonSerializer
     permission_classes = [CustomObjectPermissions,]
     filterset_fields = ('first_name', 'last_name', 'id_number',)
+    pagination_class = PersonCursorPagination
 
     def list(self, request):
         """!
-        Clase que lista las personas por el usuario logueado
+        Clase que lista las personas por el usuario logueado, paginadas por
+        cursor
 
         @author William Páez (paez.william8 at gmail.com)
         """
-        
-        queryset = Person.objects.filter(user=request.user)
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+
+        queryset = self.get_queryset().filter(user_id=request.user.pk)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     def create(self, request, format=None):
         """!
@@ -161,11 +508,159 @@ class PersonViewSet(viewsets.ModelViewSet):
             context={'user': request.user}
         )
         serializer.is_valid(raise_exception=True)
-        person = serializer.save()
-        for image in request.data.get('images'):
-            person.images.add(image['id'])
+        serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    # Columnas del export de personas
+    export_fields = (
+        ('pk', 'pk'),
+        ('first_name', 'first_name'),
+        ('last_name', 'last_name'),
+        ('id_number', 'id_number'),
+        ('phone', 'phone'),
+        ('email', 'email'),
+        ('address', 'address'),
+        ('parish', 'parish__name'),
+        ('municipality', 'parish__municipality__name'),
+        ('state', 'parish__municipality__state__name'),
+        ('country', 'parish__municipality__state__country__name'),
+    )
+
+    # Filas que se leen del cursor y se envían por bloque
+    export_chunk_size = 2000
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """!
+        Método que exporta las personas del usuario como NDJSON o CSV
+        (?output=csv). Las filas se leen de un cursor del servidor y se envían
+        a medida que llegan, por lo que la memoria no crece con el total
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        output = request.query_params.get('output', 'ndjson')
+        if output not in ('ndjson', 'csv'):
+            return Response(
+                {'detail': 'Formato no soportado, use ndjson o csv.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        names = [name for name, _ in self.export_fields]
+        rows = Person.objects.filter(user_id=request.user.pk).order_by('id').values_list(
+            *[lookup for _, lookup in self.export_fields]
+        ).iterator(chunk_size=self.export_chunk_size)
+
+        if output == 'csv':
+            writer = csv.writer(Echo())
+            header = writer.writerow(names)
+            encode = writer.writerow
+            content_type = 'text/csv; charset=utf-8'
+        else:
+            header = None
+
+            def encode(row):
+                return json.dumps(dict(zip(names, row)), ensure_ascii=False) + '\n'
+
+            content_type = 'application/x-ndjson; charset=utf-8'
+
+        def lines():
+            # El encabezado del CSV sale antes de leer las filas
+            if header is not None:
+                yield header
+            # La primera fila sale sola para que el cliente reciba datos sin
+            # esperar a que se complete un bloque
+            chunk, size = [], 1
+            for row in rows:
+                chunk.append(encode(row))
+                if len(chunk) == size:
+                    yield ''.join(chunk)
+                    chunk, size = [], self.export_chunk_size
+            if chunk:
+                yield ''.join(chunk)
+
+        response = StreamingHttpResponse(lines(), content_type=content_type)
+        response['Content-Disposition'] = (
+            'attachment; filename="people.%s"' % output
+        )
+        return response
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """!
+        Método que busca las personas del usuario por nombres, apellidos,
+        prefijo de la cédula, correo o teléfono usando el índice de texto
+        completo, ordenadas por relevancia (?q=&page=&page_size=)
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        query = request.query_params.get('q', '')
+        paginator = self.paginator
+        try:
+            page = max(int(request.query_params.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+        page_size = paginator.get_page_size(request)
+        # Se pide una fila de más para saber si hay página siguiente
+        ids = get_backend().search(
+            request.user.pk, query, page_size + 1, (page - 1) * page_size
+        )
+        people = self.get_queryset().in_bulk(ids[:page_size])
+        serializer = self.get_serializer(
+            [people[pk] for pk in ids[:page_size] if pk in people], many=True
+        )
+        url = request.build_absolute_uri()
+        return Response({
+            'next': (
+                replace_query_param(url, 'page', page + 1)
+                if len(ids) > page_size else None
+            ),
+            'previous': (
+                replace_query_param(url, 'page', page - 1) if page > 1 else None
+            ),
+            'results': serializer.data,
+        }, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False, methods=['post'], serializer_class=PersonBulkSerializer,
+    )
+    def bulk(self, request):
+        """!
+        Método para crear personas en lote. Con ?upsert=true actualiza las
+        personas del usuario que tengan la misma cédula de identidad
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        records = request.data
+        if not isinstance(records, list):
+            return Response(
+                {'detail': 'Se esperaba una lista de personas.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_records = getattr(settings, 'PERSON_BULK_MAX_RECORDS', 50000)
+        if len(records) > max_records:
+            return Response(
+                {'detail': 'El lote no puede superar %s personas.' % max_records},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        upsert = request.query_params.get('upsert') in ('true', '1')
+        if upsert and not has_perms(request.user, ['base.change_person']):
+            return Response(
+                {'detail': 'Usted no tiene permiso para realizar esta acción.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        result = self.serializer_class.bulk_save(
+            records, request.user, upsert=upsert
+        )
+        return Response(
+            result,
+            status=(
+                status.HTTP_207_MULTI_STATUS if result['errors']
+                else status.HTTP_201_CREATED
+            )
+        )
+
     def update(self, request, format=None, pk=None):
         """!
         Método para actualizar personas
@@ -174,15 +669,13 @@ class PersonViewSet(viewsets.ModelViewSet):
         """
 
         person = self.get_object()
-        if person.user == request.user:
+        if person.user_id == request.user.pk:
             serializer = self.get_serializer(person, data=request.data)
             serializer.is_valid(raise_exception=True)
             serializer.save()
-            images = request.data.get('images')
-            if images is not None:
-                person.images.clear()
-                for image in images:
-                    person.images.add(image['id'])
+            # Las imágenes precargadas ya no son válidas
+            if getattr(person, '_prefetched_objects_cache', None):
+                person._prefetched_objects_cache = {}
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(
             {'detail': 'Usted no tiene permiso para realizar esta acción.'},
@@ -197,7 +690,7 @@ class PersonViewSet(viewsets.ModelViewSet):
         """
 
         person = self.get_object()
-        if person.user == request.user:
+        if person.user_id == request.user.pk:
             serializer = self.get_serializer(person)
             return Response(serializer.data, status=status.HTTP_200_OK)
         return Response(
@@ -213,7 +706,7 @@ class PersonViewSet(viewsets.ModelViewSet):
         """
 
         person = self.get_object()
-        if person.user == request.user:
+        if person.user_id == request.user.pk:
             person.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
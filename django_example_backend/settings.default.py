@@ -60,7 +60,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'auditlog.middleware.AuditlogMiddleware',
+    'base.audit.AuditBufferMiddleware',
 ]
 
 ROOT_URLCONF = 'django_example_backend.urls'
@@ -116,6 +116,26 @@ DATABASES = {
 }
 
 
+# Caché compartida por los procesos. La caché en memoria es válida solo con
+# un proceso; en producción usar Redis (pip install redis) o Memcached para
+# que las invalidaciones lleguen a todos los workers
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+
+    # 'default': {
+    #    'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+    #    'LOCATION': 'redis://127.0.0.1:6379',
+    # }
+}
+
+
+# Carpeta del snapshot geográfico compartido por los workers (archivo
+# mapeado en memoria). Por defecto la carpeta temporal del sistema
+GEOGRAPHY_SNAPSHOT_DIR = None
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -156,6 +176,46 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Cómo se envían los archivos media: 'django' con FileResponse (sendfile y
+# Range), 'x-accel' con X-Accel-Redirect hacia MEDIA_ACCEL_PREFIX, que en
+# nginx debe ser una location internal con alias a MEDIA_ROOT, o 'x-sendfile'
+# para Apache o lighttpd
+MEDIA_SERVE_MODE = 'django'
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
+# Permisos para descargar los archivos media y segundos de caché del cliente
+# para los archivos con el hash del contenido como nombre; los demás se
+# revalidan con el ETag en cada uso
+MEDIA_PERMISSION_CLASSES = ['rest_framework.permissions.AllowAny']
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Almacenamiento de los archivos de Image. ContentAddressedStorage guarda
+# cada archivo con el hash de su contenido, por lo que las imágenes iguales
+# comparten un archivo; None usa el almacenamiento por defecto
+IMAGE_STORAGE = 'base.storage.ContentAddressedStorage'
+
+# Derivadas de las imágenes por nombre y tamaño máximo (ancho, alto), que se
+# guardan junto al original en su formato y, si IMAGE_DERIVATIVES_WEBP, en
+# WebP. Se generan en IMAGE_DERIVATIVES_WORKERS procesos (0 para el mismo
+# proceso); después de cambiar los tamaños ejecutar generate_derivatives
+IMAGE_DERIVATIVES = {
+    'small': (150, 150),
+    'medium': (600, 600),
+}
+IMAGE_DERIVATIVES_WEBP = True
+IMAGE_DERIVATIVES_QUALITY = 85
+IMAGE_DERIVATIVES_WORKERS = 2
+
+# Subidas de imágenes por partes: carpeta de los archivos temporales, que
+# debe estar en el mismo sistema de archivos que MEDIA_ROOT para mover el
+# archivo sin copiarlo, tamaño máximo de la imagen y de cada parte en bytes y
+# segundos sin recibir partes tras los que purge_uploads elimina una subida
+# sin terminar
+IMAGE_UPLOAD_DIR = BASE_DIR / 'uploads'
+IMAGE_UPLOAD_MAX_SIZE = 20 * 1024 * 1024
+IMAGE_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+IMAGE_UPLOAD_EXPIRATION = 60 * 60 * 24
+
 STATICFILES_DIRS = (
     BASE_DIR / 'static/',
 )
@@ -201,6 +261,34 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_SERIALIZER': 'rest_framework_simplejwt.serializers.TokenRefreshSlidingSerializer',
 }
 
+# Segundos que la caché conserva la época de permisos de un usuario, que se
+# guarda en la base de datos. Con una caché compartida (Redis, Memcached) el
+# cambio de permisos se ve de inmediato; con LocMemCache es lo máximo que
+# tarda en revocar los tokens en los demás procesos
+PERMISSION_EPOCH_CACHE_TIMEOUT = 5 * 60
+
+# Tokens en la lista negra para los que se dimensiona el filtro de Bloom de
+# cada proceso y segundos entre reconstrucciones completas del filtro. El
+# filtro solo se usa con una caché compartida (Redis, Memcached)
+BLACKLIST_FILTER_CAPACITY = 100000
+BLACKLIST_FILTER_REBUILD = 60 * 60
+
+# Reintentos del comando send_outbox: espera inicial en segundos, que se
+# duplica en cada fallo hasta OUTBOX_MAX_DELAY, y cantidad máxima de intentos.
+# OUTBOX_EMAIL_BACKEND permite usar otro backend que EMAIL_BACKEND
+OUTBOX_RETRY_DELAY = 60
+OUTBOX_MAX_DELAY = 60 * 60
+OUTBOX_MAX_ATTEMPTS = 8
+
+# Segundos que un worker de send_outbox reserva los correos que tomó; si no
+# registra el resultado en ese plazo otro worker los vuelve a enviar
+OUTBOX_LEASE = 10 * 60
+
+# Segundos que se conservan los correos enviados o que agotaron los intentos
+# antes de que purge_outbox los elimine; contienen enlaces de reinicio de
+# contraseña
+OUTBOX_RETENTION = 60 * 60 * 24
+
 AUTHENTICATION_BACKENDS = [
     'django.contrib.auth.backends.ModelBackend',
 ]
@@ -211,8 +299,11 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # El token de acceso lleva los permisos del usuario, por lo que no se
+    # consulta la base de datos en cada petición. Para cargar el usuario
+    # completo usar rest_framework_simplejwt.authentication.JWTAuthentication
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.ClaimsJWTAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
     'DEFAULT_PARSER_CLASSES': (
@@ -238,8 +329,46 @@ else:
     EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
     SERVER_EMAIL = 'email@email.com'
 
+# Tamaño de página por defecto y máximo del listado de personas
+PERSON_PAGE_SIZE = 100
+PERSON_MAX_PAGE_SIZE = 1000
+
+# Cantidad máxima de personas por petición en people/bulk/
+PERSON_BULK_MAX_RECORDS = 50000
+
+# Cantidad máxima de usuarios por petición en users/bulk/
+USERS_BULK_MAX_RECORDS = 10000
+
+# Hilos que calculan los hash de contraseñas y tareas que pueden esperar en
+# cola; con la cola llena login, registro y cambio de contraseña responden 503.
+# El hilo de la petición espera su hash, por lo que con ASGI, donde las vistas
+# síncronas comparten un hilo, un login detiene las demás vistas
+PASSWORD_HASHING_WORKERS = 2
+PASSWORD_HASHING_QUEUE = 8
+
 # Registra todos los modelos
 AUDITLOG_INCLUDE_ALL_MODELS = True
 
+# Los correos pendientes contienen enlaces de recuperación de contraseña, y
+# las subidas de imágenes en curso, las épocas de permisos y los Blob son
+# datos internos que cambian con cada operación
+AUDITLOG_EXCLUDE_TRACKING_MODELS = (
+    'users.OutboxEmail', 'users.PermissionEpoch', 'base.ImageUpload',
+    'base.Blob',
+)
+
 # No registra los datos cargados usando loaddata
 AUDITLOG_DISABLE_ON_RAW_SAVE = True
+
+# Escritura de las entradas de auditoría: 'request' las inserta juntas al
+# final de cada petición, 'background' en un hilo de cada proceso (las que
+# estén en cola se pierden si el proceso termina de forma abrupta) y None una
+# por una como AuditlogMiddleware
+AUDITLOG_BUFFER_MODE = 'request'
+AUDITLOG_BUFFER_BATCH_SIZE = 500
+AUDITLOG_BUFFER_QUEUE = 10000
+
+# Días que se conservan las entradas de auditoría en la tabla y carpeta de
+# los archivos comprimidos del comando archive_auditlog
+AUDITLOG_RETENTION_DAYS = 180
+AUDITLOG_ARCHIVE_DIR = BASE_DIR / 'archive' / 'auditlog'
@@ -1,3 +1,33 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import OutboxEmail
+
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    """!
+    Clase que agrega modelo OutboxEmail al panel administrativo
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Mostrar los campos de la clase
+    list_display = (
+        'to_email', 'subject', 'attempts', 'next_attempt_at', 'sent_at',
+    )
+
+    # Filtrar por campos
+    list_filter = ('sent_at',)
+
+    # Buscar por campos
+    search_fields = ('to_email',)
+
+    # Los correos se editan solo desde el comando send_outbox
+    readonly_fields = (
+        'subject', 'body', 'html_body', 'from_email', 'to_email', 'attempts',
+        'sent_at', 'last_error', 'created_at',
+    )
+
+
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
@@ -0,0 +1,287 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.checks import Tags, Warning, register
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import (
+    JWTStatelessUserAuthentication,
+)
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import PermissionEpoch
+
+# Acciones de los permisos por defecto de Django y su letra en el token
+ACTIONS = {'add': 'a', 'change': 'c', 'delete': 'd', 'view': 'v'}
+
+# Época de los usuarios que ya no existen, mayor que la de cualquier token
+DELETED_EPOCH = 2 ** 63 - 1
+
+# Cachés que cada proceso guarda por separado
+PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def is_shared_cache():
+    """!
+    Función que indica si la caché por defecto se comparte entre procesos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    return backend not in PROCESS_CACHES
+
+
+def epoch_key(user_id):
+    return 'users:epoch:%s' % user_id
+
+
+def get_epochs(user_ids):
+    """!
+    Función que devuelve las épocas de permisos de varios usuarios desde la
+    caché y consulta en una sola vez las que no están. Los usuarios sin
+    registro tienen la época 0
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return dict con el id del usuario y su época
+    """
+
+    keys = {epoch_key(user_id): user_id for user_id in user_ids}
+    cached = cache.get_many(keys)
+    epochs = {keys[key]: epoch for key, epoch in cached.items()}
+    missing = [user_id for user_id in keys.values() if user_id not in epochs]
+    if missing:
+        loaded = dict(PermissionEpoch.objects.filter(
+            user_id__in=missing
+        ).values_list('user_id', 'epoch'))
+        without = [user_id for user_id in missing if user_id not in loaded]
+        if without:
+            # Los tokens de un usuario eliminado no vuelven a ser válidos
+            existing = set(User.objects.filter(
+                pk__in=without
+            ).values_list('pk', flat=True))
+            for user_id in without:
+                loaded[user_id] = 0 if user_id in existing else DELETED_EPOCH
+        cache.set_many(
+            {epoch_key(user_id): epoch for user_id, epoch in loaded.items()},
+            getattr(settings, 'PERMISSION_EPOCH_CACHE_TIMEOUT', 300),
+        )
+        epochs.update(loaded)
+    return epochs
+
+
+def get_epoch(user_id):
+    """!
+    Función que devuelve la época de permisos del usuario, el momento en
+    milisegundos del último cambio de sus permisos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    return get_epochs([user_id])[user_id]
+
+
+def bump_epochs(user_ids):
+    """!
+    Función que revoca los tokens de acceso de los usuarios avanzando su
+    época de permisos en la base de datos
+
+    La copia de la caché se borra al confirmar la transacción, para que la
+    siguiente lectura tome la época nueva
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    user_ids = set(user_ids)
+    if not user_ids:
+        return
+    now = int(time.time() * 1000)
+    # Siempre avanza, aunque dos cambios caigan en el mismo milisegundo
+    PermissionEpoch.objects.filter(user_id__in=user_ids).update(
+        epoch=Greatest(F('epoch') + 1, Value(now))
+    )
+    # Los usuarios eliminados no tienen registro y se tratan en get_epochs
+    PermissionEpoch.objects.bulk_create([
+        PermissionEpoch(user_id=user_id, epoch=now)
+        for user_id in User.objects.filter(
+            pk__in=user_ids
+        ).values_list('pk', flat=True)
+    ], ignore_conflicts=True)
+    keys = [epoch_key(user_id) for user_id in user_ids]
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@register(Tags.security)
+def check_epoch_cache(app_configs, **kwargs):
+    """!
+    Función que avisa si la caché es propia de cada proceso, con la que un
+    cambio de permisos tarda hasta PERMISSION_EPOCH_CACHE_TIMEOUT segundos en
+    revocar los tokens en los demás procesos y el filtro de la lista negra no
+    se usa
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if is_shared_cache():
+        return []
+    classes = getattr(settings, 'REST_FRAMEWORK', {}).get(
+        'DEFAULT_AUTHENTICATION_CLASSES', []
+    )
+    hint = (
+        'La lista negra de tokens de refresco se consulta en la base de '
+        'datos en cada verificación, sin el filtro de Bloom'
+    )
+    if 'users.authentication.ClaimsJWTAuthentication' in classes:
+        hint = (
+            'Los cambios de permisos tardan hasta '
+            'PERMISSION_EPOCH_CACHE_TIMEOUT segundos en revocar los tokens '
+            'en los demás procesos. %s' % hint
+        )
+    return [Warning(
+        'La caché por defecto no se comparte entre procesos.',
+        hint='%s; use Redis o Memcached.' % hint,
+        id='users.W001',
+    )]
+
+
+def encode_permissions(perms):
+    """!
+    Función que agrupa los permisos por modelo para guardarlos en el token:
+    'base.add_person' y 'base.view_person' quedan como 'base.person:av'. Los
+    permisos que no siguen el formato por defecto se guardan completos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    models, others = {}, []
+    for perm in perms:
+        app_label, codename = perm.split('.', 1)
+        action, _, model = codename.partition('_')
+        if action in ACTIONS and model:
+            key = '%s.%s' % (app_label, model)
+            models[key] = models.get(key, '') + ACTIONS[action]
+        else:
+            others.append(perm)
+    return sorted(
+        '%s:%s' % (key, ''.join(sorted(letters)))
+        for key, letters in models.items()
+    ) + sorted(others)
+
+
+def decode_permissions(values):
+    """!
+    Función inversa de encode_permissions
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    letters = {letter: action for action, letter in ACTIONS.items()}
+    perms = set()
+    for value in values:
+        key, _, actions = value.partition(':')
+        if not actions:
+            perms.add(key)
+            continue
+        app_label, model = key.split('.', 1)
+        for letter in actions:
+            perms.add('%s.%s_%s' % (app_label, letters[letter], model))
+    return perms
+
+
+def add_claims(token, user):
+    """!
+    Función que agrega al token de acceso los permisos del usuario y su
+    época de permisos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # La época se lee antes que los permisos para que un cambio entre ambas
+    # lecturas invalide el token
+    token['epoch'] = get_epoch(user.pk)
+    token['username'] = user.get_username()
+    token['is_staff'] = user.is_staff
+    token['is_superuser'] = user.is_superuser
+    if not user.is_superuser:
+        from .permissions import get_permissions
+        token['perms'] = encode_permissions(get_permissions(user))
+    return token
+
+
+class ClaimsUser(TokenUser):
+    """!
+    Clase del usuario construido desde el token, que evalúa los permisos con
+    los claims sin consultar la base de datos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    @cached_property
+    def permissions(self):
+        return frozenset(decode_permissions(self.token.get('perms', [])))
+
+    def get_all_permissions(self, obj=None):
+        return set(self.permissions)
+
+    def has_perm(self, perm, obj=None):
+        return self.is_superuser or perm in self.permissions
+
+    def has_perms(self, perm_list, obj=None):
+        return all(self.has_perm(perm, obj) for perm in perm_list)
+
+    def has_module_perms(self, module):
+        return self.is_superuser or any(
+            perm.startswith(module + '.') for perm in self.permissions
+        )
+
+
+class ClaimsJWTAuthentication(JWTStatelessUserAuthentication):
+    """!
+    Clase que autentica con el token de acceso sin cargar el usuario de la
+    base de datos. El token se rechaza si la época de permisos del usuario
+    avanzó después de emitirlo, para que el cliente lo renueve con
+    users/refresh/
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def get_user(self, validated_token):
+        if (
+            api_settings.USER_ID_CLAIM not in validated_token
+            or 'epoch' not in validated_token
+        ):
+            raise InvalidToken('El token no incluye el usuario y sus permisos.')
+        user = ClaimsUser(validated_token)
+        if validated_token['epoch'] < get_epoch(user.id):
+            raise InvalidToken('Los permisos cambiaron, renueve el token.')
+        return user
@@ -0,0 +1,183 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework.exceptions import APIException
+
+
+class HashingBusy(APIException):
+    """!
+    Clase de la excepción que responde 503 cuando la cola de hashing está
+    llena
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    status_code = 503
+    default_detail = 'Servidor ocupado, intente de nuevo en unos segundos.'
+    default_code = 'service_unavailable'
+
+    # DRF lo envía en el encabezado Retry-After
+    wait = 1
+
+
+class HashingPool:
+    """!
+    Clase que calcula los hash de contraseñas en un pool de hilos acotado
+
+    hashlib libera el GIL mientras calcula PBKDF2, por lo que los hilos del
+    pool usan otros núcleos. A lo sumo workers + queue tareas pueden estar en
+    curso o esperando; las demás fallan de inmediato con HashingBusy, lo que
+    acota el uso de CPU y la espera durante una ráfaga de logins
+
+    El hilo de la petición espera el resultado, por lo que queda ocupado
+    mientras dura su propio hash: el pool no libera hilos del servidor. Con
+    ASGI las vistas de DRF son síncronas y se ejecutan en un único hilo
+    compartido, por lo que un login detiene las demás vistas síncronas
+    mientras se calcula el hash; en ese caso conviene servir la API con WSGI
+    y varios hilos o procesos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self, workers=None, queue=None):
+        self.workers = workers
+        self.queue = queue
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """!
+        Método que crea el pool en el primer uso del proceso, después del fork
+        de los workers del servidor
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        with self.lock:
+            if self.executor is None:
+                workers = self.workers or getattr(
+                    settings, 'PASSWORD_HASHING_WORKERS', 2
+                )
+                queue = self.queue
+                if queue is None:
+                    queue = getattr(settings, 'PASSWORD_HASHING_QUEUE', 8)
+                self.slots = threading.BoundedSemaphore(workers + queue)
+                self.executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix='hashing'
+                )
+
+    def run(self, func, *args):
+        """!
+        Método que ejecuta func en el pool y espera su resultado
+
+        @author William Páez (paez.william8 at gmail.com)
+        @return Resultado de func
+        @raise HashingBusy si no quedan lugares en la cola
+        """
+
+        if self.executor is None:
+            self.start()
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self.executor.submit(self.call, func, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        return future.result()
+
+    def call(self, func, *args):
+        # El lugar se libera antes de entregar el resultado, para que la
+        # siguiente tarea de la misma petición lo encuentre libre
+        try:
+            return func(*args)
+        finally:
+            self.slots.release()
+
+
+# Pool compartido por el proceso
+pool = HashingPool()
+
+
+def make_password(password):
+    return pool.run(hashers.make_password, password)
+
+
+def set_password(user, password):
+    """!
+    Función que asigna la contraseña al usuario calculando el hash en el pool,
+    igual que User.set_password
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    user.password = make_password(password)
+    # Lo usan los validadores de contraseña al guardar
+    user._password = password
+
+
+def verify(password, encoded):
+    """!
+    Función que verifica la contraseña y calcula el hash nuevo si cambió el
+    hasher o sus iteraciones, en la misma tarea del pool
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return tuple (válida, hash nuevo o None)
+    """
+
+    updated = []
+    valid = hashers.check_password(
+        password, encoded,
+        lambda raw: updated.append(hashers.make_password(raw)),
+    )
+    return valid, updated[0] if updated else None
+
+
+def check_password(user, password):
+    """!
+    Función que verifica la contraseña en el pool, igual que
+    User.check_password, y actualiza el hash si cambió el hasher o sus
+    iteraciones. Ambos cálculos ocupan un solo lugar del pool, por lo que un
+    login válido no falla con 503 después de verificar la contraseña
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    valid, encoded = pool.run(verify, password, user.password)
+    if encoded:
+        user.password = encoded
+        user.save(update_fields=['password'])
+    return valid
+
+
+def make_passwords(passwords, workers=None):
+    """!
+    Función que calcula los hash de muchas contraseñas usando todos los
+    núcleos, para el registro de usuarios en lote
+
+    Usa su propio pool para no ocupar los lugares del pool del login
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return list con los hash en el mismo orden
+    """
+
+    with ThreadPoolExecutor(
+        max_workers=workers or os.cpu_count() or 1,
+        thread_name_prefix='bulk-hashing',
+    ) as executor:
+        return list(executor.map(hashers.make_password, passwords))
@@ -0,0 +1,57 @@
+import csv
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.serializers import BulkRegisterSerializer
+
+
+class Command(BaseCommand):
+    """!
+    Comando que registra usuarios en lote desde un CSV o JSON, con el grupo
+    Usuario
+
+    CSV con encabezado: username,email,password,first_name,last_name (los
+    nombres pueden ir vacíos). JSON: lista de objetos con los mismos campos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    help = 'Registra usuarios en lote desde un CSV o JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Archivo .csv o .json con los usuarios')
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Formato del archivo, por defecto según la extensión',
+        )
+        parser.add_argument(
+            '--workers', type=int,
+            help='Hilos para calcular los hash, por defecto uno por núcleo',
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format == 'csv':
+            with open(path, newline='', encoding='utf-8-sig') as file:
+                records = [
+                    {key: value for key, value in row.items() if value}
+                    for row in csv.DictReader(file)
+                ]
+        elif file_format == 'json':
+            with open(path, encoding='utf-8') as file:
+                records = json.load(file)
+        else:
+            raise CommandError('Formato no soportado, use csv o json')
+
+        result = BulkRegisterSerializer.bulk_save(records, options['workers'])
+        for error in result['errors']:
+            self.stderr.write('Registro %s: %s' % (error['index'], error['errors']))
+        self.stdout.write(self.style.SUCCESS(
+            'Usuarios registrados: %s, con errores: %s' % (
+                result['created'], len(result['errors'])
+            )
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from users.outbox import purge
+
+
+class Command(BaseCommand):
+    """!
+    Comando que elimina los correos enviados o que agotaron los intentos hace
+    más de OUTBOX_RETENTION segundos, para ejecutarlo con cron
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    help = 'Elimina los correos enviados o fallidos de la tabla outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Correos eliminados por consulta',
+        )
+
+    def handle(self, *args, **options):
+        total = purge(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            '%s correos eliminados' % total
+        ))
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+
+
+class Command(BaseCommand):
+    """!
+    Comando que elimina los tokens de refresco expirados y su entrada en la
+    lista negra
+
+    Se borra por bloques de ids, cada uno en su propia transacción, para no
+    bloquear las tablas mientras se emiten o revocan tokens. A diferencia de
+    flushexpiredtokens no carga todos los tokens expirados en memoria
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    help = 'Elimina por bloques los tokens de refresco expirados'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Tokens eliminados por transacción',
+        )
+        parser.add_argument(
+            '--sleep', type=float, default=0,
+            help='Segundos de pausa entre bloques',
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        batch_size = options['batch_size']
+        total, last = 0, 0
+        while True:
+            ids = list(
+                OutstandingToken.objects.filter(
+                    pk__gt=last, expires_at__lte=now
+                ).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            BlacklistedToken.objects.filter(token_id__in=ids).delete()
+            OutstandingToken.objects.filter(pk__in=ids).delete()
+            total += len(ids)
+            last = ids[-1]
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        self.stdout.write(self.style.SUCCESS(
+            '%s tokens expirados eliminados' % total
+        ))
@@ -0,0 +1,53 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.outbox import send_batch
+
+
+class Command(BaseCommand):
+    """!
+    Comando que envía los correos pendientes de la tabla outbox
+
+    Sin --loop envía todos los pendientes y termina, para ejecutarlo con
+    cron; con --loop queda esperando nuevos correos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    help = 'Envía los correos pendientes por lotes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=100,
+            help='Correos enviados por conexión',
+        )
+        parser.add_argument(
+            '--loop', action='store_true',
+            help='Sigue ejecutándose y revisa la tabla cada --interval segundos',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help='Segundos de espera cuando no hay correos pendientes',
+        )
+
+    def handle(self, *args, **options):
+        total_sent = total_failed = 0
+        while True:
+            sent, failed = send_batch(options['batch_size'])
+            total_sent += sent
+            total_failed += failed
+            if sent or failed:
+                self.stdout.write('%s enviados, %s fallidos' % (sent, failed))
+            if not (sent or failed):
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
+            elif failed and not sent and not options['loop']:
+                # Todo el lote falló, se reintenta en la próxima ejecución
+                break
+        self.stdout.write(self.style.SUCCESS(
+            'Correos enviados: %s, fallidos: %s' % (total_sent, total_failed)
+        ))
@@ -0,0 +1,50 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+
+from users.authentication import get_epochs
+from users.permissions import (
+    PERMISSIONS_TIMEOUT,
+    load_permissions,
+    permissions_key,
+)
+
+
+class Command(BaseCommand):
+    """!
+    Comando que carga en la caché compartida los permisos de los usuarios
+    activos, para ejecutarlo al desplegar y evitar que las primeras
+    peticiones consulten la base de datos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    help = 'Carga en la caché los permisos de los usuarios activos'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Usuarios por consulta',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = list(
+            User.objects.filter(is_active=True, is_superuser=False)
+            .order_by('pk').values_list('pk', flat=True)
+        )
+        batch_size = options['batch_size']
+        for start in range(0, len(user_ids), batch_size):
+            batch = user_ids[start:start + batch_size]
+            # La época se lee antes que los permisos para que un cambio entre
+            # ambas lecturas quede guardado con una época ya vencida
+            epochs = get_epochs(batch)
+            perms = load_permissions(batch)
+            cache.set_many({
+                permissions_key(user_id, epochs[user_id]): values
+                for user_id, values in perms.items()
+            }, PERMISSIONS_TIMEOUT)
+        self.stdout.write(self.style.SUCCESS(
+            'Permisos de %s usuarios cargados' % len(user_ids)
+        ))
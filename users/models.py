@@ -1,3 +1,143 @@
+from django.contrib.auth.models import User
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class OutboxEmail(models.Model):
+    """!
+    Clase que contiene los correos pendientes de enviar
+
+    La petición solo guarda el correo y el comando send_outbox lo envía, por
+    lo que la latencia del servidor SMTP no afecta a la respuesta
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Asunto
+    subject = models.CharField(
+        'asunto', max_length=255, db_comment='Asunto del correo',
+    )
+
+    # Cuerpo en texto plano
+    body = models.TextField(
+        'cuerpo', db_comment='Cuerpo del correo en texto plano',
+    )
+
+    # Cuerpo en html
+    html_body = models.TextField(
+        'cuerpo html', blank=True, db_comment='Cuerpo del correo en html',
+    )
+
+    # Remitente, vacío para usar DEFAULT_FROM_EMAIL
+    from_email = models.CharField(
+        'remitente', max_length=254, blank=True,
+        db_comment='Remitente del correo',
+    )
+
+    # Destinatario
+    to_email = models.EmailField(
+        'destinatario', db_comment='Destinatario del correo',
+    )
+
+    # Intentos de envío fallidos
+    attempts = models.PositiveSmallIntegerField(
+        'intentos', default=0, db_comment='Intentos de envío fallidos',
+    )
+
+    # Fecha a partir de la cual se puede intentar el envío
+    next_attempt_at = models.DateTimeField(
+        'próximo intento', default=timezone.now,
+        db_comment='Fecha del próximo intento de envío',
+    )
+
+    # Fecha de envío, vacía mientras está pendiente
+    sent_at = models.DateTimeField(
+        'enviado', null=True, blank=True, db_comment='Fecha de envío',
+    )
+
+    # Último error de envío
+    last_error = models.TextField(
+        'último error', blank=True, db_comment='Último error de envío',
+    )
+
+    # Fecha de creación
+    created_at = models.DateTimeField(
+        'creado', auto_now_add=True, db_comment='Fecha de creación',
+    )
+
+    def __str__(self):
+        """!
+        Función para representar la clase de forma amigable
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param self <b>{object}</b> Objeto que instancia la clase
+        @return string <b>{object}</b> Objeto con el asunto y destinatario
+        """
+
+        return '%s <%s>' % (self.subject, self.to_email)
+
+    class Meta:
+        """!
+        Meta clase del modelo que establece algunas propiedades
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        verbose_name = 'Correo pendiente'
+        verbose_name_plural = 'Correos pendientes'
+
+        # Índice para buscar los correos pendientes por fecha de intento
+        indexes = [
+            models.Index(
+                fields=['sent_at', 'next_attempt_at'], name='outbox_pending_idx'
+            ),
+        ]
+
+
+class PermissionEpoch(models.Model):
+    """!
+    Clase que contiene la época de permisos de cada usuario, el momento en
+    milisegundos del último cambio de sus permisos
+
+    La caché solo guarda una copia; los usuarios sin registro tienen la
+    época 0, ya que sus permisos nunca cambiaron
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    # Relación con el modelo User
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True,
+        verbose_name='usuario', db_comment='Relación con el modelo usuario',
+    )
+
+    # Época en milisegundos
+    epoch = models.BigIntegerField(
+        'época', default=0,
+        db_comment='Momento en milisegundos del último cambio de permisos',
+    )
+
+    def __str__(self):
+        """!
+        Función para representar la clase de forma amigable
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param self <b>{object}</b> Objeto que instancia la clase
+        @return string <b>{object}</b> Objeto con el usuario y la época
+        """
+
+        return '%s: %s' % (self.user_id, self.epoch)
+
+    class Meta:
+        """!
+        Meta clase del modelo que establece algunas propiedades
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        verbose_name = 'Época de permisos'
+        verbose_name_plural = 'Épocas de permisos'
@@ -0,0 +1,144 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+
+def get_delay(attempts):
+    """!
+    Función que devuelve la espera antes del siguiente intento, el doble en
+    cada fallo hasta OUTBOX_MAX_DELAY
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    delay = getattr(settings, 'OUTBOX_RETRY_DELAY', 60) * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, getattr(settings, 'OUTBOX_MAX_DELAY', 3600)))
+
+
+def claim(batch_size):
+    """!
+    Función que toma un lote de correos pendientes en una transacción corta
+
+    Las filas se bloquean con SKIP LOCKED en los motores que lo soportan, por
+    lo que se pueden ejecutar varios workers a la vez, y el próximo intento
+    se mueve OUTBOX_LEASE segundos adelante. Los demás workers no las toman
+    mientras dura el envío, y si el worker termina sin registrar el resultado
+    se vuelven a enviar al vencer ese plazo
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return list con los correos tomados
+    """
+
+    now = timezone.now()
+    with transaction.atomic():
+        emails = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True).filter(
+                sent_at__isnull=True,
+                attempts__lt=getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8),
+                next_attempt_at__lte=now,
+            ).order_by('next_attempt_at')[:batch_size]
+        )
+        if emails:
+            OutboxEmail.objects.filter(
+                pk__in=[email.pk for email in emails]
+            ).update(next_attempt_at=now + timedelta(
+                seconds=getattr(settings, 'OUTBOX_LEASE', 10 * 60)
+            ))
+    return emails
+
+
+def send_batch(batch_size=100):
+    """!
+    Función que envía un lote de correos pendientes con una sola conexión al
+    servidor de correo
+
+    El envío ocurre fuera de la transacción con la que se toman los correos,
+    por lo que la latencia del servidor de correo no mantiene filas
+    bloqueadas
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return tuple con la cantidad de correos enviados y fallidos
+    """
+
+    emails = claim(batch_size)
+    if not emails:
+        return 0, 0
+    sent, failed = [], []
+    connection = get_connection(
+        getattr(settings, 'OUTBOX_EMAIL_BACKEND', None)
+    )
+    try:
+        connection.open()
+    except Exception as error:
+        failed = [(email, error) for email in emails]
+    else:
+        try:
+            for email in emails:
+                message = EmailMultiAlternatives(
+                    email.subject, email.body, email.from_email or None,
+                    [email.to_email], connection=connection,
+                )
+                if email.html_body:
+                    message.attach_alternative(email.html_body, 'text/html')
+                try:
+                    message.send()
+                except Exception as error:
+                    failed.append((email, error))
+                else:
+                    sent.append(email)
+        finally:
+            connection.close()
+
+    now = timezone.now()
+    for email in sent:
+        email.sent_at = now
+    for email, error in failed:
+        email.attempts += 1
+        email.next_attempt_at = now + get_delay(email.attempts)
+        email.last_error = str(error)
+    OutboxEmail.objects.bulk_update(
+        sent + [email for email, _ in failed],
+        ['sent_at', 'attempts', 'next_attempt_at', 'last_error'],
+    )
+    return len(sent), len(failed)
+
+
+def purge(batch_size=1000):
+    """!
+    Función que elimina por bloques los correos enviados y los que agotaron
+    los intentos hace más de OUTBOX_RETENTION segundos, ya que guardan los
+    enlaces de reinicio de contraseña en texto plano
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return int con la cantidad de correos eliminados
+    """
+
+    limit = timezone.now() - timedelta(
+        seconds=getattr(settings, 'OUTBOX_RETENTION', 60 * 60 * 24)
+    )
+    expired = OutboxEmail.objects.filter(
+        Q(sent_at__lt=limit) | Q(
+            sent_at__isnull=True, created_at__lt=limit,
+            attempts__gte=getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8),
+        )
+    )
+    total = 0
+    while True:
+        ids = list(expired.values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return total
+        total += OutboxEmail.objects.filter(pk__in=ids).delete()[0]
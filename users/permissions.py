@@ -1,4 +1,89 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from rest_framework import permissions
+from rest_framework_simplejwt.models import TokenUser
+
+from .authentication import get_epoch
+
+# Segundos que se conserva el conjunto de permisos de una época; al cambiar
+# la época las entradas anteriores dejan de leerse y expiran
+PERMISSIONS_TIMEOUT = 60 * 60 * 24
+
+
+def permissions_key(user_id, epoch):
+    return 'users:perms:%s:%s' % (user_id, epoch)
+
+
+def load_permissions(user_ids):
+    """!
+    Función que consulta los permisos propios y de grupo de varios usuarios
+    con dos consultas
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    @return dict con el id del usuario y su frozenset de permisos
+    """
+
+    perms = {user_id: set() for user_id in user_ids}
+    rows = list(User.user_permissions.through.objects.filter(
+        user_id__in=user_ids
+    ).values_list(
+        'user_id', 'permission__content_type__app_label',
+        'permission__codename',
+    )) + list(User.groups.through.objects.filter(
+        user_id__in=user_ids, group__permissions__isnull=False
+    ).values_list(
+        'user_id', 'group__permissions__content_type__app_label',
+        'group__permissions__codename',
+    ))
+    for user_id, app_label, codename in rows:
+        perms[user_id].add('%s.%s' % (app_label, codename))
+    return {user_id: frozenset(values) for user_id, values in perms.items()}
+
+
+def get_permissions(user):
+    """!
+    Función que devuelve los permisos del usuario desde la caché compartida,
+    con clave por id y época de permisos del usuario
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if not user.is_active:
+        return frozenset()
+    cached = getattr(user, '_shared_perm_cache', None)
+    if cached is not None:
+        return cached
+    key = permissions_key(user.pk, get_epoch(user.pk))
+    perms = cache.get(key)
+    if perms is None:
+        perms = load_permissions([user.pk])[user.pk]
+        cache.set(key, perms, PERMISSIONS_TIMEOUT)
+    # Se conserva en el usuario para el resto de la petición
+    user._shared_perm_cache = perms
+    return perms
+
+
+def has_perms(user, perms):
+    """!
+    Función equivalente a user.has_perms con la caché compartida
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if not user or not user.is_authenticated:
+        return False
+    if isinstance(user, TokenUser):
+        # Los permisos vienen en el token
+        return user.has_perms(perms)
+    if user.is_active and user.is_superuser:
+        return True
+    return set(perms) <= get_permissions(user)
 
 
 class CustomObjectPermissions(permissions.DjangoObjectPermissions):
@@ -22,8 +107,24 @@ class CustomObjectPermissions(permissions.DjangoObjectPermissions):
 
     def has_permission(self, request, view):
         perms = self.get_required_permissions(request.method, view.model)
-        return (request.user and request.user.has_perms(perms))
+        return has_perms(request.user, perms)
 
     def has_object_permission(self, request, view, obj):
         perms = self.get_required_permissions(request.method, view.model)
-        return (request.user and request.user.has_perms(perms))
+        return has_perms(request.user, perms)
+
+
+class AddObjectPermissions(CustomObjectPermissions):
+    """!
+    Clase que exige el permiso de agregar del modelo en todos los métodos,
+    para los endpoint que solo sirven para crear registros
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    perms_map = {
+        method: ['%(app_label)s.add_%(model_name)s']
+        for method in CustomObjectPermissions.perms_map
+    }
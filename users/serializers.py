@@ -1,3 +1,5 @@
+import time
+
 from rest_framework import serializers
 from django.contrib.auth.forms import _unicode_ci_compare
 from django.contrib.auth.models import (
@@ -6,17 +8,21 @@ from django.contrib.auth.models import (
 )
 from django.contrib.auth import _clean_credentials
 from django.contrib.auth.signals import user_login_failed
+from django.conf import settings
+from django.db import IntegrityError, transaction
 from django.db.models import Q
 from rest_framework.validators import UniqueValidator
 from django.contrib.auth.password_validation import validate_password
 from django.contrib.auth import get_user_model
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMultiAlternatives
 from django.template import loader
 from django.utils.encoding import force_bytes
 from django.utils.http import urlsafe_base64_encode
 
+from . import hashing
+from .models import OutboxEmail
+
 UserModel = get_user_model()
 
 
@@ -38,35 +44,46 @@ class LoginSerializer(serializers.Serializer):
         """!
         Meethod for validated of return serializer is correct
 
+        La contraseña se verifica una sola vez con check_password, que además
+        actualiza el hash si cambió el hasher o las iteraciones. El tiempo de
+        cada fase queda en self.timings en milisegundos
+
         @param attrs object with field for validate
         @return attrs object that contain the serializer validated
         """
 
         username = attrs.get('username')
         password = attrs.get('password')
+        credentials = {'username': username, 'password': password}
+        self.timings = {}
         msg = None
         if username and password:
+            start = time.perf_counter()
             user = User.objects.filter(
                 Q(username__iexact=username) | Q(email__iexact=username)
-            ).distinct()
-            credentials = {'username': username, 'password': password}
+            ).order_by('pk').first()
+            self.timings['lookup'] = (time.perf_counter() - start) * 1000
 
+            start = time.perf_counter()
             if user:
-                user = user.first()
-                if user.check_password(password):
+                if hashing.check_password(user, password):
                     if not user.is_active:
                         msg = 'User not active!'
                 else:
                     msg = 'Invalid the password!'
             else:
+                # Calcula un hash igual que ModelBackend para que el tiempo
+                # de respuesta no revele si el usuario existe
+                hashing.make_password(password)
                 msg = 'Invalid credentials!'
+            self.timings['hash'] = (time.perf_counter() - start) * 1000
         else:
             msg = "Must include 'username' and 'password'."
         if msg:
             user_login_failed.send(
                 sender=__name__,
                 credentials=_clean_credentials(credentials),
-                request=None,
+                request=self.context.get('request'),
                 msg=msg,
             )
             raise serializers.ValidationError(msg)
@@ -111,11 +128,12 @@ class RegisterSerializer(serializers.ModelSerializer):
         return attrs
 
     def create(self, validated_data):
-        user = User.objects.create(
+        user = User(
             username=validated_data['username'],
             email=validated_data['email'],
         )
-        user.set_password(validated_data['password'])
+        # El hash se asigna antes de insertar para guardar con un solo INSERT
+        hashing.set_password(user, validated_data['password'])
         user.save()
         # Se asigna el rol Usuario
         user.groups.add(Group.objects.get(name='Usuario'))
@@ -123,6 +141,180 @@ class RegisterSerializer(serializers.ModelSerializer):
         return user
 
 
+class BulkRegisterSerializer(serializers.ModelSerializer):
+    """!
+    Clase que valida y registra usuarios en lote
+
+    Cada registro se valida sin consultar la base de datos; la unicidad del
+    usuario y del correo se verifica para todo el lote con una consulta por
+    bloque, los hash se calculan en paralelo y los usuarios y sus grupos se
+    insertan con bulk_create
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    email = serializers.EmailField(required=True)
+
+    password = serializers.CharField(
+        write_only=True, required=True, validators=[validate_password]
+    )
+
+    # Cantidad de registros por consulta o inserción
+    batch_size = 1000
+
+    # Grupo asignado a los usuarios registrados
+    group_name = 'Usuario'
+
+    class Meta:
+        model = User
+        fields = ('username', 'email', 'password', 'first_name', 'last_name')
+        # La unicidad del usuario se valida para todo el lote
+        extra_kwargs = {
+            'username': {
+                'validators': User._meta.get_field('username').validators,
+            },
+        }
+
+    @classmethod
+    def existing(cls, field, values):
+        """!
+        Método que consulta por bloques los valores del campo que ya existen
+
+        @author William Páez (paez.william8 at gmail.com)
+        @return set con los valores existentes
+        """
+
+        values = list(values)
+        found = set()
+        for i in range(0, len(values), cls.batch_size):
+            found.update(User.objects.filter(
+                **{'%s__in' % field: values[i:i + cls.batch_size]}
+            ).values_list(field, flat=True))
+        return found
+
+    @classmethod
+    def write(cls, users, group):
+        """!
+        Método que inserta los usuarios y su grupo en una transacción
+
+        @author William Páez (paez.william8 at gmail.com)
+        @raise IntegrityError si otra petición registró alguno de los usuarios
+        """
+
+        through = User.groups.through
+        with transaction.atomic():
+            User.objects.bulk_create(users, batch_size=cls.batch_size)
+            if any(user.pk is None for user in users):
+                # Motores que no devuelven los ids insertados
+                ids = dict(User.objects.filter(
+                    username__in=[user.username for user in users]
+                ).values_list('username', 'pk'))
+                for user in users:
+                    user.pk = ids[user.username]
+            through.objects.bulk_create(
+                [through(user_id=user.pk, group_id=group.pk) for user in users],
+                batch_size=cls.batch_size,
+            )
+
+    @classmethod
+    def bulk_save(cls, records, workers=None):
+        """!
+        Método que registra los usuarios de un lote sin abortar por los
+        registros inválidos
+
+        @author William Páez (paez.william8 at gmail.com)
+        @param records <b>{list}</b> Registros con los campos del usuario
+        @param workers <b>{int}</b> Hilos para los hash, por defecto uno por
+            núcleo
+        @return dict con la cantidad de creados y los errores por índice del
+            registro
+        """
+
+        errors = {}
+        rows = {}
+        for index, record in enumerate(records):
+            serializer = cls(data=record)
+            if serializer.is_valid():
+                rows[index] = serializer.validated_data
+            else:
+                errors[index] = serializer.errors
+
+        # Usuarios y correos repetidos dentro del lote o ya registrados
+        usernames = cls.existing(
+            'username', {data['username'] for data in rows.values()}
+        )
+        emails = cls.existing(
+            'email', {data['email'] for data in rows.values()}
+        )
+        for index, data in list(rows.items()):
+            error = {}
+            if data['username'] in usernames:
+                error['username'] = ['Ya existe un usuario con este nombre.']
+            if data['email'] in emails:
+                error['email'] = ['Ya existe un usuario con este correo.']
+            usernames.add(data['username'])
+            emails.add(data['email'])
+            if error:
+                errors[index] = error
+                del rows[index]
+
+        group = Group.objects.get(name=cls.group_name)
+        passwords = hashing.make_passwords(
+            [data['password'] for data in rows.values()], workers
+        )
+        users = [
+            User(
+                username=data['username'],
+                email=data['email'],
+                first_name=data.get('first_name', ''),
+                last_name=data.get('last_name', ''),
+                password=password,
+            )
+            for data, password in zip(rows.values(), passwords)
+        ]
+        indexes = {data['username']: index for index, data in rows.items()}
+        while True:
+            try:
+                cls.write(users, group)
+                break
+            except IntegrityError:
+                # Otra petición registró alguno de los usuarios o correos
+                # después de la consulta; esos se informan y se reintenta
+                usernames = cls.existing(
+                    'username', [user.username for user in users]
+                )
+                emails = cls.existing('email', [user.email for user in users])
+                remaining = []
+                for user in users:
+                    error = {}
+                    if user.username in usernames:
+                        error['username'] = [
+                            'Ya existe un usuario con este nombre.'
+                        ]
+                    if user.email in emails:
+                        error['email'] = [
+                            'Ya existe un usuario con este correo.'
+                        ]
+                    if error:
+                        errors[indexes[user.username]] = error
+                    else:
+                        user.pk = None
+                        remaining.append(user)
+                if len(remaining) == len(users):
+                    raise
+                users = remaining
+
+        return {
+            'created': len(users),
+            'errors': [
+                {'index': index, 'errors': errors[index]}
+                for index in sorted(errors)
+            ],
+        }
+
+
 class PasswordChangeSerializer(serializers.ModelSerializer):
     """!
     Clase que permite actualizar la contraseña
@@ -157,14 +349,14 @@ class PasswordChangeSerializer(serializers.ModelSerializer):
 
     def validate_old_password(self, value):
         user = self.context['user']
-        if not user.check_password(value):
+        if not hashing.check_password(user, value):
             raise serializers.ValidationError(
                 {'old_password': 'Old password is not correct'}
             )
         return value
 
     def update(self, instance, validated_data):
-        instance.set_password(validated_data['password'])
+        hashing.set_password(instance, validated_data['password'])
         instance.save()
         return instance
 
@@ -249,7 +441,7 @@ class PasswordResetSerializer(serializers.Serializer):
 
     email = serializers.EmailField(required=True)
 
-    def send_mail(
+    def enqueue_mail(
         self,
         subject_template_name,
         email_template_name,
@@ -259,8 +451,9 @@ class PasswordResetSerializer(serializers.Serializer):
         html_email_template_name=None,
     ):
         """!
-        Método que envía un correo
-        
+        Método que arma un correo para la tabla outbox, sin guardarlo; el
+        comando send_outbox lo envía
+
         @author William Páez (paez.william8 at gmail.com)
         """
 
@@ -268,13 +461,17 @@ class PasswordResetSerializer(serializers.Serializer):
         # Email subject *must not* contain newlines
         subject = "".join(subject.splitlines())
         body = loader.render_to_string(email_template_name, context)
-
-        email_message = EmailMultiAlternatives(subject, body, from_email, [to_email])
+        html_body = ''
         if html_email_template_name is not None:
-            html_email = loader.render_to_string(html_email_template_name, context)
-            email_message.attach_alternative(html_email, "text/html")
-
-        email_message.send()
+            html_body = loader.render_to_string(html_email_template_name, context)
+
+        return OutboxEmail(
+            subject=subject,
+            body=body,
+            html_body=html_body,
+            from_email=from_email or '',
+            to_email=to_email,
+        )
 
     def get_users(self, email):
         """!
@@ -316,6 +513,7 @@ class PasswordResetSerializer(serializers.Serializer):
         site_name = current_site.name
         domain = current_site.domain
         email_field_name = UserModel.get_email_field_name()
+        emails = []
         for user in self.get_users(email):
             user_email = getattr(user, email_field_name)
             context = {
@@ -328,7 +526,7 @@ class PasswordResetSerializer(serializers.Serializer):
                 "protocol": "https" if use_https else "http",
                 **(extra_email_context or {}),
             }
-            self.send_mail(
+            message = self.enqueue_mail(
                 subject_template_name,
                 email_template_name,
                 context,
@@ -336,6 +534,15 @@ class PasswordResetSerializer(serializers.Serializer):
                 user_email,
                 html_email_template_name=html_email_template_name,
             )
+            # Un correo aún pendiente basta, así repetir la petición no
+            # multiplica los envíos; los que agotaron los intentos no cuentan
+            if not OutboxEmail.objects.filter(
+                to_email=user_email, subject=message.subject,
+                sent_at__isnull=True,
+                attempts__lt=getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8),
+            ).exists():
+                emails.append(message)
+        OutboxEmail.objects.bulk_create(emails)
         return email
 
 
@@ -365,6 +572,6 @@ class SetPasswordSerializer(serializers.Serializer):
 
     def create(self, validated_data):
         user = self.context['user']
-        user.set_password(validated_data['new_password1'])
+        hashing.set_password(user, validated_data['new_password1'])
         user.save()
         return user
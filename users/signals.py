@@ -0,0 +1,152 @@
+from django.contrib.auth.models import Group, User
+from django.db import connections, transaction
+from django.db.models import Index
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from .authentication import bump_epochs
+from .tokens import blacklist, bump_version
+
+# Índices de auth_user para los filtros de UserViewset. El modelo pertenece a
+# django.contrib.auth, por lo que no se pueden declarar en su Meta
+USER_INDEXES = (
+    Index(fields=['first_name'], name='auth_user_first_name_idx'),
+    Index(fields=['last_name'], name='auth_user_last_name_idx'),
+)
+
+
+@receiver(post_migrate)
+def create_user_indexes(sender, using='default', **kwargs):
+    """!
+    Función que crea los índices de auth_user que falten después de migrar
+    la app users
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if sender.name != 'users':
+        return
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        existing = connection.introspection.get_constraints(
+            cursor, User._meta.db_table
+        )
+    with connection.schema_editor() as editor:
+        for index in USER_INDEXES:
+            if index.name not in existing:
+                editor.add_index(User, index)
+
+
+def get_group_users(group_ids):
+    return User.groups.through.objects.filter(
+        group_id__in=group_ids
+    ).values_list('user_id', flat=True)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def user_permissions_changed(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """!
+    Función que revoca los tokens de acceso de los usuarios cuyos grupos o
+    permisos cambiaron
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_epochs([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # instance es el grupo o el permiso y pk_set los usuarios
+        bump_epochs(pk_set)
+    elif action == 'pre_clear':
+        field = 'group_id' if isinstance(instance, Group) else 'permission_id'
+        bump_epochs(sender.objects.filter(
+            **{field: instance.pk}
+        ).values_list('user_id', flat=True))
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def group_permissions_changed(
+    sender, instance, action, reverse, pk_set, **kwargs
+):
+    """!
+    Función que revoca los tokens de acceso de los usuarios de los grupos
+    cuyos permisos cambiaron
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            bump_epochs(get_group_users([instance.pk]))
+    elif action in ('post_add', 'post_remove'):
+        # instance es el permiso y pk_set los grupos
+        bump_epochs(get_group_users(pk_set))
+    elif action == 'pre_clear':
+        bump_epochs(get_group_users(sender.objects.filter(
+            permission_id=instance.pk
+        ).values_list('group_id', flat=True)))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, instance, **kwargs):
+    """!
+    Función que revoca los tokens de acceso al modificar o eliminar el
+    usuario, salvo cuando solo se actualiza el último inicio de sesión
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    update_fields = kwargs.get('update_fields')
+    if kwargs.get('created') or (
+        update_fields and set(update_fields) <= {'last_login'}
+    ):
+        return
+    bump_epochs([instance.pk])
+
+
+@receiver(pre_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    # La eliminación en cascada de los usuarios del grupo no envía m2m_changed
+    bump_epochs(get_group_users([instance.pk]))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def token_blacklisted(sender, instance, created, **kwargs):
+    """!
+    Función que agrega el token al filtro de la lista negra del proceso y
+    avisa a los demás procesos al confirmar la transacción
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    if created:
+        jti = instance.token.jti
+
+        def commit():
+            blacklist.add(jti)
+            bump_version()
+
+        transaction.on_commit(commit)
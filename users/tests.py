@@ -1,3 +1,656 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.hashers import MD5PasswordHasher, PBKDF2PasswordHasher
+from django.contrib.auth.models import Group, Permission, User
+from django.contrib.auth.signals import user_logged_in, user_login_failed
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import (
+    BlacklistedToken,
+    OutstandingToken,
+)
+
+from base.tests import QueryPlanMixin
+
+from . import hashing, views
+from .hashing import HashingPool
+from .models import OutboxEmail
+from .outbox import send_batch
+from .permissions import get_permissions
+from .tokens import BlacklistFilter, RefreshToken
+from .utils import JwtToken
+
+
+class QueryPlanTest(QueryPlanMixin, TestCase):
+    """!
+    Clase que verifica que los filtros de UserViewset usan índices
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def test_filters(self):
+        self.assertFiltersUseIndexes(views)
+
+
+class ClaimsAuthenticationTest(TestCase):
+    """!
+    Clase que verifica que los tokens de acceso se revocan al cambiar los
+    permisos del usuario y que users/refresh/ emite uno nuevo
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            'usuario', 'usuario@email.com', 'usuario12345'
+        )
+        self.permission = Permission.objects.get(
+            content_type__app_label='auth', codename='view_user'
+        )
+        self.user.user_permissions.add(self.permission)
+        self.tokens = JwtToken(self.user)
+        self.client = APIClient()
+
+    def get_users(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer %s' % token)
+        return self.client.get('/api/users/')
+
+    def refresh(self, data):
+        self.client.credentials()
+        return self.client.post('/api/users/refresh/', data, format='json')
+
+    def test_valid_token(self):
+        self.assertEqual(self.get_users(self.tokens['token']).status_code, 200)
+
+    def test_permission_change_rejects_token(self):
+        self.user.user_permissions.remove(self.permission)
+        response = self.get_users(self.tokens['token'])
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.data['code'], 'token_not_valid')
+
+    def test_group_change_rejects_token(self):
+        self.user.groups.create(name='Grupo')
+        self.assertEqual(self.get_users(self.tokens['token']).status_code, 401)
+
+    def test_cache_miss_keeps_token(self):
+        # La época está en la base de datos, no solo en la caché
+        cache.clear()
+        self.assertEqual(self.get_users(self.tokens['token']).status_code, 200)
+        self.user.user_permissions.remove(self.permission)
+        cache.clear()
+        self.assertEqual(self.get_users(self.tokens['token']).status_code, 401)
+
+    def test_deleted_user_rejects_token(self):
+        self.user.delete()
+        self.assertEqual(self.get_users(self.tokens['token']).status_code, 401)
+
+    def test_refresh(self):
+        self.user.user_permissions.remove(self.permission)
+        self.user.user_permissions.add(self.permission)
+        response = self.refresh({'refresh_token': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.user.pk)
+        self.assertEqual(self.get_users(response.data['token']).status_code, 200)
+
+    def test_refresh_without_permission(self):
+        self.user.user_permissions.remove(self.permission)
+        response = self.refresh({'refresh_token': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_users(response.data['token']).status_code, 403)
+
+    def test_refresh_missing_token(self):
+        self.assertEqual(self.refresh({}).status_code, 400)
+
+    def test_refresh_invalid_token(self):
+        self.assertEqual(self.refresh({'refresh_token': 'abcd'}).status_code, 401)
+
+    def test_refresh_without_user_claim(self):
+        token = RefreshToken()
+        self.assertEqual(self.refresh({'refresh_token': str(token)}).status_code, 401)
+
+    def test_refresh_inactive_user(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.refresh({'refresh_token': self.tokens['refresh']})
+        self.assertEqual(response.status_code, 401)
+
+
+class SharedPermissionsTest(TestCase):
+    """!
+    Clase que verifica que los permisos guardados en la caché compartida se
+    descartan al cambiar los permisos o grupos del usuario
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            'usuario', 'usuario@email.com', 'usuario12345'
+        )
+        self.group = Group.objects.create(name='Grupo')
+        self.view = Permission.objects.get(
+            content_type__app_label='auth', codename='view_user'
+        )
+        self.change = Permission.objects.get(
+            content_type__app_label='auth', codename='change_user'
+        )
+
+    def get_permissions(self):
+        # Cada petición carga un usuario nuevo, sin la copia de la anterior
+        return get_permissions(User.objects.get(pk=self.user.pk))
+
+    def test_cached(self):
+        self.user.user_permissions.add(self.view)
+        self.assertEqual(self.get_permissions(), {'auth.view_user'})
+        with self.assertNumQueries(0):
+            get_permissions(User(pk=self.user.pk, is_active=True))
+
+    def test_user_permissions(self):
+        self.assertEqual(self.get_permissions(), set())
+        self.user.user_permissions.add(self.view)
+        self.assertEqual(self.get_permissions(), {'auth.view_user'})
+        self.view.user_set.remove(self.user)
+        self.assertEqual(self.get_permissions(), set())
+
+    def test_groups(self):
+        self.group.permissions.add(self.view)
+        self.assertEqual(self.get_permissions(), set())
+        self.group.user_set.add(self.user)
+        self.assertEqual(self.get_permissions(), {'auth.view_user'})
+        self.user.groups.clear()
+        self.assertEqual(self.get_permissions(), set())
+
+    def test_group_permissions(self):
+        self.user.groups.add(self.group)
+        self.assertEqual(self.get_permissions(), set())
+        self.group.permissions.add(self.view)
+        self.assertEqual(self.get_permissions(), {'auth.view_user'})
+        self.change.group_set.add(self.group)
+        self.assertEqual(
+            self.get_permissions(), {'auth.view_user', 'auth.change_user'}
+        )
+        self.view.group_set.clear()
+        self.assertEqual(self.get_permissions(), {'auth.change_user'})
+        self.group.delete()
+        self.assertEqual(self.get_permissions(), set())
+
+    def test_warm_permissions(self):
+        self.user.user_permissions.add(self.view)
+        call_command('warm_permissions', stdout=StringIO())
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                get_permissions(User(pk=self.user.pk, is_active=True)),
+                {'auth.view_user'},
+            )
+        self.user.user_permissions.add(self.change)
+        self.assertEqual(
+            self.get_permissions(), {'auth.view_user', 'auth.change_user'}
+        )
+
+
+class BlacklistFilterTest(TestCase):
+    """!
+    Clase que verifica que un token de refresco revocado en un proceso se
+    rechaza en los demás y que purge_tokens elimina los expirados
+
+    Cada instancia de BlacklistFilter hace las veces del filtro de otro
+    proceso
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            'usuario', 'usuario@email.com', 'usuario12345'
+        )
+
+    def create_token(self):
+        token = RefreshToken.for_user(self.user)
+        return token, token['jti']
+
+    def blacklist(self, token):
+        with self.captureOnCommitCallbacks(execute=True):
+            token.blacklist()
+
+    @mock.patch('users.tokens.is_shared_cache', return_value=True)
+    def test_shared_cache(self, shared):
+        other = BlacklistFilter()
+        token, jti = self.create_token()
+        self.assertNotIn(jti, other)
+        self.blacklist(token)
+        self.assertIn(jti, other)
+
+    def test_process_cache(self):
+        # Sin caché compartida otro proceso no ve la versión nueva
+        other = BlacklistFilter()
+        token, jti = self.create_token()
+        self.assertNotIn(jti, other)
+        token.blacklist()
+        self.assertIn(jti, other)
+        self.assertIsNone(other.bloom)
+
+    @mock.patch('users.tokens.is_shared_cache', return_value=True)
+    def test_late_commit(self, shared):
+        # El id menor se confirma después de que el filtro leyó el mayor
+        first, first_jti = self.create_token()
+        second, second_jti = self.create_token()
+        self.blacklist(first)
+        self.blacklist(second)
+        pending = BlacklistedToken.objects.get(token__jti=first_jti)
+        pending.delete()
+        other = BlacklistFilter()
+        self.assertNotIn(first_jti, other)
+        self.assertIn(second_jti, other)
+        with self.captureOnCommitCallbacks(execute=True):
+            BlacklistedToken.objects.create(
+                pk=pending.pk, token=pending.token
+            )
+        self.assertIn(first_jti, other)
+
+    def test_purge_tokens(self):
+        now = timezone.now()
+        tokens = [self.create_token()[0] for _ in range(5)]
+        expired = [token['jti'] for token in tokens[:3]]
+        OutstandingToken.objects.filter(jti__in=expired).update(
+            expires_at=now - timedelta(seconds=1)
+        )
+        for token in tokens[1:4]:
+            token.blacklist()
+        call_command('purge_tokens', batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            set(OutstandingToken.objects.values_list('jti', flat=True)),
+            {token['jti'] for token in tokens[3:]},
+        )
+        self.assertEqual(
+            list(BlacklistedToken.objects.values_list(
+                'token__jti', flat=True
+            )),
+            [tokens[3]['jti']],
+        )
+
+
+class HashingPoolTest(TestCase):
+    """!
+    Clase que verifica que el login responde 503 con Retry-After cuando el
+    pool de hashing está lleno y que la actualización del hash no ocupa otro
+    lugar del pool
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'usuario', 'usuario@email.com', 'usuario12345'
+        )
+        # Un solo lugar, sin cola
+        self.pool = HashingPool(1, 0)
+        patcher = mock.patch.object(hashing, 'pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, password='usuario12345'):
+        return APIClient().post('/api/users/login/', {
+            'username': 'usuario', 'password': password,
+        }, format='json')
+
+    def test_busy(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def wait():
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=self.pool.run, args=(wait,))
+        thread.start()
+        started.wait()
+        try:
+            response = self.login()
+        finally:
+            release.set()
+            thread.join()
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertEqual(self.login().status_code, 201)
+
+    def test_outdated_hash(self):
+        hasher = PBKDF2PasswordHasher()
+        self.user.password = hasher.encode(
+            'usuario12345', hasher.salt(), iterations=1000
+        )
+        self.user.save(update_fields=['password'])
+        self.assertEqual(self.login().status_code, 201)
+        self.user.refresh_from_db()
+        self.assertEqual(
+            hasher.decode(self.user.password)['iterations'],
+            hasher.iterations,
+        )
+        self.assertTrue(self.user.check_password('usuario12345'))
+
+    def test_invalid_password(self):
+        self.assertEqual(self.login('otra12345').status_code, 400)
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']
+)
+class LoginTest(TestCase):
+    """!
+    Clase que verifica que el login calcula un solo hash por petición,
+    también cuando el usuario no existe
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'usuario', 'usuario@email.com', 'usuario12345'
+        )
+        self.calls = {'verify': 0, 'encode': 0}
+        for name in self.calls:
+            method = getattr(MD5PasswordHasher, name)
+            patcher = mock.patch.object(
+                MD5PasswordHasher, name, autospec=True,
+                side_effect=self.count(name, method),
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def count(self, name, method):
+        def wrapper(*args, **kwargs):
+            self.calls[name] += 1
+            return method(*args, **kwargs)
+        return wrapper
+
+    def login(self, username='usuario', password='usuario12345'):
+        return APIClient().post('/api/users/login/', {
+            'username': username, 'password': password,
+        }, format='json')
+
+    def test_login(self):
+        logged_in = mock.Mock()
+        user_logged_in.connect(logged_in)
+        self.addCleanup(user_logged_in.disconnect, logged_in)
+        response = self.login('USUARIO@email.com')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['id'], self.user.pk)
+        # MD5PasswordHasher.verify calcula el hash con encode, por lo que un
+        # solo hash es una llamada a cada uno
+        self.assertEqual(self.calls, {'verify': 1, 'encode': 1})
+        self.assertEqual(logged_in.call_args.kwargs['user'], self.user)
+        self.assertEqual(
+            [part.split(';')[0] for part in response['Server-Timing'].split(', ')],
+            ['lookup', 'hash', 'token'],
+        )
+
+    def test_failed(self):
+        failed = mock.Mock()
+        user_login_failed.connect(failed)
+        self.addCleanup(user_login_failed.disconnect, failed)
+        self.assertEqual(self.login(password='otra12345').status_code, 400)
+        self.assertEqual(self.calls, {'verify': 1, 'encode': 1})
+        # Un usuario que no existe también calcula un hash
+        self.assertEqual(self.login('nadie').status_code, 400)
+        self.assertEqual(self.calls, {'verify': 1, 'encode': 2})
+        self.assertEqual(failed.call_count, 2)
+        self.assertIsNotNone(failed.call_args.kwargs['request'])
+        self.assertNotIn('otra12345', str(failed.call_args_list))
+
+    def test_inactive(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.login().status_code, 400)
+        self.assertEqual(self.calls, {'verify': 1, 'encode': 1})
+
+
+@override_settings(
+    PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher']
+)
+class BulkRegisterTest(TestCase):
+    """!
+    Clase que verifica el registro de usuarios en lote por el endpoint y el
+    comando provision_users
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        self.group = Group.objects.create(name='Usuario')
+        self.admin = User.objects.create_superuser(
+            'admin', 'admin@email.com', 'admin12345'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def record(self, i, **kwargs):
+        return {
+            'username': 'usuario%s' % i,
+            'email': 'usuario%s@email.com' % i,
+            'password': 'Clave.12345x',
+            **kwargs,
+        }
+
+    def test_bulk(self):
+        User.objects.create_user('usuario9', 'otro@email.com')
+        response = self.client.post('/api/users/bulk/', [
+            self.record(0, first_name='Ana'),
+            self.record(1, email='correo'),
+            self.record(2, username='usuario0'),
+            self.record(3, email='admin@email.com'),
+            self.record(9),
+            self.record(4),
+        ], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [error['index'] for error in response.data['errors']], [1, 2, 3, 4]
+        )
+        self.assertIn('username', response.data['errors'][1]['errors'])
+        self.assertIn('email', response.data['errors'][2]['errors'])
+        user = User.objects.get(username='usuario0')
+        self.assertEqual(user.first_name, 'Ana')
+        self.assertTrue(user.check_password('Clave.12345x'))
+        self.assertEqual(
+            set(self.group.user_set.values_list('username', flat=True)),
+            {'usuario0', 'usuario4'},
+        )
+
+    def test_admin_only(self):
+        self.client.force_authenticate(User.objects.create_user('usuario'))
+        response = self.client.post(
+            '/api/users/bulk/', [self.record(0)], format='json'
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_concurrent_registration(self):
+        make_passwords = hashing.make_passwords
+
+        def register(passwords, workers=None):
+            # Otra petición registra un usuario después de la validación
+            User.objects.create_user('usuario1', 'otro@email.com')
+            return make_passwords(passwords, workers)
+
+        with mock.patch.object(hashing, 'make_passwords', register):
+            response = self.client.post('/api/users/bulk/', [
+                self.record(0), self.record(1), self.record(2),
+            ], format='json')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'], [{
+            'index': 1,
+            'errors': {'username': ['Ya existe un usuario con este nombre.']},
+        }])
+        self.assertEqual(self.group.user_set.count(), 2)
+
+    def test_provision_users(self):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.unlink, path)
+        with os.fdopen(fd, 'w') as file:
+            file.write('username,email,password,first_name,last_name\n')
+            file.write('usuario0,usuario0@email.com,Clave.12345x,Ana,\n')
+            file.write('usuario1,correo,Clave.12345x,,\n')
+        stdout, stderr = StringIO(), StringIO()
+        call_command(
+            'provision_users', path, workers=1, stdout=stdout, stderr=stderr
+        )
+        self.assertIn('registrados: 1, con errores: 1', stdout.getvalue())
+        self.assertIn('Registro 1', stderr.getvalue())
+        self.assertTrue(User.objects.filter(
+            username='usuario0', first_name='Ana', groups=self.group
+        ).exists())
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    """!
+    Clase del backend de correo que falla en cada envío
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def send_messages(self, messages):
+        raise ConnectionError('Servidor de correo no disponible')
+
+
+class OutboxTest(TestCase):
+    """!
+    Clase que verifica que el reinicio de contraseña solo encola el correo y
+    que send_outbox lo envía, reintenta con espera y purge_outbox lo elimina
+
+    Los tests usan el backend locmem de Django, que guarda los correos en
+    django.core.mail.outbox
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def setUp(self):
+        self.user = User.objects.create_user(
+            'usuario', 'usuario@email.com', 'usuario12345'
+        )
+
+    def reset(self, email='usuario@email.com'):
+        return APIClient().post(
+            '/api/users/reset/password-reset/', {'email': email},
+            format='json',
+        )
+
+    def test_enqueue(self):
+        self.assertEqual(self.reset().status_code, 200)
+        self.assertEqual(mail.outbox, [])
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.to_email, 'usuario@email.com')
+        # Un correo pendiente basta
+        self.reset()
+        self.reset('otro@email.com')
+        self.assertEqual(OutboxEmail.objects.count(), 1)
+
+    def test_send(self):
+        self.reset()
+        stdout = StringIO()
+        call_command('send_outbox', stdout=stdout)
+        self.assertIn('Correos enviados: 1, fallidos: 0', stdout.getvalue())
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['usuario@email.com'])
+        self.assertIsNotNone(OutboxEmail.objects.get().sent_at)
+        self.assertEqual(send_batch(), (0, 0))
+        # Ya enviado, la petición siguiente encola otro
+        self.reset()
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+    def test_lease(self):
+        self.reset()
+        due = []
+
+        class Backend(BaseEmailBackend):
+            def send_messages(backend, messages):
+                # Mientras se envía ningún worker puede tomar el correo
+                due.append(OutboxEmail.objects.filter(
+                    next_attempt_at__lte=timezone.now()
+                ).count())
+                return len(messages)
+
+        with mock.patch('users.outbox.get_connection', lambda path: Backend()):
+            self.assertEqual(send_batch(), (1, 0))
+        self.assertEqual(due, [0])
+
+    @override_settings(
+        OUTBOX_EMAIL_BACKEND='users.tests.FailingEmailBackend',
+        OUTBOX_RETRY_DELAY=60, OUTBOX_MAX_ATTEMPTS=2,
+    )
+    def test_backoff(self):
+        self.reset()
+        start = timezone.now()
+        self.assertEqual(send_batch(), (0, 1))
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('no disponible', email.last_error)
+        self.assertGreaterEqual(
+            email.next_attempt_at, start + timedelta(seconds=60)
+        )
+        # No se reintenta antes de tiempo
+        self.assertEqual(send_batch(), (0, 0))
+        OutboxEmail.objects.update(next_attempt_at=start)
+        self.assertEqual(send_batch(), (0, 1))
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 2)
+        self.assertGreaterEqual(
+            email.next_attempt_at, start + timedelta(seconds=120)
+        )
+        # Agotó los intentos: no se envía y no impide encolar otro
+        OutboxEmail.objects.update(next_attempt_at=start)
+        self.assertEqual(send_batch(), (0, 0))
+        self.reset()
+        self.assertEqual(OutboxEmail.objects.count(), 2)
+
+    @override_settings(OUTBOX_RETENTION=60, OUTBOX_MAX_ATTEMPTS=2)
+    def test_purge(self):
+        old = timezone.now() - timedelta(seconds=120)
+        emails = OutboxEmail.objects.bulk_create([
+            OutboxEmail(subject='enviado', to_email='a@email.com', sent_at=old),
+            OutboxEmail(
+                subject='reciente', to_email='a@email.com',
+                sent_at=timezone.now(),
+            ),
+            OutboxEmail(subject='agotado', to_email='a@email.com', attempts=2),
+            OutboxEmail(subject='pendiente', to_email='a@email.com', attempts=1),
+        ])
+        OutboxEmail.objects.filter(
+            pk__in=[email.pk for email in emails]
+        ).update(created_at=old)
+        stdout = StringIO()
+        call_command('purge_outbox', batch_size=1, stdout=stdout)
+        self.assertIn('2 correos eliminados', stdout.getvalue())
+        self.assertEqual(
+            set(OutboxEmail.objects.values_list('subject', flat=True)),
+            {'reciente', 'pendiente'},
+        )
@@ -0,0 +1,184 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Max, Q
+from django.utils import timezone
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken as BaseRefreshToken
+
+from .authentication import is_shared_cache
+
+VERSION_KEY = 'users:blacklist:version'
+
+# Ids por debajo del último leído que se vuelven a consultar si faltaban,
+# porque su transacción pudo confirmarse después que la de un id mayor
+GAP_WINDOW = 1000
+
+
+class BloomFilter:
+    """!
+    Clase del filtro de Bloom: responde si una clave puede estar en el
+    conjunto, sin falsos negativos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        # Doble hashing: las k posiciones salen de dos enteros de 64 bits
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self.positions(key)
+        )
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_version():
+    cache.set(VERSION_KEY, max(int(time.time() * 1000), get_version() + 1), None)
+
+
+class BlacklistFilter:
+    """!
+    Clase que guarda en memoria un filtro de Bloom con los jti de los tokens
+    de refresco en la lista negra que aún no expiraron
+
+    Si el jti no está en el filtro no está en la lista negra y no se consulta
+    la base de datos; si está, se confirma con una consulta. Cuando otro
+    proceso agrega un token cambia la versión en la caché y el filtro lee los
+    ids mayores al último leído y los que faltaban por debajo de él. Cada
+    BLACKLIST_FILTER_REBUILD segundos se reconstruye completo para descartar
+    los expirados. Con una caché propia de cada proceso los demás no ven el
+    cambio de versión, por lo que el filtro no se usa y siempre se consulta
+    la base de datos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def __init__(self):
+        self.bloom = None
+        self.version = None
+        self.last_id = 0
+        self.gaps = set()
+        self.built_at = 0
+        self.lock = threading.Lock()
+
+    def build(self):
+        """!
+        Método que arma el filtro con todos los tokens vigentes
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        version = get_version()
+        last = BlacklistedToken.objects.aggregate(last=Max('pk'))['last'] or 0
+        start = max(last - GAP_WINDOW, 0)
+        gaps = set(range(start + 1, last)) - set(
+            BlacklistedToken.objects.filter(
+                pk__gt=start, pk__lt=last
+            ).values_list('pk', flat=True)
+        )
+        jtis = BlacklistedToken.objects.filter(
+            token__expires_at__gt=timezone.now()
+        ).values_list('token__jti', flat=True)
+        capacity = getattr(settings, 'BLACKLIST_FILTER_CAPACITY', 100000)
+        count = jtis.count()
+        bloom = BloomFilter(max(capacity, 2 * count))
+        for jti in jtis.iterator(chunk_size=5000):
+            bloom.add(jti)
+        self.bloom, self.version = bloom, version
+        self.last_id, self.gaps = last, gaps
+        self.built_at = time.monotonic()
+
+    def sync(self):
+        """!
+        Método que agrega los tokens que otros procesos pusieron en la lista
+        negra desde la última sincronización
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        version = get_version()
+        seen = set()
+        for pk, jti in BlacklistedToken.objects.filter(
+            Q(pk__gt=self.last_id) | Q(pk__in=self.gaps)
+        ).values_list('pk', 'token__jti'):
+            self.bloom.add(jti)
+            seen.add(pk)
+        last = max(seen | {self.last_id})
+        self.gaps = {
+            pk for pk in self.gaps | set(range(self.last_id + 1, last))
+            if pk > last - GAP_WINDOW
+        } - seen
+        self.version, self.last_id = version, last
+
+    def add(self, jti):
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+    def __contains__(self, jti):
+        if is_shared_cache():
+            with self.lock:
+                rebuild = getattr(settings, 'BLACKLIST_FILTER_REBUILD', 60 * 60)
+                if (
+                    self.bloom is None
+                    or time.monotonic() - self.built_at > rebuild
+                ):
+                    self.build()
+                elif self.version != get_version():
+                    self.sync()
+                if jti not in self.bloom:
+                    return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+# Filtro compartido por el proceso
+blacklist = BlacklistFilter()
+
+
+class RefreshToken(BaseRefreshToken):
+    """!
+    Clase del token de refresco que consulta la lista negra con el filtro en
+    memoria, por lo que el caso común de un token vigente no consulta la base
+    de datos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    def check_blacklist(self):
+        if self.payload[api_settings.JTI_CLAIM] in blacklist:
+            raise TokenError('Token is blacklisted')
@@ -1,7 +1,9 @@
 from django.contrib.auth import get_user_model
 from django.core.exceptions import ValidationError
 from django.utils.http import urlsafe_base64_decode
-from rest_framework_simplejwt.tokens import RefreshToken
+
+from .authentication import add_claims
+from .tokens import RefreshToken
 
 UserModel = get_user_model()
 
@@ -10,10 +12,25 @@ def JwtToken(user=None):
     token = RefreshToken.for_user(user)
     return {
         'refresh': str(token),
-        'token': str(token.access_token),
+        'token': str(add_claims(token.access_token, user)),
         'id': user.pk
     }
 
+def server_timing(timings):
+    """!
+    Función que arma el encabezado Server-Timing con la duración de cada fase
+    en milisegundos
+
+    @author William Páez (paez.william8 at gmail.com)
+    @copyright <a href='http://www.gnu.org/licenses/gpl-2.0.html'>
+        GNU Public License versión 2 (GPLv2)</a>
+    """
+
+    return ', '.join(
+        '%s;dur=%.1f' % (name, duration) for name, duration in timings.items()
+    )
+
+
 def get_user(uidb64):
         try:
             # urlsafe_base64_decode() decodes to bytestring
@@ -1,10 +1,15 @@
-from django.contrib.auth import authenticate, login
+import time
+
+from django.conf import settings
+from django.contrib.auth import login
 from django.contrib.auth.models import User
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
 from .serializers import (
+    BulkRegisterSerializer,
     LoginSerializer,
     RegisterSerializer,
     PasswordChangeSerializer,
@@ -12,7 +17,9 @@ from .serializers import (
     SetPasswordSerializer,
     UserSerializer,
 )
-from .utils import JwtToken, get_user
+from .authentication import add_claims
+from .tokens import RefreshToken
+from .utils import JwtToken, get_user, server_timing
 from django.core.exceptions import ImproperlyConfigured
 from django.contrib.auth.tokens import default_token_generator
 
@@ -52,16 +59,20 @@ class UserViewset(viewsets.ModelViewSet):
                 },
                 status=400
             )
-        data = request.data
-        username = data.get('username')
-        password = data.get('password')
-        serializer = self.serializer_class(data=request.data)
+        serializer = self.serializer_class(
+            data=request.data, context={'request': request}
+        )
         serializer.is_valid(raise_exception=True)
         user = serializer.validated_data['user']
-        user_auth = authenticate(request, username=username, password=password)
-        if user is not None:
-            login(request, user_auth)
-        return Response(JwtToken(user), status=201)
+        # La contraseña ya se verificó en el serializer, por lo que no se
+        # llama a authenticate(), que volvería a calcular el hash
+        login(request, user, backend=settings.AUTHENTICATION_BACKENDS[0])
+        start = time.perf_counter()
+        data = JwtToken(user)
+        serializer.timings['token'] = (time.perf_counter() - start) * 1000
+        response = Response(data, status=201)
+        response['Server-Timing'] = server_timing(serializer.timings)
+        return response
 
     @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def logout(self, request):
@@ -80,6 +91,43 @@ class UserViewset(viewsets.ModelViewSet):
             print(error)
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
+    @action(
+        detail=False, methods=['post'], permission_classes=[permissions.AllowAny]
+    )
+    def refresh(self, request):
+        """!
+        Función que emite un nuevo token de acceso, con los permisos actuales
+        del usuario, a partir del token de refresco
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        refresh_token = request.data.get('refresh_token')
+        if not refresh_token:
+            return Response(
+                {'refresh_token': ['Este campo es requerido.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            token = RefreshToken(refresh_token)
+        except TokenError as error:
+            return Response(
+                {'detail': str(error)}, status=status.HTTP_401_UNAUTHORIZED
+            )
+        user_id = token.get(api_settings.USER_ID_CLAIM)
+        user = user_id is not None and User.objects.filter(
+            pk=user_id, is_active=True
+        ).first()
+        if not user:
+            return Response(
+                {'detail': 'Usuario no encontrado o inactivo.'},
+                status=status.HTTP_401_UNAUTHORIZED
+            )
+        return Response({
+            'token': str(add_claims(token.access_token, user)),
+            'id': user.pk,
+        }, status=status.HTTP_200_OK)
+
     @action(
         detail=False, methods=['post'], serializer_class=RegisterSerializer,
         permission_classes=[permissions.AllowAny]
@@ -96,6 +144,38 @@ class UserViewset(viewsets.ModelViewSet):
         serializer.save()
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(
+        detail=False, methods=['post'], serializer_class=BulkRegisterSerializer,
+        permission_classes=[permissions.IsAdminUser]
+    )
+    def bulk(self, request):
+        """!
+        Función que registra usuarios en lote, solo para administradores
+
+        @author William Páez (paez.william8 at gmail.com)
+        """
+
+        records = request.data
+        if not isinstance(records, list):
+            return Response(
+                {'detail': 'Se esperaba una lista de usuarios.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_records = getattr(settings, 'USERS_BULK_MAX_RECORDS', 10000)
+        if len(records) > max_records:
+            return Response(
+                {'detail': 'El lote no puede superar %s usuarios.' % max_records},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        result = self.serializer_class.bulk_save(records)
+        return Response(
+            result,
+            status=(
+                status.HTTP_207_MULTI_STATUS if result['errors']
+                else status.HTTP_201_CREATED
+            )
+        )
+
     @action(
         detail=False, methods=['put'], serializer_class=PasswordChangeSerializer,
         permission_classes=[permissions.IsAuthenticated],
@@ -108,13 +188,14 @@ class UserViewset(viewsets.ModelViewSet):
         @author William Páez (paez.william8 at gmail.com)
         """
 
-        user = request.user
+        # request.user puede ser el usuario del token, sin base de datos
+        user = User.objects.get(pk=request.user.pk)
         serializer = self.serializer_class(
             data=request.data,
             context={'user': user}
         )
         serializer.is_valid(raise_exception=True)
-        serializer.update(request.user, request.data)
+        serializer.update(user, request.data)
         return Response(status=status.HTTP_200_OK)
 
     @action(